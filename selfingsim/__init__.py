@@ -12,6 +12,8 @@ from __future__ import unicode_literals
 import argparse
 
 from . import simulate
+from . import sweep
+from . import coalescent
 from . import convert
 from . import sample
 from . import analyze
@@ -23,6 +25,8 @@ def run():
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers()
     simulate.setup_command_line(subparsers)
+    sweep.setup_command_line(subparsers)
+    coalescent.setup_command_line(subparsers)
     convert.setup_command_line(subparsers)
     sample.setup_command_line(subparsers)
     analyze.setup_command_line(subparsers)
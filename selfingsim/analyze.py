@@ -11,9 +11,16 @@ from __future__ import unicode_literals
 
 # standard imports
 import argparse
+import functools
+import glob
+import multiprocessing
+import sys
+
+import numpy as np
 
 # within-package imports
 from . import data
+from . import utils
 
 def run():
     """
@@ -32,21 +39,195 @@ def setup_command_line(subparsers):
     # setup shared command line argument
     sharedparser = argparse.ArgumentParser(add_help=False)
     sharedparser.add_argument(
-        "samplefile",
+        "samplefiles",
         type=str,
-        help="file containing samples (output of (sub)sample command")
+        nargs="+",
+        help="files containing samples (output of (sub)sample command), or quoted "
+             "glob patterns of such files")
     sharedparser.add_argument(
         "--with-header",
         action="store_true",
         help="set this flag to print headder line")
+    sharedparser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of files analyzed in parallel (default: 1)")
 
     # setup command line arguments for indiviudal subcommands
     subparser = subparsers.add_parser("inbcoeff", parents=[sharedparser])
+    subparser.add_argument(
+        "--ci",
+        choices=["bootstrap", "jackknife"],
+        help="report confidence intervals of overall Fis by this resampling method "
+             "instead of per-locus statistics")
+    subparser.add_argument(
+        "--resample",
+        choices=["loci", "individuals"],
+        default="loci",
+        help="unit of resampling for confidence intervals (default: loci)")
+    subparser.add_argument(
+        "--replicates",
+        type=int,
+        default=1000,
+        help="number of bootstrap resamples (default: 1000)")
+    subparser.add_argument(
+        "--level",
+        type=float,
+        default=0.95,
+        help="confidence level (default: 0.95)")
+    subparser.add_argument(
+        "--seed",
+        type=int,
+        help="seed of bootstrap resampling (default: random)")
     subparser.set_defaults(func=inbcoeff)
 
     subparser = subparsers.add_parser("inbtime", parents=[sharedparser])
     subparser.set_defaults(func=inbtime)
 
+    subparser = subparsers.add_parser("selfing", parents=[sharedparser])
+    subparser.add_argument(
+        "--level",
+        type=float,
+        default=0.95,
+        help="confidence level (default: 0.95)")
+    subparser.set_defaults(func=selfing)
+
+def expand(patterns):
+    """
+    Returns files matching glob patterns in the order of patterns.
+
+    Files matching a pattern are sorted, and a pattern matching no file is kept
+    as it is, so that it is reported as a missing file.
+    """
+    fnames = []
+    for pattern in patterns:
+        fnames.extend(sorted(glob.glob(pattern)) or [pattern])
+    return fnames
+
+def inbcoeff_rows(fname):
+    """
+    Returns rows of inbreeding coefficients, Fis, and other related statistics
+    of a sample for each locus as well as overall.
+    """
+    sample = data.createsample(fname)
+    coeffs = sample.inbreedingcoefficient()
+    src = sample.source
+
+    return ["{}\t{}\t{}\t{}\t{}\t{}\t{}".
+            format(
+                src,
+                entry["key"],
+                entry["hobs"],
+                entry["hexp"],
+                entry["fis"],
+                entry["fisc"],
+                entry["nalleles"]) for entry in coeffs]
+
+def inbci_rows(fname, method, over, nrep, level, seed):
+    """
+    Returns rows of confidence intervals of overall inbreeding coefficients of
+    a sample.
+
+    Resampling is seeded from `seed` and the file, so results do not depend on
+    which worker analyzes the file.
+    """
+    sample = data.createsample(fname)
+    rng = np.random.RandomState(utils.derive_seed(seed, fname))
+    intervals = sample.confidenceinterval(method, over, nrep, level, rng)
+    src = sample.source
+
+    names = {"fis": "Fis", "fisc": "Fis.corrected"}
+    return ["{}\t{}\t{}\t{}\t{}\t{}".
+            format(
+                src,
+                names[entry["key"]],
+                entry["estimate"],
+                entry["lower"],
+                entry["upper"],
+                entry["se"]) for entry in intervals]
+
+def inbtime_rows(fname):
+    """
+    Returns rows of numbers of generations until the first outcrossing event
+    of individuals in a sample.
+    """
+    sample = data.createsample(fname)
+    src = sample.source
+
+    return ["{}\tsample.{}\t{}".format(src, i, tselfing)
+            for i, tselfing in zip(sample.ids, sample.tselfing)]
+
+def selfing_rows(fname, level):
+    """
+    Returns a row of the selfing rate of a sample estimated from multilocus
+    heterozygosity.
+    """
+    sample = data.createsample(fname)
+    estimate = sample.selfingrate(level)
+
+    return ["{}\t{}\t{}\t{}\t{}\t{}".
+            format(
+                sample.source,
+                estimate["selfing"],
+                estimate["lower"],
+                estimate["upper"],
+                estimate["loglik"],
+                estimate["nloc"])]
+
+def analyze_file(task):
+    """
+    Analyzes a file, and returns the file, rows of results, and an error message
+    (None on success).
+
+    Errors reported by sys.exit are caught as well, as they would otherwise
+    abort the other files (or leave a pool of workers waiting).
+    """
+    func, fname = task
+    try:
+        return fname, func(fname), None
+    except (Exception, SystemExit) as e:
+        return fname, [], "{}: {}".format(type(e).__name__, e)
+
+def analyze_files(config, func, header):
+    """
+    Analyzes files and prints their results in the order of files.
+
+    Files are analyzed in parallel if requested.  A file failing to be analyzed
+    is reported and skipped, and the command fails after all files are done.
+    """
+    tasks = [(func, fname) for fname in expand(config.samplefiles)]
+
+    if config.with_header:
+        print(header)
+
+    if config.jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(config.jobs)
+        chunksize = max(1, len(tasks) // (4 * config.jobs))
+        try:
+            failed = report(pool.imap(analyze_file, tasks, chunksize))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        failed = report(analyze_file(task) for task in tasks)
+
+    if failed > 0:
+        sys.exit("{} of {} files failed.".format(failed, len(tasks)))
+
+def report(results):
+    """
+    Prints results of files as they finish, and returns the number of failures.
+    """
+    failed = 0
+    for fname, rows, error in results:
+        if error is not None:
+            failed += 1
+            print("failed\t{}\t{}".format(fname, error), file=sys.stderr)
+        for row in rows:
+            print(row)
+    return failed
+
 def inbcoeff(config):
     """
     Computes and prints inbreeding coefficients, Fis, and other related statistics
@@ -54,23 +235,22 @@ def inbcoeff(config):
 
     Other statistics are observed and expected heterozygosities, bias-corrected
     inbreeding coefficients, and number of alleles.
+
+    If a resampling method is given, confidence intervals of overall Fis and
+    bias-corrected Fis are reported instead, and the seed of resampling is
+    printed to stderr.
     """
-    sample = data.createsample(config.samplefile)
-    coeffs = sample.inbreedingcoefficient()
-    src = sample.source
+    if config.ci is None:
+        analyze_files(config, inbcoeff_rows,
+                      "dataset\tlocus\thetero.obs\thetero.exp\tFis\tFis.corrected\tnumber.of.alleles")
+        return
 
-    if config.with_header:
-        print("dataset\tlocus\thetero.obs\thetero.exp\tFis\tFis.corrected\tnumber.of.alleles")
-    for entry in coeffs:
-        print("{}\t{}\t{}\t{}\t{}\t{}\t{}".
-              format(
-                  src,
-                  entry["key"],
-                  entry["hobs"],
-                  entry["hexp"],
-                  entry["fis"],
-                  entry["fisc"],
-                  entry["nalleles"]))
+    seed = config.seed if config.seed is not None else utils.random_seed()
+    # Resampling is reproduced with the seed given by --seed.
+    print("resampling seed: {}".format(seed), file=sys.stderr)
+    func = functools.partial(inbci_rows, method=config.ci, over=config.resample,
+                             nrep=config.replicates, level=config.level, seed=seed)
+    analyze_files(config, func, "dataset\tstatistic\testimate\tlower\tupper\tse")
 
 def inbtime(config):
     """
@@ -80,13 +260,16 @@ def inbtime(config):
     This statistics are reported per-individual.
     If the most recent mating is outcrossing, this function returns 0.
     """
-    sample = data.createsample(config.samplefile)
-    src = sample.source
+    analyze_files(config, inbtime_rows, "dataset\tsample\tselfing.gen")
 
-    if config.with_header:
-        print("dataset\tsample\tselfing.gen")
-    for i, tselfing in zip(sample.ids, sample.tselfing):
-        print("{}\tsample.{}\t{}".format(src, i, tselfing))
+def selfing(config):
+    """
+    Estimates and prints selfing rates by maximum likelihood from the
+    distribution of multilocus heterozygosity among individuals (the method of
+    RMES), together with their confidence intervals.
+    """
+    analyze_files(config, functools.partial(selfing_rows, level=config.level),
+                  "dataset\tselfing\tlower\tupper\tloglik\tnumber.of.loci")
 
 if __name__ == '__main__':
     run()
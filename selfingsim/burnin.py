@@ -0,0 +1,97 @@
+"""
+selfingsim.burnin
+=================
+
+Shared burn-in of simulations.
+
+Replicates (and points of a sweep) differing only in settings irrelevant to the
+burn-in phase (e.g., the number of generations after burn-in or the output file)
+go through statistically identical burn-in phases.  When "burnin cache" names a
+directory, the population at the end of burn-in is saved there once, and every
+such simulation forks from the saved population with its own random number
+stream instead of repeating the burn-in.
+
+A saved population is keyed by a hash of all settings but those irrelevant to
+burn-in.  The master seed is part of the key, and the burn-in phase itself is
+seeded from the key, so the result of a set of simulations does not depend on
+which of them happens to run the burn-in.
+
+While one simulation runs the burn-in, the others wait for it.  A lock file is
+left behind if the process running burn-in is killed, and it must be removed by
+hand.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import errno
+import hashlib
+import json
+import os
+import time
+
+from . import checkpoint
+from . import utils
+
+# Settings irrelevant to burn-in.
+IRRELEVANT = ('replicate', 'seed', 'resume', 'outfile', 'gens', 'debug', 'output_per',
+              'checkpoint_per', 'burnin_cache')
+
+# Interval (in seconds) between checks for a burn-in run by another simulation.
+POLL = 1.0
+
+
+def get_key(config):
+    """
+    Returns a key identifying the burn-in phase of a simulation.
+    """
+    settings = dict((key, value) for key, value in config._params.items()
+                    if key not in IRRELEVANT)
+    text = json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def get_path(config):
+    """
+    Returns the name of a file holding the population at the end of burn-in.
+    """
+    return os.path.join(config.burnin_cache, get_key(config) + '.burnin')
+
+
+def load(config, build):
+    """
+    Returns a state at the end of burn-in shared by simulations.
+
+    If the state is not cached yet, `build` is called with a seed of the burn-in
+    phase, and it must return the state in the format of a checkpoint.  None is
+    returned if burn-in is not shared.
+    """
+    if config.burnin_cache is None or config.burnin == 0:
+        return None
+
+    try:
+        os.makedirs(config.burnin_cache)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    fname = get_path(config)
+    lock = fname + '.lock'
+    while not os.path.exists(fname):
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            time.sleep(POLL)
+            continue
+
+        os.close(fd)
+        try:
+            if not os.path.exists(fname):
+                checkpoint.dump(fname, build(utils.derive_seed(get_key(config))))
+        finally:
+            os.remove(lock)
+
+    return checkpoint.read(fname)
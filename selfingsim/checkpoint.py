@@ -0,0 +1,169 @@
+"""
+selfingsim.checkpoint
+=====================
+
+Checkpoints of long simulations.
+
+A simulation with a positive "checkpoint per" saves its state at the beginning of
+every "checkpoint per" x N generations, next to its output file (with suffix
+".ckpt").  A state holds everything needed to continue the simulation: the
+population, the state of the mutation model, the state of random number
+generators, and the size of the output file at the time.  When the simulation is
+rerun with `resume`, it continues from the saved state, and the output file is
+truncated to the saved size, so that the final output is byte-identical to that
+of an uninterrupted run.
+
+The NumPy engine saves its random number generator as is.  simuPOP does not
+expose the state of its generator, so simuPOP-based simulations instead reseed
+the generator from the seed and the generation at every checkpoint, whether or
+not the simulation is resumed later.
+
+A checkpoint is removed when a simulation finishes.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import pickle
+import sys
+
+from . import utils
+
+# Settings allowed to differ between an interrupted run and its resumption.
+VOLATILE = ('seed', 'master_seed', 'resume', 'burnin_cache')
+
+
+def get_path(config):
+    """
+    Returns the name of a checkpoint file of a simulation.
+    """
+    return config.outfile + '.ckpt'
+
+
+def get_generations(config):
+    """
+    Returns generations at the beginning of which states are saved.
+    """
+    if config.checkpoint_per > 0:
+        return list(range(config.checkpoint_per, config.gens + config.burnin,
+                          config.checkpoint_per))
+    return []
+
+
+def _settings(params):
+    return dict((key, value) for key, value in params.items() if key not in VOLATILE)
+
+
+def dump(fname, state):
+    """
+    Writes a state of a simulation to a file.
+
+    An existing file is replaced atomically, so an interruption while writing
+    leaves the previous one intact.
+    """
+    tmp = fname + '.tmp'
+    with io.open(tmp, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    utils.replace(tmp, fname)
+
+
+def read(fname):
+    """
+    Reads a state of a simulation written by `dump`.
+    """
+    with io.open(fname, 'rb') as f:
+        return pickle.load(f)
+
+
+def save(config, state):
+    """
+    Saves a state of a simulation as its checkpoint.
+    """
+    dump(get_path(config), dict(state, params=_settings(config._params)))
+
+
+def load(config):
+    """
+    Returns a state saved by the latest checkpoint of a simulation.
+
+    None is returned unless the simulation is resumed and its checkpoint exists, that
+    is, the simulation starts from scratch.
+    """
+    fname = get_path(config)
+    if not config.resume or not os.path.exists(fname):
+        return None
+
+    state = read(fname)
+    if state['params'] != _settings(config._params):
+        sys.exit('Checkpoint "{}" was saved with different settings.'.format(fname))
+    return state
+
+
+def remove(config):
+    """
+    Removes a checkpoint of a finished simulation (if any).
+    """
+    fname = get_path(config)
+    if os.path.exists(fname):
+        os.remove(fname)
+
+
+def dump_population(pop, fname):
+    """
+    Returns a simuPOP population as bytes.
+    """
+    tmp = fname + '.pop'
+    pop.save(tmp)
+    try:
+        with io.open(tmp, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(tmp)
+
+
+def load_population(simu, data, fname):
+    """
+    Restores a simuPOP population from bytes returned by `dump_population`.
+    """
+    tmp = fname + '.pop'
+    with io.open(tmp, 'wb') as f:
+        f.write(data)
+    try:
+        return simu.loadPopulation(tmp)
+    finally:
+        os.remove(tmp)
+
+
+def get_checkpoint_operator(simu, config, writer, mutator, seed):
+    """
+    Sets up an operator saving states of a simuPOP-based simulation.
+
+    It must be the first pre-mating operator.  At a checkpoint, the population has
+    gone through all operators of the previous generation, and the evolution of a
+    resumed simulation starts there.  `mutator` provides `get_state` and
+    `set_state`, and random number generators are reseeded from `seed`.
+    """
+    class MyCheckpointer(simu.PyOperator):
+        """
+        Saves a state of a simulation at the beginning of a generation.
+        """
+        def __init__(self):
+            super(MyCheckpointer, self).__init__(func=self.save,
+                                                 at=get_generations(config))
+
+        def save(self, pop):
+            gen = pop.dvars().gen
+            # Both uninterrupted and resumed simulations restart random number
+            # streams here, so they draw identical numbers afterward.
+            simu.setRNG(seed=utils.derive_seed(seed, gen))
+            save(config, {'gen': gen,
+                          'seed': seed,
+                          'offset': writer.position(),
+                          'mutator': mutator.get_state(),
+                          'population': dump_population(pop, get_path(config))})
+            return True
+
+    return MyCheckpointer()
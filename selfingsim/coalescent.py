@@ -0,0 +1,321 @@
+"""
+selfingsim.coalescent
+=====================
+
+Coalescent with partial selfing.
+
+Following Nordborg (2000), the ancestry of genes in a partially selfing
+population is split into two phases.  Looking back in time, an individual first
+goes through a run of consecutive selfing generations, whose length t follows the
+geometric distribution P(t) = (1 - s) s^t with the fraction s (= s*) of
+uniparental offspring.  In each of these generations, the two genes of the
+individual coalesce with probability 1/2, so they are identical by descent with
+probability 1 - 2^-t at the end of the run.  Otherwise, the two genes move into
+distinct outcrossed ancestors, and all such lineages follow the standard
+coalescent with an effective population size reduced by a factor of 1 + F, where
+F = s / (2 - s) is the equilibrium inbreeding coefficient.  Mutations during the
+short runs of selfing are ignored.
+
+The effective size before the reduction accounts for unequal contributions of
+sexes to offspring (see `ParentsChooser.gene_sources`).  Loci are treated as
+unlinked, except that the length of a run of selfing is shared.
+
+Besides drawing initial populations of forward simulations, this module draws
+samples directly (`selfingsim coalesce`).  Samples are written in the same JSON
+format as those taken from simulation results by `selfingsim sample`, so they
+can be analyzed and converted in the same way.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import io
+import json
+import os
+import sys
+
+import numpy as np
+
+from . import common as cf
+from . import data
+from . import simulate
+from . import utils
+
+
+def run():
+    """
+    Draws samples as a stand-alone script.
+    """
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+    setup_command_line(subparsers)
+    args = parser.parse_args()
+    args.func(args)
+
+
+def setup_command_line(subparsers):
+    """
+    Sets up command line interface.
+    """
+    parser = subparsers.add_parser(
+        'coalesce',
+        help='draw samples with the coalescent with partial selfing')
+    parser.add_argument(
+        'config',
+        type=argparse.FileType('r'),
+        help='the settings of simulation as a JSON file')
+    parser.add_argument(
+        'samplesize',
+        type=int,
+        help='sample size')
+    parser.add_argument(
+        'reps',
+        type=int,
+        help='number of replicates')
+    parser.add_argument(
+        'substs',
+        type=str,
+        nargs='*',
+        help='substitutions plugged into an output file name (specified in config)')
+    parser.set_defaults(func=coalesce)
+
+
+def inbreeding_coefficient(sstar):
+    """
+    Returns the equilibrium inbreeding coefficient under partial selfing.
+    """
+    return sstar / (2 - sstar)
+
+
+def effective_size(chooser):
+    """
+    Returns the effective size of a population on the coalescent time scale.
+    """
+    outbred = 1 / sum(prob ** 2 / size for size, prob in chooser.gene_sources() if prob > 0)
+    return outbred / (1 + inbreeding_coefficient(chooser.sstar))
+
+
+def draw_selfing(rng, sstar, size):
+    """
+    Draws the numbers of consecutive selfing generations of individuals.
+    """
+    if sstar >= 1.0:
+        sys.exit('No equilibrium exists under complete selfing.')
+    return rng.geometric(1 - sstar, size=size) - 1
+
+
+def draw_ibd(rng, selfing, loci):
+    """
+    Draws, for each individual and locus, whether two genes coalesce while the
+    individual is traced back through consecutive selfing generations.
+    """
+    prob = 1 - 0.5 ** np.asarray(selfing, dtype=float)
+    return rng.random_sample((len(prob), loci)) < prob[:, np.newaxis]
+
+
+def get_lineages(ibd):
+    """
+    Returns lineages (in the outcrossed phase) of genes of individuals.
+
+    Lineages are numbered through individuals, and two identical-by-descent genes
+    share a lineage.  The result has shape (individuals, 2).
+    """
+    nlineage = 2 - ibd.astype(np.int64)
+    start = np.cumsum(nlineage) - nlineage
+    return np.column_stack([start, start + nlineage - 1])
+
+
+def draw_alleles(rng, theta, nlineage):
+    """
+    Draws alleles of lineages under the infinite alleles model.
+
+    Alleles follow the Ewens sampling formula, and they are drawn with Hoppe's
+    urn: the k-th lineage (from zero) carries a new allele with probability
+    theta / (theta + k), and otherwise it copies one of the earlier lineages.
+    Alleles are numbered from zero in the order of their first appearance.
+    """
+    k = np.arange(nlineage)
+    new = rng.random_sample(nlineage) * (theta + k) < theta
+    new[:1] = True
+    # Each lineage points to the lineage it copies, or to itself if it is new.
+    source = np.where(new, k, (rng.random_sample(nlineage) * k).astype(np.int64))
+    # Follow pointers until all of them reach lineages with new alleles.
+    while True:
+        ancestor = source[source]
+        if (ancestor == source).all():
+            break
+        source = ancestor
+    return np.unique(source, return_inverse=True)[1]
+
+
+def draw_genealogy(rng, nlineage):
+    """
+    Draws a genealogy of lineages under the standard coalescent.
+
+    Nodes 0, ..., `nlineage` - 1 are the lineages, and later nodes are their
+    ancestors in the order of coalescence, so that the last node is the root.
+    Returns the parent and the age (in units of 2Ne generations) of every node.
+    The root is its own parent.
+    """
+    nnode = 2 * nlineage - 1
+    parent = np.arange(nnode)
+    age = np.zeros(nnode)
+    if nlineage < 2:
+        return parent, age
+
+    k = np.arange(nlineage, 1, -1)
+    age[nlineage:] = np.cumsum(rng.exponential(2 / (k * (k - 1))))
+    # A pair of distinct lineages among k for each coalescence.
+    first = (rng.random_sample(nlineage - 1) * k).astype(np.int64)
+    second = (rng.random_sample(nlineage - 1) * (k - 1)).astype(np.int64)
+    second += second >= first
+
+    active = list(range(nlineage))
+    for node, i, j in zip(range(nlineage, nnode), first.tolist(), second.tolist()):
+        parent[active[i]] = node
+        parent[active[j]] = node
+        active[i] = node
+        active[j] = active[-1]
+        active.pop()
+    return parent, age
+
+
+def draw_haplotypes(rng, theta, nlineage):
+    """
+    Draws haplotypes of lineages under the infinite sites model.
+
+    Mutations are placed on branches of a genealogy, and they are numbered from
+    zero by their ages, the oldest first.  Returns haplotypes of lineages as
+    indices to a list of distinct haplotypes, each of which is a frozenset of
+    mutations, together with the list.
+    """
+    parent, age = draw_genealogy(rng, nlineage)
+    nnode = len(parent)
+    length = age[parent] - age
+    nmut = rng.poisson(theta / 2 * length)
+    nodes = np.repeat(np.arange(nnode), nmut)
+    # Order mutations from the oldest.
+    ages = age[nodes] + rng.random_sample(len(nodes)) * length[nodes]
+    order = np.argsort(-ages, kind='mergesort')
+    mutations = {}
+    for mutation, node in enumerate(nodes[order].tolist()):
+        mutations.setdefault(node, []).append(mutation)
+
+    # A node carries mutations of its parent, whose index is larger.
+    haplotypes = [frozenset()] * nnode
+    for node in range(nnode - 2, -1, -1):
+        haplotypes[node] = haplotypes[parent[node]]
+        if node in mutations:
+            haplotypes[node] = haplotypes[node] | frozenset(mutations[node])
+
+    distinct = {}
+    index = np.array([distinct.setdefault(haplotypes[node], len(distinct))
+                      for node in range(nlineage)], dtype=np.int64)
+    return index, sorted(distinct, key=distinct.get)
+
+
+def draw_population(rng, config, draw, size=None):
+    """
+    Draws individuals from a population at equilibrium.
+
+    `draw` is either `draw_alleles` or `draw_haplotypes`.  Returns the numbers of
+    consecutive selfing generations of individuals, and per locus, the value
+    returned by `draw` together with an array of shape (individuals, 2) mapping
+    genes to lineages in the value.  All individuals in a population are drawn
+    unless `size` is given.
+    """
+    chooser = cf.get_parents_chooser(config)
+    nesize = effective_size(chooser)
+    if size is None:
+        size = config.N
+
+    selfing = draw_selfing(rng, chooser.sstar, size)
+    ibd = draw_ibd(rng, selfing, config.loci)
+    loci = []
+    for locus in range(config.loci):
+        lineages = get_lineages(ibd[:, locus])
+        theta = 4 * nesize * config.m[locus]
+        loci.append((draw(rng, theta, lineages[-1, 1] + 1), lineages))
+    return selfing, loci
+
+
+def draw_allele_genotypes(rng, config):
+    """
+    Draws a population at equilibrium under the infinite alleles model.
+
+    Returns the next unused allele, genotypes of shape (N, 2, loci), and the numbers
+    of consecutive selfing generations.
+    """
+    selfing, loci = draw_population(rng, config, draw_alleles)
+    geno = np.empty((config.N, 2, config.loci), dtype=np.int64)
+    for locus, (alleles, lineages) in enumerate(loci):
+        geno[:, :, locus] = alleles[lineages]
+    return int(geno.max()) + 1, geno, selfing
+
+
+def encode_haplotypes(haplotypes):
+    """
+    Returns hexadecimal codes of haplotypes under the infinite sites model.
+
+    As in output of forward simulations, bits represent states of segregating
+    sites ordered by age, and the oldest site is the most significant bit.
+    """
+    sites = sorted(frozenset().union(*haplotypes) - frozenset.intersection(*haplotypes))
+    bits = dict((site, 1 << (len(sites) - 1 - i)) for i, site in enumerate(sites))
+    return ['0x{:x}'.format(sum(bits.get(site, 0) for site in haplotype))
+            for haplotype in haplotypes]
+
+
+def draw_sample(rng, config, size):
+    """
+    Draws a sample of individuals from a population at equilibrium.
+
+    Genes are strings as in samples taken from simulation results.
+    """
+    if config.mutation_model == 'infinite sites':
+        selfing, loci = draw_population(rng, config, draw_haplotypes, size)
+        loci = [(np.array(encode_haplotypes(haplotypes), dtype=object)[index], lineages)
+                for (index, haplotypes), lineages in loci]
+    else:
+        selfing, loci = draw_population(rng, config, draw_alleles, size)
+
+    genes = np.empty((size, config.loci, 2), dtype=object)
+    for locus, (values, lineages) in enumerate(loci):
+        genes[:, locus] = values[lineages]
+    genos = [[[str(i) for i in locus] for locus in ind] for ind in genes.tolist()]
+    return data.FullSample(config.outfile, [str(i) for i in range(size)], genos,
+                           selfing.tolist())
+
+
+def coalesce(args):
+    """
+    Draws independent samples from populations at equilibrium.
+
+    Each replicate is seeded by a seed derived from the master seed ("seed" in
+    the general section of config, or a random one if absent), and it is written
+    to a file named as a sample taken by `selfingsim sample` from the output file
+    in config.  The master seed is printed to stderr, so samples can be drawn
+    again.
+    """
+    cobj = json.load(args.config)
+    master = cobj['general'].get('seed')
+    if master is None:
+        master = utils.random_seed()
+    print("master seed: {}".format(master), file=sys.stderr)
+    config = simulate.Config(cobj, args.substs)
+
+    fbase = os.path.splitext(config.outfile)[0]
+    template = fbase + '.size_{}.sample_rep_{{:0{}}}.json'.format(
+        args.samplesize, len(str(max(args.reps - 1, 0))))
+
+    for rep in range(args.reps):
+        rng = np.random.RandomState(utils.derive_seed(master, rep))
+        sample = draw_sample(rng, config, args.samplesize)
+        with io.open(template.format(rep), 'w') as fhandle:
+            print(sample.tojson(), file=fhandle)
+
+
+if __name__ == '__main__':
+    run()
@@ -9,6 +9,14 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import abc
+import binascii
+import sys
+
+import numpy as np
+
+from . import utils
+
 def get_population(simu, size, loci, info_fields='self_gen'):
     """Construct a population object."""
     return simu.Population(size=size,
@@ -29,212 +37,372 @@ def get_init_genotype_by_count(simu, nalleles):
     return (nalleles, simu.InitGenotype(prop=[1 / nalleles for _ in range(nalleles)]))
 
 
-def pick_pure_hermaphrodite_parents(simu, config):
+def get_numpy_rng(simu):
     """
-    Sets up a mechanism to pick parent(s) under pure hermaphroditism.
+    Returns a NumPy random number generator seeded from simuPOP's RNG.
+
+    A fresh generator is meant to be requested at the beginning of every
+    generation, so that the NumPy stream is fully determined by simuPOP's RNG.
     """
-    rng = simu.getRNG()
-    runif = rng.randUniform
-    rint = rng.randInt
-    try:
-        sstar = config.sstar
-        def compound_generator(pop):
-            """
-            Generates parents under pure hermaphroditism using a compound parameter.
-            """
-            npop = pop.popSize()
-            while True:
-                if runif() < sstar:         # uniparental
-                    yield rint(npop)
-                else:                   # biparental
-                    first, second = rint(npop), rint(npop)
-                    while first == second:
-                        second = rint(npop)
-                    yield [first, second]
-        return compound_generator
-    except KeyError:
-        stilde = config.stilde
-        tau = config.tau
-        def fundamental_generator(pop):
-            """
-            Generates parents under pure hermaphroditism using fundamental parameters.
-            """
-            npop = pop.popSize()
-            while True:
-                if runif() < stilde: # proportion of self-fertilized eggs
-                    if runif() < tau: # survival of a uniparental zygote (rel to a biparental z)
-                        yield rint(npop)
-                else:
-                    first, second = rint(npop), rint(npop)
-                    while first == second:
-                        second = rint(npop)
-                    yield [first, second]
-        return fundamental_generator
-
-
-def pick_androdioecious_parents(simu, config):
-    """
-    Sets up a mechanism to pick parent(s) under androdioecy.
-    """
-    rng = simu.getRNG()
-    runif = rng.randUniform
-    rint = rng.randInt
-    try:
-        sstar = config.sstar
-        def compound_generator(pop):
-            """
-            Picks up parent(s) under androdioecy using a compound parameter.
-            """
-            gen = -1
-            while True:
-                ngen = pop.dvars().gen
-                if gen != ngen:
-                    # At the beginning of a generation, extract the
-                    # sex-specific subpopulations from a parental
-                    # population. The sex-specific subpopulations are used
-                    # throughout mating events in one generation.
-                    gen = ngen
-                    males = pop.extractSubPops(subPops=[(0, 0)])
-                    herms = pop.extractSubPops(subPops=[(0, 1)])
-                    nmale = males.popSize()
-                    nherm = herms.popSize()
-
-                if runif() < sstar:         # uniparental
-                    yield herms.individual(rint(nherm))
-                else:                   # biparental
-                    yield [males.individual(rint(nmale)), herms.individual(rint(nherm))]
-        return compound_generator
-    except KeyError:
-        stilde = config.stilde
-        tau = config.tau
-        def compound_generator(pop):
-            """
-            Picks up parent(s) under androdioecy using fundamental parameters.
-            """
-            gen = -1
-            while True:
-                ngen = pop.dvars().gen
-                if gen != ngen:
-                    # At the beginning of a generation, extract the
-                    # sex-specific subpopulations from a parental
-                    # population. The sex-specific subpopulations are used
-                    # throughout mating events in one generation.
-                    gen = ngen
-                    males = pop.extractSubPops(subPops=[(0, 0)])
-                    herms = pop.extractSubPops(subPops=[(0, 1)])
-                    nmale = males.popSize()
-                    nherm = herms.popSize()
-
-                if runif() < stilde: # proportion of self-fertlized egg
-                    if runif() < tau: # survival rate of a uniparental zygote rel to a biparental z.
-                        yield herms.individual(rint(nherm))
-                else:                   # biparental
-                    yield [males.individual(rint(nmale)), herms.individual(rint(nherm))]
-        return compound_generator
-
-
-def pick_gynodioecious_parents(simu, config):
-    """
-    Sets up a mechanism to pick up parent(s) under gynodioecy.
-    """
-    rng = simu.getRNG()
-    runif = rng.randUniform
-    rint = rng.randInt
-    try:
-        sstar = config.sstar
-        H = config.H
-        def compound_generator(pop):
-            """
-            Picks up parent(s) under gynodioecy using compound parameters.
-            """
-            gen = -1
-            while True:
-                ngen = pop.dvars().gen
-                if gen != ngen:
-                    # At the beginning of a generation, extract the
-                    # sex-specific subpopulations from a parental
-                    # population. The sex-specific subpopulations are used
-                    # throughout mating events in one generation.
-                    gen = ngen
-                    h = pop.extractSubPops(subPops=[(0, 0)])
-                    f = pop.extractSubPops(subPops=[(0, 1)])
-                    Nh = h.popSize()
-                    Nf = f.popSize()
-
-                if runif() < sstar: # uniparental
-                    yield h.individual(rint(Nh))
-                else:               # biparental
-                    if runif() < H: # having a hermaphroditic seed parent
-                        first, second = rint(Nh), rint(Nh)
-                        while first == second:
-                            second = rint(Nh)
-                        yield [h.individual(first), h.individual(second)]
-                    else:           # female seed parent
-                        yield [h.individual(rint(Nh)), f.individual(rint(Nf))]
-        return compound_generator
-    except KeyError:
-        a = config.a
-        sigma = config.sigma
-        tau = config.tau
-        def fundamental_generator(pop):
-            """
-            Picks up parent(s) under gynodioecy using fundamental parameters.
-            """
-            gen = -1
-            while True:
-                ngen = pop.dvars().gen
-                if gen != ngen:
-                    # At the beginning of a generation, extract the
-                    # sex-specific subpopulations from a parental
-                    # population. The sex-specific subpopulations are used
-                    # throughout mating events in one generation.
-                    gen = ngen
-                    h = pop.extractSubPops(subPops=[(0, 0)])
-                    f = pop.extractSubPops(subPops=[(0, 1)])
-                    Nh = h.popSize()
-                    Nf = f.popSize()
-                    hermseed = Nh / (Nh * Nf * sigma)
-
-                if runif() < hermseed: # hermaphroditic seed parent
-                    if runif() < a: # self-pollen
-                        yield h.individual(rint(Nh))
-                    else: # non self-pollen
-                        first, second = rint(Nh), rint(Nh)
-                        while first == second:
-                            second = rint(Nh)
-                        yield [h.individual(first), h.individual(second)]
-                else: # female seed parent
-                    if runif() < tau:
-                        yield [h.individual(rint(Nh)), f.individual(rint(Nf))]
-        return fundamental_generator
-
-
-def get_selfing_tagger(simu, field):
+    return np.random.RandomState(simu.getRNG().randInt(utils.MAX_SEED))
+
+
+def get_genotype(pop):
+    """
+    Returns genotypes of a population as an array of shape (N, 2, loci).
+
+    This is a convenience for array code rather than a fast path: the array is
+    a copy built element by element from simuPOP's storage, at about the cost
+    of `list(pop.genotype())`.  It stays unchanged as the population changes.
+    Pass a modified array to `set_genotype`.
+    """
+    geno = pop.genotype()
+    shape = (pop.popSize(), 2, pop.totNumLoci())
+    return np.fromiter(geno, dtype=np.int64, count=len(geno)).reshape(shape)
+
+
+def set_genotype(pop, geno):
+    """
+    Stores genotypes in an array of shape (N, 2, loci) to a population.
+
+    Like `get_genotype`, this copies element by element through a Python list.
+    """
+    pop.setGenotype(np.asarray(geno).ravel().tolist())
+
+
+def draw_other_parents(rng, first, npop):
+    """
+    Draws a second parent for each of `first`, uniformly among the other `npop` - 1
+    individuals.
+    """
+    return (first + rng.randint(1, npop, size=len(first))) % npop
+
+
+def draw_hits(rng, rate, ntrial):
+    """
+    Returns sorted indices of successes among `ntrial` Bernoulli trials with success
+    probability `rate`.
+
+    Instead of testing every trial, gaps between successive successes are drawn
+    from the geometric distribution, so the cost is proportional to the number of
+    successes rather than to `ntrial`.
+    """
+    if rate <= 0.0 or ntrial == 0:
+        return np.zeros(0, dtype=np.int64)
+    elif rate >= 1.0:
+        return np.arange(ntrial)
+
+    # Draw gaps in chunks large enough to cover all trials most of the time.
+    mean = rate * ntrial
+    chunk = int(mean + 4 * mean ** 0.5) + 1
+    hits = []
+    last = -1
+    while True:
+        positions = last + np.cumsum(rng.geometric(rate, size=chunk))
+        hits.append(positions[positions < ntrial])
+        if positions[-1] >= ntrial:
+            return np.concatenate(hits)
+        last = positions[-1]
+
+
+def sample_mutations(rng, m_rate, ngene):
+    """
+    Samples genes hit by mutations in one generation.
+
+    Yields pairs of a locus and sorted indices of mutated genes among `ngene` genes
+    at the locus.  Only loci with at least one mutation are yielded, and loci with
+    zero mutation rate cost nothing.
+    """
+    for locus, rate in enumerate(m_rate):
+        if rate > 0.0:
+            genes = draw_hits(rng, rate, ngene)
+            if len(genes) > 0:
+                yield locus, genes
+
+
+def encode_states(states):
+    """
+    Returns hexadecimal codes of genes under the infinite sites model.
+
+    `states` holds states of polymorphic sites (0 for ancestral and 1 for derived)
+    along its last axis, and the first site is the most significant bit.  The
+    result is an array of strings with the remaining shape.  A gene without any
+    polymorphic site is "0x0".
+    """
+    states = np.asarray(states, dtype=np.uint8)
+    shape, nsite = states.shape[:-1], states.shape[-1]
+    if nsite == 0:
+        return np.full(shape, '0x0', dtype=object)
+
+    # Bits are packed into bytes, padded on the most significant side.
+    flat = states.reshape(-1, nsite)
+    padded = np.zeros((len(flat), nsite + (-nsite) % 8), dtype=np.uint8)
+    padded[:, padded.shape[1] - nsite:] = flat
+    packed = np.packbits(padded, axis=1)
+    # Distinct genes are formatted only once.
+    keys = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+    distinct, inverse = np.unique(keys, return_inverse=True)
+    labels = ['0x{:x}'.format(int(binascii.hexlify(key.tobytes()), 16)) for key in distinct]
+    return np.array(labels, dtype=object)[inverse.ravel()].reshape(shape)
+
+
+def encode_sites(geno):
+    """
+    Returns hexadecimal codes of genes of a population under the infinite sites
+    model.
+
+    `geno` holds states of all sites as an array of shape (individuals, 2, loci,
+    sites per locus).  Only sites polymorphic in the population are encoded, in
+    the order of sites, so sites either unused or fixed do not show in codes.
+    The result is an array of strings of shape (individuals, 2, loci).
+    """
+    # A site is polymorphic unless all chromosomes share its state.
+    poly = geno.min(axis=(0, 1)) != geno.max(axis=(0, 1))
+    genotypes = np.empty(geno.shape[:3], dtype=object)
+    for locus in range(geno.shape[2]):
+        genotypes[:, :, locus] = encode_states(geno[:, :, locus, poly[locus]])
+    return genotypes
+
+
+# A base of abstract classes under both python2 and python3.
+_ABC = abc.ABCMeta(str('ABC'), (object,), {})
+
+
+class ParentsChooser(_ABC):
+    """
+    Abstract base class of choosers drawing parents of all offspring in a
+    generation at once.
+
+    Subclasses implement `draw`, which returns three arrays of length `size`:
+    flags of uniparental offspring, indices of the first (or only) parents, and
+    indices of the second parents.  The second parents of uniparental offspring
+    are meaningless.  They also implement `gene_sources`, which describes
+    classes of parents for the coalescent (see selfingsim.coalescent).
+
+    `choose` additionally remembers the latest draw together with the numbers
+    of selfing generations of the parents, from which `offspring_selfing`
+    derives those of the offspring in one pass.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.uniparental = None
+        self.first = None
+        self.selfing = None
+
+    @abc.abstractmethod
+    def draw(self, rng):
+        """
+        Draws parents of all offspring in one generation.
+        """
+
+    def choose(self, rng, selfing):
+        """
+        Draws parents of all offspring in one generation, and remembers them along
+        with the numbers of selfing generations of the parental population.
+        """
+        uniparental, first, second = self.draw(rng)
+        self.uniparental = uniparental
+        self.first = first
+        self.selfing = np.asarray(selfing)
+        return uniparental, first, second
+
+    @abc.abstractmethod
+    def gene_sources(self):
+        """
+        Returns sizes of classes of parents and the probabilities that a gene of an
+        offspring comes from each class.
+        """
+
+    def offspring_selfing(self):
+        """
+        Returns the numbers of selfing generations of offspring of the latest draw.
+
+        A uniparental offspring has one more generation than its parent, and a
+        biparental offspring has none.
+        """
+        return np.where(self.uniparental, self.selfing[self.first] + 1, 0)
+
+
+class PureHermaphroditeParentsChooser(ParentsChooser):
+    """
+    Draws parents under pure hermaphroditism.
+    """
+    def __init__(self, config):
+        super(PureHermaphroditeParentsChooser, self).__init__(config.N)
+        try:
+            self.sstar = config.sstar
+        except KeyError:
+            # Conditioning on survival of zygotes turns the fundamental
+            # parameters into the compound parameter.
+            stilde = config.stilde
+            tau = config.tau
+            self.sstar = stilde * tau / (stilde * tau + 1 - stilde)
+
+    def draw(self, rng):
+        npop = self.size
+        uniparental = rng.random_sample(npop) < self.sstar
+        first = rng.randint(npop, size=npop)
+        second = draw_other_parents(rng, first, npop)
+        return uniparental, first, second
+
+    def gene_sources(self):
+        return [(self.size, 1.0)]
+
+
+def get_parents_generator(simu, chooser, field='self_gen'):
+    """
+    Wraps a `ParentsChooser` into a generator function for simu.PyParentsChooser.
+    """
+    field = str(field)
+
+    def generator(pop):
+        """
+        Yields parents drawn in bulk at the beginning of a generation.
+        """
+        uniparental, first, second = chooser.choose(get_numpy_rng(simu),
+                                                    pop.indInfo(field))
+        for uni, i, j in zip(uniparental.tolist(), first.tolist(), second.tolist()):
+            if uni:
+                yield i
+            else:
+                yield [i, j]
+    return generator
+
+
+class AndrodioeciousParentsChooser(ParentsChooser):
+    """
+    Draws parents under androdioecy.
+
+    Sexes are fixed by position in a population (see `androdioecy`): the first
+    N - N_hermaphrodites individuals are males, and the rest are hermaphrodites.
+    Parents are therefore drawn as indices into these ranges of the parental
+    population.
+    """
+    def __init__(self, config):
+        super(AndrodioeciousParentsChooser, self).__init__(config.N)
+        self.nmale = config.N - config.N_hermaphrodites
+        self.nherm = config.N_hermaphrodites
+        try:
+            self.sstar = config.sstar
+        except KeyError:
+            stilde = config.stilde
+            tau = config.tau
+            self.sstar = stilde * tau / (stilde * tau + 1 - stilde)
+        if not 0 < self.nherm <= config.N:
+            sys.exit('N_hermaphrodites must be between 1 and N.')
+        if self.nmale == 0 and self.sstar < 1:
+            sys.exit('Outcrossing requires males under androdioecy.  '
+                     'Set N_hermaphrodites below N, or s* to 1.')
+
+    def draw(self, rng):
+        size = self.size
+        uniparental = rng.random_sample(size) < self.sstar
+        herms = self.nmale + rng.randint(self.nherm, size=size)
+        if self.nmale > 0:
+            males = rng.randint(self.nmale, size=size)
+        else:
+            # Every offspring is uniparental without males.
+            males = herms
+        # A biparental offspring has a male pollen parent and a hermaphroditic
+        # seed parent.
+        first = np.where(uniparental, herms, males)
+        return uniparental, first, herms
+
+    def gene_sources(self):
+        # One of two genes of a biparental offspring comes from a male.
+        male = (1 - self.sstar) / 2
+        return [(self.nmale, male), (self.nherm, 1 - male)]
+
+
+class GynodioeciousParentsChooser(ParentsChooser):
+    """
+    Draws parents under gynodioecy.
+
+    Sexes are fixed by position in a population (see `gynodioecy`): the first
+    N_hermaphrodites individuals are hermaphrodites, and the rest are females.
+    Parents are therefore drawn as indices into these ranges of the parental
+    population.
+    """
+    def __init__(self, config):
+        super(GynodioeciousParentsChooser, self).__init__(config.N)
+        self.nherm = Nh = config.N_hermaphrodites
+        self.nfemale = Nf = config.N - config.N_hermaphrodites
+        try:
+            self.sstar = config.sstar
+            self.H = config.H
+        except KeyError:
+            # Conditioning on survival of zygotes turns the fundamental
+            # parameters into the compound parameters.
+            a = config.a
+            sigma = config.sigma
+            tau = config.tau
+            self.sstar = tau * Nh * a / (tau * Nh * a + Nh * (1 - a) + Nf * sigma)
+            self.H = Nh * (1 - a) / (Nh * (1 - a) + Nf * sigma)
+        if not 0 < Nh <= config.N:
+            sys.exit('N_hermaphrodites must be between 1 and N.')
+        if Nf == 0 and self.sstar < 1 and self.H < 1:
+            sys.exit('Seeds of females require females under gynodioecy.  '
+                     'Set N_hermaphrodites below N, or H to 1.')
+
+    def draw(self, rng):
+        size = self.size
+        uniparental = rng.random_sample(size) < self.sstar
+        hermseed = rng.random_sample(size) < self.H
+        first = rng.randint(self.nherm, size=size)
+        herms = draw_other_parents(rng, first, self.nherm)
+        if self.nfemale > 0:
+            females = self.nherm + rng.randint(self.nfemale, size=size)
+        else:
+            # Every seed parent is a hermaphrodite without females.
+            females = herms
+        second = np.where(hermseed, herms, females)
+        return uniparental, first, second
+
+    def gene_sources(self):
+        # One of two genes of a biparental offspring comes from its seed parent,
+        # which is a female unless the seed parent is a hermaphrodite.
+        female = (1 - self.sstar) * (1 - self.H) / 2
+        return [(self.nherm, 1 - female), (self.nfemale, female)]
+
+
+def get_parents_chooser(config):
+    """
+    Returns a parents chooser appropriate to the mating scheme.
+    """
+    if config.mating_model == 'androdioecy':
+        return AndrodioeciousParentsChooser(config)
+    elif config.mating_model == 'gynodioecy':
+        return GynodioeciousParentsChooser(config)
+    elif config.mating_model == 'pure hermaphroditism':
+        return PureHermaphroditeParentsChooser(config)
+    else:
+        sys.exit('Unrecognized mating model: {}.'.format(config.mating_model))
+
+
+def get_selfing_tagger(simu, chooser, field='self_gen'):
     class MySelfingTagger(simu.PyOperator):
         """
         Update information field to reflect selfing.
 
-        When selfing occurred, this operator record the fact by incrementing the value
-        of `field` by one.
+        This operator runs once per generation after mating.  It sets the value of
+        `field` of uniparental offspring to the value of their parent plus one, and
+        resets the value of biparental offspring to 0.  Parents are looked up from
+        the latest draw of `chooser`, so no Python code runs per offspring.
         """
 
         def __init__(self, field='self_gen'):
-            self.field = field.encode("utf-8")
+            self.field = str(field)
             super(MySelfingTagger, self).__init__(func=self.record)
 
-        def record(self, pop, off, dad, mom):
+        def record(self, pop):
             """
-            Increment the value of offspring's infofield `field` by one if it is uniparental.
-            Otherwise reset the value to 0.
+            Update `field` of all offspring in one batch.
             """
-            if mom is not None:
-                off.setInfo(0, str(self.field))
-            else:
-                off.setInfo(dad.info(self.field) + 1, self.field)
+            pop.setIndInfo(chooser.offspring_selfing().tolist(), self.field)
             return True
     return MySelfingTagger(field)
 
-def get_pure_hermaphrodite_mating(simu, r_rate, parents_chooser, size, rec_sites, field='self_gen'):
+def get_pure_hermaphrodite_mating(simu, r_rate, parents_chooser, size, rec_sites):
     """
     Constructs mating scheme for pure hermaphrodite with partial selfing under
     the infinite alleles model.
@@ -245,45 +413,38 @@ def get_pure_hermaphrodite_mating(simu, r_rate, parents_chooser, size, rec_sites
     Furthermore, a parent can participate in both selfing and outcrossing.
     """
 
-    selfing_tagger = get_selfing_tagger(simu, field)
-
     return simu.HomoMating(chooser=parents_chooser,
                            generator=simu.OffspringGenerator(
-                               ops=[simu.Recombinator(rates=r_rate, loci=rec_sites),
-                                    selfing_tagger]),
+                               ops=simu.Recombinator(rates=r_rate, loci=rec_sites)),
                            subPopSize=size)
 
 
 def get_androdioecious_mating(simu, r_rate, parents_chooser,
-                              size, sex_seq, rec_sites, field='self_gen'):
+                              size, sex_seq, rec_sites):
     """
     Constructs a mating operator under androdioecy.
     """
 
     sex_mode = (simu.GLOBAL_SEQUENCE_OF_SEX,) + sex_seq
 
-    selfing_tagger = get_selfing_tagger(simu, field)
     return simu.HomoMating(chooser=parents_chooser,
                            generator=simu.OffspringGenerator(
-                               ops=[simu.Recombinator(rates=r_rate, loci=rec_sites),
-                                    selfing_tagger],
+                               ops=simu.Recombinator(rates=r_rate, loci=rec_sites),
                                sexMode=sex_mode),
                            subPopSize=size)
 
 
 def get_gynodioecious_mating(simu, r_rate, parents_chooser,
-                             size, sex_seq, rec_sites, field='self_gen'):
+                             size, sex_seq, rec_sites):
     """
     Constructs a mating operator under gynodioecy.
     """
 
     sex_mode = (simu.GLOBAL_SEQUENCE_OF_SEX,) + sex_seq
 
-    selfing_tagger = get_selfing_tagger(simu, field)
     return simu.HomoMating(chooser=parents_chooser,
                            generator=simu.OffspringGenerator(
-                               ops=[simu.Recombinator(rates=r_rate, loci=rec_sites),
-                                    selfing_tagger],
+                               ops=simu.Recombinator(rates=r_rate, loci=rec_sites),
                                sexMode=sex_mode),
                            subPopSize=size)
 
@@ -299,9 +460,8 @@ def pure_hermaphrodite(simu, execute_func, config):
     # Index of sites, after which recombinations happen.
     rec_loci = [config.allele_length * i - 1 for i in range(1, config.loci)]
 
-    parents_chooser = simu.PyParentsChooser(
-        pick_pure_hermaphrodite_parents(simu, config)
-    )
+    chooser = PureHermaphroditeParentsChooser(config)
+    parents_chooser = simu.PyParentsChooser(get_parents_generator(simu, chooser))
 
     mating_op = get_pure_hermaphrodite_mating(simu,
                                               r_rate=config.r,
@@ -309,7 +469,7 @@ def pure_hermaphrodite(simu, execute_func, config):
                                               size=config.N,
                                               rec_sites=rec_loci)
 
-    execute_func(config, pop, mating_op)
+    execute_func(config, pop, mating_op, get_selfing_tagger(simu, chooser))
 
 
 def androdioecy(simu, execute_func, config):
@@ -329,9 +489,8 @@ def androdioecy(simu, execute_func, config):
     # Index of sites, after which recombinations happen.
     rec_loci = [config.allele_length * i - 1 for i in range(1, config.loci)]
 
-    parents_chooser = simu.PyParentsChooser(
-        pick_androdioecious_parents(simu, config)
-    )
+    chooser = AndrodioeciousParentsChooser(config)
+    parents_chooser = simu.PyParentsChooser(get_parents_generator(simu, chooser))
 
     mating_op = get_androdioecious_mating(simu,
                                           r_rate=config.r,
@@ -340,7 +499,7 @@ def androdioecy(simu, execute_func, config):
                                           sex_seq=sex_seq,
                                           rec_sites=rec_loci)
 
-    execute_func(config, pop, mating_op)
+    execute_func(config, pop, mating_op, get_selfing_tagger(simu, chooser))
 
 
 
@@ -361,9 +520,8 @@ def gynodioecy(simu, execute_func, config):
     # Index of sites, after which recombinations happen.
     rec_loci = [config.allele_length * i - 1 for i in range(1, config.loci)]
 
-    parents_chooser = simu.PyParentsChooser(
-        pick_gynodioecious_parents(simu, config)
-    )
+    chooser = GynodioeciousParentsChooser(config)
+    parents_chooser = simu.PyParentsChooser(get_parents_generator(simu, chooser))
 
     mating_op = get_gynodioecious_mating(simu,
                                          r_rate=config.r,
@@ -372,4 +530,4 @@ def gynodioecy(simu, execute_func, config):
                                          sex_seq=sex_seq,
                                          rec_sites=rec_loci)
 
-    execute_func(config, pop, mating_op)
+    execute_func(config, pop, mating_op, get_selfing_tagger(simu, chooser))
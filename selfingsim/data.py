@@ -17,26 +17,124 @@ except NameError:
     pass
 
 # standeard imports
-from collections import Counter
-import csv
 import io
-from itertools import groupby, izip
+from itertools import groupby
+try:
+    from itertools import izip
+except ImportError:
+    izip = zip
+try:
+    xrange
+except NameError:
+    xrange = range
 import json
+import math
 import os.path
 import random
 
-from . import utils
+import numpy as np
+
+from . import storage
+
+# Maximum number of allele frequencies of bootstrap resamples held at once.
+_BLOCKSIZE = 2 ** 22
+
+def _normalquantile(prob):
+    """
+    Returns the quantile of the standard normal distribution at `prob`.
+    """
+    lower, upper = -40., 40.
+    for _ in xrange(100):
+        mid = (lower + upper) / 2
+        if (1 + math.erf(mid / math.sqrt(2))) / 2 < prob:
+            lower = mid
+        else:
+            upper = mid
+    return (lower + upper) / 2
+
+# Generations of selfing beyond which individuals are taken as fully inbred in
+# the RMES likelihood.
+_MAXGEN = 20
+
+# Bounds of per-locus heterozygosity of outcrossed individuals.
+_EPS = 1e-10
+
+def _rmesem(hets, counts, selfing=None, theta=None, maxgen=_MAXGEN, tol=1e-12,
+            maxiter=10000):
+    """
+    Maximizes the RMES likelihood of the selfing rate by the EM algorithm.
+
+    Data are distinct multilocus heterozygosity patterns (0 or 1 per locus) as
+    rows of `hets`, each observed `counts` times.  An individual has been
+    selfed for t generations with probability (1 - s) s^t, where generations
+    from `maxgen` on are lumped together, and it is heterozygous at locus l
+    with probability theta_l / 2^t independently among loci.  The number of
+    generations is the missing data.
+
+    If `selfing` is given, it is held fixed, and only theta is maximized.
+    `theta` is the starting point.  This function returns the selfing rate,
+    theta, and the log-likelihood.
+    """
+    hets = hets.astype(float)
+    counts = counts.astype(float)
+    gens = np.arange(maxgen + 1)
+    halves = 0.5 ** gens
+    fixed = selfing is not None
+    s = selfing if fixed else 0.5
+    if theta is None:
+        # Heterozygosity expected at the equilibrium of the starting rate.
+        s0 = min(s, 0.9)
+        theta = counts.dot(hets) / counts.sum() * (2 - s0) / (2 * (1 - s0))
+    theta = np.clip(theta, _EPS, 1 - _EPS)
+
+    loglik = -np.inf
+    for _ in xrange(maxiter):
+        # E-step: posterior probabilities of generations of selfing per pattern.
+        prior = (1 - s) * s ** gens
+        prior[-1] = s ** maxgen
+        probs = halves[:, None] * theta
+        with np.errstate(divide='ignore'):
+            joint = hets.dot(np.log(probs).T) + (1 - hets).dot(np.log1p(-probs).T) + np.log(prior)
+        top = joint.max(axis=1, keepdims=True)
+        marginal = top[:, 0] + np.log(np.exp(joint - top).sum(axis=1))
+        newloglik = counts.dot(marginal)
+        weights = counts[:, None] * np.exp(joint - marginal[:, None])
+
+        converged = newloglik - loglik <= tol * (1 + abs(newloglik))
+        loglik = newloglik
+        if converged:
+            break
+
+        # M-step: the selfing rate has a closed form, and theta is improved by
+        # Newton's method (the expected log-likelihood is concave in it).
+        ngens = weights.sum(axis=0)
+        if not fixed:
+            total = ngens[:-1].sum() + gens.dot(ngens)
+            s = gens.dot(ngens) / total if total > 0 else 0.
+        nhet = weights.T.dot(hets)
+        nhom = weights.T.dot(1 - hets)
+        for _ in xrange(5):
+            rest = 1 - halves[:, None] * theta
+            grad = nhet.sum(axis=0) / theta - (nhom * halves[:, None] / rest).sum(axis=0)
+            hess = -nhet.sum(axis=0) / theta ** 2 - (nhom * (halves[:, None] / rest) ** 2).sum(axis=0)
+            new = theta - grad / hess
+            new = np.where(new <= 0, theta / 2, np.where(new >= 1, (theta + 1) / 2, new))
+            theta = np.clip(new, _EPS, 1 - _EPS)
+
+    return s, theta, loglik
 
 def createsample(fname, gen=None):
     """
     Depending on file suffix, create an instance of an appropriate Sample object.
 
     The second argument "gen" is only meaningful when an instance is created from
-    tsv file.
+    simulation results (either tsv or binary file).
     """
     suffix = os.path.splitext(fname)[1]
-    if suffix == ".tsv": # original simulation result
+    if suffix == ".tsv" or suffix in storage.COMPRESSIONS: # original simulation result
         return FullSample.fromtsv(fname, gen)
+    elif suffix == storage.BINARY_SUFFIX: # simulation result in binary format
+        return FullSample.frombinary(fname, gen)
     elif suffix == ".json":
         return FullSample.fromjson(fname)
     elif suffix == ".phase":
@@ -44,17 +142,59 @@ def createsample(fname, gen=None):
     raise ValueError
 
 
+def itersamples(fname, gen):
+    """
+    Yields instances of FullSample, one per replicate, from simulation results.
+
+    Unlike createsample, replicates are read one by one as they are consumed.
+    """
+    if os.path.splitext(fname)[1] == storage.BINARY_SUFFIX:
+        return FullSample.iterbinary(fname, gen)
+    return FullSample.itertsv(fname, gen)
+
+
+def encode(genos):
+    """
+    Maps genes to integer codes.
+
+    Genotypes are given per individual as a pair of genes per locus (e.g., nested
+    lists).  This function returns an array of codes of shape (individuals,
+    loci, 2) in the smallest unsigned type holding them, and per-locus lists of
+    labels, i.e., distinct genes in sorted order indexed by codes.
+    """
+    genes = np.asarray(genos)
+    if genes.ndim != 3:
+        # Genes are not of a single type (or not even pairs).
+        genes = np.array(genos, dtype=object)
+    codes = np.empty(genes.shape, dtype=np.int64)
+    labels = []
+    for locus in xrange(genes.shape[1]):
+        values, inverse = np.unique(genes[:, locus].ravel(), return_inverse=True)
+        labels.append(values.tolist())
+        codes[:, locus] = inverse.reshape(-1, 2)
+    ncode = max([len(i) for i in labels] + [1])
+    return codes.astype(np.min_scalar_type(ncode - 1)), labels
+
+
 class BasicSample(object):
     """
     This class holds genotypic information of sample, and it also provides
     serialization to various formats (currently RMES, PHASE, and NEXUS).
+
+    Genotypes are held as an integer array of shape (nsam, nloc, 2), whose
+    elements are codes of genes at each locus (see encode).  `genos` is either
+    genotypes as nested lists, which are encoded once here, or such an array of
+    codes together with per-locus `labels`.
     """
-    def __init__(self, src, ids, genos):
+    def __init__(self, src, ids, genos, labels=None):
+        if labels is None:
+            genos, labels = encode(genos)
         self._src = src
         self._ids = ids
-        self._genos = genos
-        self._nsam = len(genos)
-        self._nloc = len(genos[0])
+        self._codes = genos
+        self._labels = labels
+        self._genos = None
+        self._nsam, self._nloc = genos.shape[:2]
 
     @property
     def source(self):
@@ -75,8 +215,27 @@ class BasicSample(object):
         """
         Returns a list of genotypes in the sample.
         """
+        if self._genos is None:
+            genes = np.empty(self._codes.shape, dtype=object)
+            for locus, labels in enumerate(self._labels):
+                genes[:, locus] = np.array(labels, dtype=object)[self._codes[:, locus]]
+            self._genos = genes.tolist()
         return self._genos
 
+    @property
+    def codes(self):
+        """
+        Returns codes of genes in the sample as an array of shape (nsam, nloc, 2).
+        """
+        return self._codes
+
+    @property
+    def labels(self):
+        """
+        Returns per-locus lists of genes indexed by codes.
+        """
+        return self._labels
+
     @property
     def nsam(self):
         """
@@ -101,9 +260,8 @@ class BasicSample(object):
         idx = self._drawindividuals(nsam)
 
         ids = [self._ids[i] for i in idx]
-        genos = [[self._genos[i][j] for j in locs] for i in idx]
-
-        return BasicSample(self._src, ids, genos)
+        return BasicSample(self._src, ids, self._codes[idx][:, locs],
+                           [self._labels[j] for j in locs])
 
     def _checklocs(self, locs):
         """
@@ -115,12 +273,11 @@ class BasicSample(object):
         """
         # Sanity check: test if specified loci all exist.
         if locs == None:
-            ret = range(len(self._genos[0]))
+            ret = list(range(self._nloc))
         else:
-            nloc = len(self._genos[0])
-            if len([True for i in locs if i >= nloc]) > 0:
+            if len([True for i in locs if i >= self._nloc]) > 0:
                 raise ValueError("Specified locus outside of range")
-            ret = locs
+            ret = list(locs)
         return ret
 
 
@@ -135,7 +292,7 @@ class BasicSample(object):
         """
         Create an instance of BasicSample.
         """
-        with io.open(fname, "rU") as fhandle:
+        with io.open(fname, "r") as fhandle:
             next(fhandle)
             nloc = int(next(fhandle).strip())
             types = next(fhandle).strip()
@@ -164,7 +321,7 @@ class BasicSample(object):
 
         lines = [str(self._nsam), str(self._nloc), "M" * self._nloc]
 
-        for idx, geno in zip(self._ids, self._genos):
+        for idx, geno in zip(self._ids, self.genotypes):
             line = "\t".join([str(idx)] + [str(j) for i in geno for j in i])
             lines.append(line)
 
@@ -185,35 +342,47 @@ class BasicSample(object):
     def _afreqs(self):
         """
         Return allele frequency spectrum per-locus.
+
+        Frequencies at a locus are ordered by the first appearance of alleles.
         """
-        alleles = [[gene for ind in self._genos for gene in ind[loc]] for loc in xrange(self._nloc)]
-        return [[v / (2 * self._nsam) for v in Counter(a).values()] for a in alleles]
+        afreqs = []
+        for locus in xrange(self._nloc):
+            _, first, counts = np.unique(self._codes[:, locus].ravel(),
+                                         return_index=True, return_counts=True)
+            afreqs.append(counts[np.argsort(first)] / (2 * self._nsam))
+        return afreqs
 
     def _hobs(self):
         """
         Obtains per-locus observed heterozygosity.
         """
-        genos = [[ind[loc] for ind in self._genos] for loc in xrange(self._nloc)]
-        return [sum(1 if g[0] != g[1] else 0 for g in geno) / self.nsam for geno in genos]
+        return (self._codes[:, :, 0] != self._codes[:, :, 1]).sum(axis=0) / self._nsam
 
     @staticmethod
     def _hexp(afreqs):
         """
         Computes per-locus expected heterozygosity from allele frequency.
         """
-        return [1 - sum(a * a for a in locus) for locus in afreqs]
+        # cumsum adds frequencies one by one, as in summing them in python.
+        return np.array([1 - np.cumsum(locus * locus)[-1] for locus in afreqs])
 
-    def _fis(self, hobs, hexp, correct=False):
+    def _fis(self, hobs, hexp, correct=False, ngenes=None):
         """
         Computes inbreeding coefficient (Fis) per locus.
+
+        The bias correction assumes `ngenes` genes (by default, all genes in the
+        sample) at each locus.
         """
-        ngenes = 2 * self._nsam
-        if correct:
-            fis = [(exp - obs + obs / ngenes) / (exp - obs / ngenes)
-                   if exp - obs / ngenes != 0. else float('nan')
-                   for obs, exp in zip(hobs, hexp)]
-        else:
-            fis = [1 - obs / exp if exp != 0. else float('nan') for obs, exp in zip(hobs, hexp)]
+        hobs = np.asarray(hobs, dtype=float)
+        hexp = np.asarray(hexp, dtype=float)
+        if ngenes is None:
+            ngenes = 2 * self._nsam
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if correct:
+                denom = hexp - hobs / ngenes
+                fis = np.where(denom != 0., (hexp - hobs + hobs / ngenes) / denom, np.nan)
+            else:
+                fis = np.where(hexp != 0., 1 - hobs / hexp, np.nan)
 
         return fis
 
@@ -231,11 +400,13 @@ class BasicSample(object):
 
         nalleles = [len(a) for a in afreqs]
 
-        fis = self._fis(hobs, hexp, False)
-        fis2 = self._fis(hobs, hexp, True)
+        fis = self._fis(hobs, hexp, False).tolist()
+        fis2 = self._fis(hobs, hexp, True).tolist()
 
-        fis.append(self._fis([sum(hobs)], [sum(hexp)], False)[0])
-        fis2.append(self._fis([sum(hobs)], [sum(hexp)], True)[0])
+        hobs = hobs.tolist()
+        hexp = hexp.tolist()
+        fis.append(self._fis([sum(hobs)], [sum(hexp)], False).tolist()[0])
+        fis2.append(self._fis([sum(hobs)], [sum(hexp)], True).tolist()[0])
 
         hobs.append(sum(hobs) / len(hobs))
         hexp.append(sum(hexp) / len(hexp))
@@ -256,13 +427,157 @@ class BasicSample(object):
 
         return data
 
+    def _allelecopies(self):
+        """
+        Returns numbers of copies of alleles per individual as an array of shape
+        (nsam, total number of alleles), whose columns are alleles of the first
+        locus, then those of the second locus, and so on.
+        """
+        nlabels = np.array([len(i) for i in self._labels], dtype=np.int64)
+        ncol = int(nlabels.sum())
+        cols = self._codes.astype(np.int64) + (np.cumsum(nlabels) - nlabels)[:, None]
+        cols += np.arange(self._nsam, dtype=np.int64)[:, None, None] * ncol
+        copies = np.bincount(cols.ravel(), minlength=self._nsam * ncol)
+        return copies.reshape(self._nsam, ncol).astype(float)
+
+    def _resample(self, method, over, nrep, rng):
+        """
+        Returns sums over loci of observed and expected heterozygosities in
+        resampled samples, and the number of genes per locus in them.
+
+        All resamples are weighted sums of per-locus heterozygosities (over
+        loci) or of per-individual allele copies and heterozygotes (over
+        individuals), which are computed once.
+        """
+        if over == "loci":
+            hobs = self._hobs()
+            hexp = self._hexp(self._afreqs())
+            if method == "jackknife":
+                return hobs.sum() - hobs, hexp.sum() - hexp, 2 * self._nsam
+            weights = rng.multinomial(self._nloc, np.ones(self._nloc) / self._nloc, size=nrep)
+            return weights.dot(hobs), weights.dot(hexp), 2 * self._nsam
+
+        if over != "individuals":
+            raise ValueError("Unknown unit of resampling: {}".format(over))
+        copies = self._allelecopies()
+        hets = (self._codes[:, :, 0] != self._codes[:, :, 1]).sum(axis=1).astype(float)
+        if method == "jackknife":
+            nsam = self._nsam - 1
+            freqs = (copies.sum(axis=0) - copies) / (2 * nsam)
+            hexp = self._nloc - (freqs * freqs).sum(axis=1)
+            return (hets.sum() - hets) / nsam, hexp, 2 * nsam
+
+        nsam = self._nsam
+        weights = rng.multinomial(nsam, np.ones(nsam) / nsam, size=nrep).astype(float)
+        hexp = np.empty(nrep)
+        # Bound the memory held by allele frequencies of resamples.
+        block = max(1, _BLOCKSIZE // max(1, copies.shape[1]))
+        for start in xrange(0, nrep, block):
+            freqs = weights[start:start + block].dot(copies) / (2 * nsam)
+            hexp[start:start + block] = self._nloc - (freqs * freqs).sum(axis=1)
+        return weights.dot(hets) / nsam, hexp, 2 * nsam
+
+    def confidenceinterval(self, method="bootstrap", over="loci", nrep=1000, level=0.95,
+                           rng=None):
+        """
+        Compute confidence intervals of overall Fis and bias-corrected Fis by
+        resampling loci or individuals (`over`).
+
+        With method "bootstrap", `nrep` samples are drawn with replacement using
+        a NumPy RandomState `rng`, and limits are percentiles of their
+        estimates.  With method "jackknife", each locus (or individual) is left
+        out in turn, and limits are drawn from the normal distribution with the
+        jackknife standard error.
+
+        This method returns a dict per statistic ("fis" and "fisc") holding the
+        point estimate, lower and upper limits, and the standard error.
+        """
+        if method not in ("bootstrap", "jackknife"):
+            raise ValueError("Unknown method of resampling: {}".format(method))
+        if not 0. < level < 1.:
+            raise ValueError("Confidence level must be between 0 and 1")
+        if rng is None:
+            rng = np.random.RandomState()
+
+        overall = self.inbreedingcoefficient()[-1]
+        hobs, hexp, ngenes = self._resample(method, over, nrep, rng)
+
+        data = []
+        for key in ["fis", "fisc"]:
+            values = self._fis(hobs, hexp, key == "fisc", ngenes)
+            values = values[~np.isnan(values)]
+            estimate = overall[key]
+            if method == "bootstrap" and len(values) > 1:
+                lower, upper = np.percentile(values, [50 * (1 - level), 50 * (1 + level)])
+                se = values.std(ddof=1)
+            elif method == "jackknife" and len(values) > 1:
+                nunit = len(values)
+                se = np.sqrt((nunit - 1) / nunit * ((values - values.mean()) ** 2).sum())
+                width = _normalquantile((1 + level) / 2) * se
+                lower, upper = estimate - width, estimate + width
+            else:
+                lower = upper = se = np.nan
+            data.append({
+                "key": key,
+                "estimate": estimate,
+                "lower": float(lower),
+                "upper": float(upper),
+                "se": float(se)})
+
+        return data
+
+    def selfingrate(self, level=0.95, maxgen=_MAXGEN):
+        """
+        Estimate the selfing rate by maximum likelihood from the distribution of
+        multilocus heterozygosity, as RMES does (David et al. 2007).
+
+        Loci without heterozygotes carry no information on the selfing rate and
+        are ignored.  Limits of the confidence interval at `level` are where the
+        profile log-likelihood drops by half the chi-square quantile (1 d.f.).
+
+        This method returns a dict holding the estimate ("selfing"), lower and
+        upper limits, the maximum log-likelihood, and the number of loci used.
+        """
+        if not 0. < level < 1.:
+            raise ValueError("Confidence level must be between 0 and 1")
+        hets = self._codes[:, :, 0] != self._codes[:, :, 1]
+        hets = hets[:, hets.any(axis=0)]
+        if hets.shape[1] == 0:
+            return {"selfing": np.nan, "lower": np.nan, "upper": np.nan,
+                    "loglik": np.nan, "nloc": 0}
+        patterns, counts = np.unique(hets, axis=0, return_counts=True)
+
+        selfing, theta, loglik = _rmesem(patterns, counts, maxgen=maxgen)
+        threshold = loglik - _normalquantile((1 + level) / 2) ** 2 / 2
+
+        def profile(rate):
+            return _rmesem(patterns, counts, rate, theta, maxgen)[2] >= threshold
+
+        def bound(inside, outside):
+            if profile(outside):
+                return outside
+            for _ in xrange(30):
+                mid = (inside + outside) / 2
+                if profile(mid):
+                    inside = mid
+                else:
+                    outside = mid
+            return (inside + outside) / 2
+
+        return {
+            "selfing": float(selfing),
+            "lower": float(bound(selfing, 0.)),
+            "upper": float(bound(selfing, 1 - 1e-9)),
+            "loglik": float(loglik),
+            "nloc": hets.shape[1]}
+
 class FullSample(BasicSample):
     """
     In addition to what BasicSample holds, this class also holds the number
     of generations until the last outcrossing event.
     """
-    def __init__(self, src, ids, genos, inbgens):
-        super(FullSample, self).__init__(src, ids, genos)
+    def __init__(self, src, ids, genos, inbgens, labels=None):
+        super(FullSample, self).__init__(src, ids, genos, labels)
         self._inbgens = inbgens
 
     @property
@@ -282,9 +597,8 @@ class FullSample(BasicSample):
 
         ids = [self._ids[i] for i in idx]
         inbs = [self._inbgens[i] for i in idx]
-        genos = [[self._genos[i][j] for j in locs] for i in idx]
-
-        return FullSample(self._src, ids, genos, inbs)
+        return FullSample(self._src, ids, self._codes[idx][:, locs], inbs,
+                          [self._labels[j] for j in locs])
 
     @staticmethod
     def fromtsv(fname, gen):
@@ -300,37 +614,59 @@ class FullSample(BasicSample):
 
         If specified generations are not recorded, this returns an empty list.
         """
-        samples = []
-        with io.open(fname, utils.getmode("r")) as fhandle:
-            reader = csv.reader(fhandle, delimiter=_str("\t"))
-            # Throw out a header row
-            next(fhandle)
-            rows = [row for row in reader if int(row[1]) == gen]
-
-            # sanity check 1: total number of chromosomes (rows) must be multiple
-            # of 2, as diploids have two chromosomes.
-            if len(rows) % 2 != 0:
-                raise ValueError("Number of chromosomes not mulitple of 2")
+        return list(FullSample.itertsv(fname, gen))
 
+    @staticmethod
+    def itertsv(fname, gen):
+        """
+        Yield instances of FullSample from simulation results one replicate at
+        a time (see fromtsv).
 
-            for _, rawdata in groupby(rows, lambda x: x[0]):
-                irawdata = iter(rawdata)
+        Rows are read as the instances are consumed, and only rows of the
+        current replicate are held in memory.
+        """
+        rows = storage.read_rows(fname, gen)
+        for _, rawdata in groupby(rows, lambda x: x[0]):
+            ids = []
+            inbgens = []
+            genos = []
+            for first in rawdata:
+                second = next(rawdata, None)
+                # sanity check 1: total number of chromosomes (rows) must be
+                # multiple of 2, as diploids have two chromosomes.
+                if second is None:
+                    raise ValueError("Number of chromosomes not mulitple of 2")
+                # sanity check 2: a pair of chromosomes has to be from a single
+                # individual.
+                if first[2] != second[2]:
+                    raise ValueError("Chromosomes come from different individual")
+                ids.append(first[2])
+                inbgens.append(int(float(first[3])))
+                genos.append([[gvals[0], gvals[1]] for gvals in zip(first[5:], second[5:])])
+
+            yield FullSample(fname, ids, genos, inbgens)
 
-                ids = []
-                inbgens = []
-                genos = []
-                for vals in izip(irawdata, irawdata):
-                    # sanity check 2: a pair of chromosomes has to be from a single
-                    # individual.
-                    if vals[0][2] != vals[1][2]:
-                        raise ValueError("Chromosomes come from different individual")
-                    ids.append(vals[0][2])
-                    inbgens.append(int(float(vals[0][3])))
-                    genos.append([[gvals[0], gvals[1]] for gvals in zip(vals[0][5:], vals[1][5:])])
+    @staticmethod
+    def frombinary(fname, gen):
+        """
+        Create list of instances of FullSample from simulation results in the
+        binary format (see selfingsim.storage.BinaryWriter).
 
-                samples.append(FullSample(fname, ids, genos, inbgens))
+        As with fromtsv, this function returns a FullSample instance per
+        replicate recorded at the specified generation.  Genes are strings just
+        like those read from a tsv file.
+        """
+        return list(FullSample.iterbinary(fname, gen))
 
-        return samples
+    @staticmethod
+    def iterbinary(fname, gen):
+        """
+        Yield instances of FullSample from simulation results in the binary
+        format one replicate at a time (see frombinary).
+        """
+        for _, inbgens, genes in storage.read_snapshots(fname, gen):
+            ids = [str(i) for i in xrange(len(inbgens))]
+            yield FullSample(fname, ids, genes.transpose(0, 2, 1), inbgens.tolist())
 
     @staticmethod
     def fromjson(fname):
@@ -353,7 +689,7 @@ class FullSample(BasicSample):
         Write this sample to json-formatted string.
         """
 
-        data = [[i, j, k] for i, j, k in zip(self._ids, self._inbgens, self._genos)]
+        data = [[i, j, k] for i, j, k in zip(self._ids, self._inbgens, self.genotypes)]
 
         return str(json.dumps(data))
 
@@ -0,0 +1,184 @@
+"""
+selfingsim.genostore
+====================
+
+Memory-mapped genotype store of samples.
+
+Reading a whole population (from simulation results) or a whole sample (from a
+JSON file) just to draw a few individuals from it is wasteful, especially when
+the same file is sampled repeatedly.  The first time a file is read through
+`load`, its samples are saved in a store next to the file (named after the file,
+the generation, and suffix ".store"), and later reads map the store instead of
+parsing the file again.
+
+A store is a directory holding, per replicate, three NumPy arrays: genes as
+fixed-width integer codes of shape (individuals, loci, 2), the numbers of selfing
+generations, and IDs of individuals.  Codes index into per-locus lists of genes
+kept in a small JSON file with the size and modification time of the original
+file (see `data.encode`).  A store is rebuilt if the original file has changed.
+IDs keep their type: integer IDs (which JSON samples may have) are stored as
+integers, and IDs of mixed types are kept in the JSON file instead of an array.
+
+Samples loaded from a store are instances of FullSample holding the mapped codes,
+and their IDs and numbers of selfing generations are read from the mapped arrays
+only when accessed.  Hence, drawing individuals from them (e.g., with
+`FullSample.sample`) reads only the selected rows.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import numbers
+import os
+import shutil
+import tempfile
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+import numpy as np
+
+from . import data
+from . import utils
+
+# Suffix of a store.
+SUFFIX = ".store"
+
+
+class MappedValues(object):
+    """
+    A read-only sequence of values (e.g., IDs) of individuals backed by an array.
+
+    Items are converted by `convert` (e.g., str) as they are read.
+    """
+    def __init__(self, values, convert):
+        self._values = values
+        self._convert = convert
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, idx):
+        return self._convert(self._values[idx])
+
+
+def get_path(fname, gen=None):
+    """
+    Returns the name of a store of samples read from a file.
+    """
+    if gen is None:
+        return fname + SUFFIX
+    return "{}.gen_{}{}".format(fname, gen, SUFFIX)
+
+
+def _signature(fname):
+    stat = os.stat(fname)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def _read_meta(path):
+    try:
+        with io.open(os.path.join(path, "meta.json"), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _id_type(ids):
+    # Booleans are integers to Python but not to JSON.
+    if all(isinstance(i, numbers.Integral) and not isinstance(i, bool) for i in ids):
+        return "int"
+    if all(isinstance(i, basestring) for i in ids):
+        return "str"
+    return None
+
+
+def _read(fname, gen):
+    if gen is None:
+        return [data.createsample(fname)]
+    return data.itersamples(fname, gen)
+
+
+def build(fname, gen=None):
+    """
+    Saves samples read from a file in a store, and returns the name of the store.
+
+    The store is written to a temporary directory and then renamed, so a store
+    is never seen half-written.  If another process builds the same store at the
+    same time, one of them wins.
+    """
+    path = get_path(fname, gen)
+    signature = _signature(fname)
+    tmp = tempfile.mkdtemp(prefix=os.path.basename(path) + ".",
+                           dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        replicates = []
+        for rep, sample in enumerate(_read(fname, gen)):
+            np.save(os.path.join(tmp, "{}.genes.npy".format(rep)), sample.codes)
+            np.save(os.path.join(tmp, "{}.tselfing.npy".format(rep)),
+                    np.array(sample.tselfing, dtype=np.int64))
+            ids = list(sample.ids)
+            id_type = _id_type(ids)
+            if id_type is None:
+                replicates.append({"labels": sample.labels, "ids": ids})
+                continue
+            np.save(os.path.join(tmp, "{}.ids.npy".format(rep)),
+                    np.array(ids, dtype=np.int64 if id_type == "int" else None))
+            replicates.append({"labels": sample.labels, "id type": id_type})
+        with io.open(os.path.join(tmp, "meta.json"), "w") as f:
+            f.write(json.dumps({"source": signature, "replicates": replicates}))
+
+        if os.path.exists(path):
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            utils.replace(tmp, path)
+        except OSError:
+            # Another process has just built the store.
+            pass
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return path
+
+
+def _map(fname):
+    # Plain arrays are much faster to index than memmap, and they still read
+    # the mapped file.
+    return np.load(fname, mmap_mode="r").view(np.ndarray)
+
+
+def load(fname, gen=None):
+    """
+    Returns samples (one per replicate) in a file through its store.
+
+    As with `data.createsample`, `gen` is the generation of simulation results,
+    and it must be None for a sample in a JSON file.  The store is built if it
+    does not exist or is out of date.  If it cannot be built (e.g., in a
+    read-only directory), samples are read from the file as usual.
+    """
+    path = get_path(fname, gen)
+    meta = _read_meta(path)
+    if meta is None or meta["source"] != _signature(fname):
+        try:
+            build(fname, gen)
+        except (IOError, OSError):
+            return list(_read(fname, gen))
+        meta = _read_meta(path)
+
+    samples = []
+    for rep, replicate in enumerate(meta["replicates"]):
+        prefix = os.path.join(path, str(rep))
+        codes, tselfing = [_map(prefix + suffix) for suffix in [".genes.npy", ".tselfing.npy"]]
+        if "ids" in replicate:
+            ids = replicate["ids"]
+        else:
+            # Stores built before IDs kept their type hold strings.
+            convert = int if replicate.get("id type") == "int" else str
+            ids = MappedValues(_map(prefix + ".ids.npy"), convert)
+        samples.append(data.FullSample(fname, ids, codes,
+                                       MappedValues(tselfing, int), replicate["labels"]))
+    return samples
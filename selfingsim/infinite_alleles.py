@@ -9,15 +9,16 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import csv
-import io
 import sys
 
 import simuOpt
 simuOpt.setOptions(alleleType='long')
 import simuPOP as simu
+from . import burnin
+from . import checkpoint
+from . import coalescent
 from . import common as cf
-from . import utils
+from . import storage
 
 def get_init_genotype_by_prop(prop):
     """
@@ -28,6 +29,27 @@ def get_init_genotype_by_prop(prop):
     return (len(prop), simu.InitGenotype(prop=[p / s for p in prop]))
 
 
+def get_init_genotype_by_equilibrium(config, mutator, field='self_gen'):
+    """
+    Sets up initial genotypes and numbers of selfing generations drawn from
+    equilibrium (see selfingsim.coalescent).
+
+    Alleles are drawn when the operator is applied, and `mutator` is then told the
+    next unused allele.
+    """
+    field = str(field)
+
+    def init(pop):
+        next_idx, geno, selfing = coalescent.draw_allele_genotypes(cf.get_numpy_rng(simu),
+                                                                   config)
+        cf.set_genotype(pop, geno)
+        pop.setIndInfo(selfing.tolist(), field)
+        mutator.set_state({'idx': [[next_idx] * config.loci]})
+        return True
+
+    return simu.PyOperator(func=init)
+
+
 def get_mutation_operator(m_rate, loci, nrep, burnin, new_idx=0):
     """
     Sets up a mutation scheme under the infinite alleles model.
@@ -46,53 +68,45 @@ def get_mutation_operator(m_rate, loci, nrep, burnin, new_idx=0):
 
         def mutate(self, pop):
             """Add mutations to organisms."""
-            rng = simu.getRNG()
-
-            dvars = pop.dvars()
-            rep = dvars.rep
-            gen = dvars.gen - burnin
-
-            for i, ind in enumerate(pop.individuals()):
-                for locus in range(loci):
-                    for ploidy in range(2):
-                        if  rng.randUniform() < m_rate[locus]:
-                            ind.setAllele(self.idx[rep][locus], locus, ploidy=ploidy)
-                            self.idx[rep][locus] += 1
+            rng = cf.get_numpy_rng(simu)
+            rep = pop.dvars().rep
+
+            # Genes are numbered by individuals then by ploidy, so new alleles are
+            # assigned in the same order as scanning individuals one by one.
+            for locus, genes in cf.sample_mutations(rng, m_rate, 2 * pop.popSize()):
+                for gene in genes.tolist():
+                    ind, ploidy = divmod(gene, 2)
+                    pop.individual(ind).setAllele(self.idx[rep][locus], locus, ploidy=ploidy)
+                    self.idx[rep][locus] += 1
             return True
 
+        def get_state(self):
+            """Returns the next new alleles for a checkpoint."""
+            return {'idx': self.idx}
+
+        def set_state(self, state):
+            """Restores the next new alleles from a checkpoint."""
+            self.idx = state['idx']
+
     return MyMutator()
 
 
-def get_output_operator(config, field='self_gen'):
+def get_output_operator(config, writer, field='self_gen'):
     """
-    Sets up an operator to write out simulation results (and progress).
+    Sets up an operator to write out simulation results (and progress) through
+    `writer`.
     """
-    output = config.outfile
     output_per = config.output_per
-    N = config.N
     burnin = config.burnin
     ngen = config.gens
 
-    header = [
-        'replicate',
-        'generation',
-        'individual',
-        'number of selfing',
-        'chromosome'
-    ] + ['locus {}'.format(i) for i in range(config.loci)]
-
-    # For compatibility with python2.
-    # csv module does not support unicode.
-    delim = str("\t")
     field = str(field)
 
     class MyWriter(simu.PyOperator):
         """A class handling output of genetic information of the entire population."""
 
         def __init__(self):
-            with io.open(output, utils.getmode("w")) as f:
-                writer = csv.DictWriter(f, header, delimiter=delim)
-                writer.writeheader()
+            self._writer = writer
 
             if output_per > 0:
                 ats = [i + burnin for i in range(0, ngen, output_per)]
@@ -102,38 +116,16 @@ def get_output_operator(config, field='self_gen'):
 
 
         def write(self, pop):
-            # In order to keep output file structure simple, all
-            # information regarding to simulation such as model
-            # parameters are included into each row.  This obviously
-            # caused repetition of simulation-wide parameters many
-            # times and excessive use of storage space.  However, I
-            # consider an upside, the simplicity of the output file
-            # structure, is well worth the cost.
-
-            with io.open(output, utils.getmode("a")) as f:
-                dvars = pop.dvars()
-                rep = dvars.rep
-                gen = dvars.gen
-
-                writer = csv.DictWriter(f, header, delimiter=delim)
-
-                # write genotype row by row.  Each row contains a list
-                # of genes on a single chromosome.  Because simulated
-                # organisms are diploid, each individual occupy two
-                # (successive) rows.
-                for idx, ind in enumerate(pop.individuals()):
-                    selfing = ind.info(field)
-                    for ploidy in range(2):
-                        geno = list(ind.genotype(ploidy=ploidy))
-                        writer.writerow({key: value for key, value in
-                                         zip(header,
-                                             [rep, gen, idx, int(selfing), ploidy] + geno)})
-
+            dvars = pop.dvars()
+            # Genotypes are a copy, so they are written in the background while
+            # the population evolves further.
+            genotypes = cf.get_genotype(pop)
+            self._writer.write(config.replicate, dvars.gen, pop.indInfo(field), genotypes)
             return True
 
     return MyWriter()
 
-def execute(config, pop, mating_op):
+def execute(config, pop, mating_op, tagger_op):
     """
     Executes simulations with appropriate mutation model and mating scheme.
     """
@@ -148,6 +140,9 @@ def execute(config, pop, mating_op):
         next_idx, init_genotype_op = cf.get_init_genotype_by_count(simu, init[1])
     elif init[0] == 'frequency':
         next_idx, init_genotype_op = get_init_genotype_by_prop(init[1])
+    elif init[0] == 'equilibrium':
+        # The next unused allele is known only after alleles are drawn.
+        next_idx, init_genotype_op = 0, None
 
     init_info_op = cf.get_init_info(simu)
 
@@ -157,32 +152,83 @@ def execute(config, pop, mating_op):
                                         burnin=config.burnin,
                                         new_idx=next_idx)
 
-    output_op = get_output_operator(config)
+    if init_genotype_op is None:
+        init_genotype_op = get_init_genotype_by_equilibrium(config, mutation_op)
+
+    def burn_in(seed):
+        """Returns a state of the population at the end of burn-in."""
+        simu.setRNG(seed=seed)
+        simulator = simu.Simulator(pops=pop, rep=1)
+        simulator.evolve(
+            initOps=[init_info_op, init_genotype_op],
+            preOps=mutation_op,
+            matingScheme=mating_op,
+            postOps=[tagger_op],
+            gen=config.burnin)
+        return {'gen': config.burnin,
+                'mutator': mutation_op.get_state(),
+                'population': checkpoint.dump_population(simulator.population(0),
+                                                         burnin.get_path(config))}
+
+    seed = config.seed if config.seed is not None else simu.getRNG().seed()
+    state = checkpoint.load(config)
+    if state is None:
+        state = burnin.load(config, burn_in)
+        if state is not None:
+            # A simulation forked from a shared burn-in draws its own random numbers.
+            simu.setRNG(seed=seed)
+            state = dict(state, seed=seed, offset=None)
+
+    if state is None:
+        init_ops = [init_info_op, init_genotype_op]
+        writer = storage.get_writer(config.outfile, config.loci)
+        start = 0
+    else:
+        pop = checkpoint.load_population(simu, state['population'], checkpoint.get_path(config))
+        mutation_op.set_state(state['mutator'])
+        init_ops = []
+        seed = state['seed']
+        writer = storage.get_writer(config.outfile, config.loci, offset=state['offset'])
+        start = state['gen']
+
+    output_op = get_output_operator(config, writer)
+    checkpoint_op = checkpoint.get_checkpoint_operator(simu, config, writer, mutation_op, seed)
 
     simulator = simu.Simulator(pops=pop, rep=1)
 
+    # The selfing tagger must precede any operator reading `self_gen`.
+    post_op = [tagger_op]
     if config.debug > 0:
-        post_op = [simu.Stat(alleleFreq=simu.ALL_AVAIL, step=config.debug),
-                   simu.PyEval(r"'%s\n' % alleleFreq", step=config.debug)]
-    else:
-        post_op = []
+        post_op.extend([simu.Stat(alleleFreq=simu.ALL_AVAIL, step=config.debug),
+                        simu.PyEval(r"'%s\n' % alleleFreq", step=config.debug)])
 
     if config.output_per > 0:
         post_op.append(output_op)
 
-    simulator.evolve(
-        initOps=[init_info_op, init_genotype_op],
-        preOps=mutation_op,
-        matingScheme=mating_op,
-        postOps=post_op,
-        finalOps=output_op,
-        gen=config.gens + config.burnin)
+    # The writer is closed even if the simulation fails, so that states written
+    # so far (including the final one written by finalOps) are flushed.
+    try:
+        # A resumed population carries its generation, so it evolves only the rest.
+        simulator.evolve(
+            initOps=init_ops,
+            preOps=[checkpoint_op, mutation_op],
+            matingScheme=mating_op,
+            postOps=post_op,
+            finalOps=output_op,
+            gen=config.gens + config.burnin - start)
+    finally:
+        writer.close()
+
+    checkpoint.remove(config)
 
 
 def run(config):
     """
     Runs simulations under an appropriate mating scheme.
     """
+    if config.seed is not None:
+        simu.setRNG(seed=config.seed)
+
     if config.mating_model == 'androdioecy':
         cf.androdioecy(simu, execute, config)
     elif config.mating_model == 'gynodioecy':
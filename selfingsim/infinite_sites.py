@@ -10,110 +10,19 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 # standard imports
-import csv
-import io
 import sys
 
+import numpy as np
+
 import simuOpt
 simuOpt.setOptions(alleleType='binary')
 import simuPOP as simu
 
+from . import burnin
+from . import checkpoint
+from . import coalescent
 from . import common as cf
-from . import utils
-
-
-def get_pure_hermaphrodite_mating(r_rate, weight, size, loci, allele_length, field='self_gen'):
-    """
-    Construct mating scheme for pure hermaphrodite with partial selfing under the
-    infinite sites model.
-
-    A fraction, 0 <= weight <= 1, of offspring is generated by selfing, and others are
-    generated by outcrossing.  In this model, there is no specific sex so that any
-    individual can mate with any other individuals in a population.
-    Furthermore, a parent can participate in both selfing and outcrossing.
-    """
-    field = str(field)
-    # Index of sites, after which recombinations happen.
-    rec_loci = [allele_length * i - 1 for i in range(1, loci + 1)]
-    selfing = simu.SelfMating(ops=[simu.Recombinator(rates=r_rate,
-                                                     loci=rec_loci),
-                                   cf.MySelfingTagger(field)],
-                              weight=weight)
-
-    outcross = simu.HomoMating(chooser=simu.PyParentsChooser(generator=cf.pickTwoParents),
-                               generator=simu.OffspringGenerator(
-                                   ops=[simu.Recombinator(rates=r_rate,
-                                                          loci=rec_loci),
-                                        cf.MyOutcrossingTagger(field)]),
-                               weight=1.0 - weight)
-
-    return simu.HeteroMating(matingSchemes=[selfing, outcross],
-                             subPopSize=size)
-
-
-def get_androdioecious_mating(
-        r_rate,
-        weight,
-        size,
-        sex_ratio,
-        loci,
-        allele_length,
-        field='self_gen'):
-    """
-    Sets up androdioecious mating.
-    """
-
-    sex_mode = (simu.PROB_OF_MALES, sex_ratio)
-
-    rec_loci = [allele_length * i - 1 for i in range(1, loci + 1)]
-
-    selfing = simu.SelfMating(ops=[simu.Recombinator(rates=r_rate,
-                                                     loci=rec_loci),
-                                   cf.MySelfingTagger(field)],
-                              sexMode=sex_mode,
-                              subPops=[(0, 1)],
-                              weight=weight)
-
-    outcross = simu.RandomMating(ops=[simu.Recombinator(rates=r_rate,
-                                                        loci=rec_loci)],
-                                 sexMode=sex_mode,
-                                 weight=weight)
-
-    return simu.HeteroMating(matingSchemes=[selfing, outcross],
-                             subPopSize=size)
-
-
-def get_gynodioecious_mating(
-        r_rate,
-        weight,
-        size,
-        sex_ratio,
-        loci,
-        allele_length,
-        field='self_gen'):
-    """
-    Sets up gynodioecious mating.
-    """
-
-    sex_mode = (simu.PROB_OF_MALES, sex_ratio)
-
-    rec_loci = [allele_length * i - 1 for i in range(1, loci + 1)]
-
-    selfing = simu.SelfMating(ops=[simu.Recombinator(rates=r_rate,
-                                                     loci=rec_loci),
-                                   cf.MySelfingTagger(field)],
-                              sexMode=sex_mode,
-                              subPops=[(0, 0)],
-                              weight=weight)
-
-    outcross = simu.RandomMating(ops=[simu.Recombinator(rates=r_rate,
-                                                        loci=rec_loci),
-                                      cf.MySelfingTagger(field)],
-                                 sexMode=sex_mode,
-                                 weight=weight)
-
-    return simu.HeteroMating(matingSchemes=[selfing, outcross],
-                             subPopSize=size)
+from . import storage
 
 
 def get_mutation_operator(m_rate, loci, allele_length, nrep, burnin):
@@ -125,138 +34,162 @@ def get_mutation_operator(m_rate, loci, allele_length, nrep, burnin):
         A mutation operator representing the infinite sites model.
 
         A new mutation occurs at a distinct site from any previous mutated sites.
+
+        In addition to sites available for new mutations, this operator keeps
+        sites occupied by mutations.  Only `reclaim` needs to know which of
+        them are lost or fixed, so derived alleles are counted there (and only
+        there) rather than in every generation.
         """
         def __init__(self):
             self.available = list(list(range(i * allele_length, (i + 1) * allele_length)
                                        for i in range(loci))
                                   for r in range(nrep))
+            self.used = list(list(set() for i in range(loci)) for r in range(nrep))
             super(MyMutator, self).__init__(func=self.mutate)
 
 
         def mutate(self, pop):
             """Add mutations to organisms."""
-            rng = simu.getRNG()
+            rng = cf.get_numpy_rng(simu)
 
             dvars = pop.dvars()
             rep = dvars.rep
-            gen = dvars.gen - burnin
-
-            for ind in pop.individuals():
-                for locus in range(loci):
-                    for ploidy in range(2):
-                        if rng.randUniform() < m_rate[locus]:
-                            try:
-                                idx = self.available[rep][locus].pop()
-                            except IndexError:
-                                if self.reclaim(pop, rep, locus):
-                                    idx = self.available[rep][locus].pop()
-                                else:
-                                    sys.stderr.write(
-                                        '[ERROR] rep={}, gen={}: available sites exhausted.\n'.
-                                        format(rep, gen - burnin))
-                                    return False
-
-                            # A site is represented by 1 bit.  An
-                            # ancestral state is always represented by
-                            # 0, and mutated state is therefore always
-                            # 1.
-                            ind.setAllele(1, idx, ploidy=ploidy)
+
+            for locus, genes in cf.sample_mutations(rng, m_rate, 2 * pop.popSize()):
+                for gene in genes.tolist():
+                    ind, ploidy = divmod(gene, 2)
+                    try:
+                        idx = self.available[rep][locus].pop()
+                    except IndexError:
+                        if self.reclaim(pop, rep, locus):
+                            idx = self.available[rep][locus].pop()
+                        else:
+                            sys.stderr.write(
+                                '[ERROR] rep={}, gen={}: available sites exhausted.\n'.
+                                format(rep, dvars.gen - burnin))
+                            return False
+
+                    # A site is represented by 1 bit.  An
+                    # ancestral state is always represented by
+                    # 0, and mutated state is therefore always
+                    # 1.
+                    pop.individual(ind).setAllele(1, idx, ploidy=ploidy)
+                    self.used[rep][locus].add(idx)
             return True
 
 
         def reclaim(self, pop, rep, locus):
             """
-            Scan and reuse monomorphic sites.
+            Reuse monomorphic sites.
 
             A new mutation uses up one available site/locus.  After enough mutations
             appear in a population, a simulation exhausts all sites/loci.  However,
             some of such mutations may be either extinct from or fixed in a current
             population.  Extinct mutations will never come back to the population, and
             fixed mutations likewise never returns to ancestral states.  Therefore,
-            those sites occupied by such mutations can be freed and reused.  This method
-            scans all sites to find monomorphic sites.  Once the monomorphic sites are
-            identified, those sites are re-initialized and registered to a list of all
-            available sites.
+            those sites occupied by such mutations can be freed and reused.  Derived
+            alleles at occupied sites of the locus are counted with simuPOP's native
+            allele counting, so that lost and fixed mutations are found without
+            scanning genotypes in Python.  Fixed sites are re-initialized, and then
+            both are registered to a list of all available sites.
             """
-            start = locus * allele_length
-            raw_geno = list(pop.genotype())
-            stride = loci * allele_length
-            available = [loc for loc in range(start, start + allele_length)
-                         if len(set(raw_geno[loc::stride])) == 1]
-
-            if len(available) == 0:
-                # Even after scanning all sites, there is no unused site.
+            used = self.used[rep][locus]
+            sites = sorted(used)
+            if len(sites) == 0:
+                return False
+
+            nchrom = 2 * pop.popSize()
+            simu.stat(pop, alleleFreq=sites, vars=['alleleNum'])
+            nums = pop.dvars().alleleNum
+            lost = [site for site in sites if nums[site][1] == 0]
+            fixed = [site for site in sites if nums[site][1] == nchrom]
+
+            if len(lost) + len(fixed) == 0:
+                # Every mutation is segregating, so there is no site to free.
                 return False
 
             # Re-initialize newly freed sites by setting their values 0.
-            for ind in pop.individuals():
-                for site in available:
-                    ind.setAllele(0, site, ploidy=0)
-                    ind.setAllele(0, site, ploidy=1)
-            self.available[rep][locus] = available
+            if len(fixed) > 0:
+                simu.initGenotype(pop, genotype=0, loci=fixed)
+            used.difference_update(lost + fixed)
+            self.available[rep][locus] = lost + fixed
+            return True
+
+
+        def get_state(self):
+            """
+            Returns available and occupied sites for a checkpoint.
+            """
+            return {'available': self.available, 'used': self.used}
+
+
+        def set_state(self, state):
+            """
+            Restores available and occupied sites from a checkpoint.
+
+            Older checkpoints hold counts of derived alleles keyed by occupied sites.
+            """
+            self.available = state['available']
+            if 'used' in state:
+                self.used = state['used']
+            else:
+                self.used = list(list(set(counts) for counts in rep_counts)
+                                 for rep_counts in state['counts'])
 
 
     return MyMutator()
 
 
-def get_output_operator(config, field='self_gen'):
+def get_init_genotype_by_equilibrium(config, mutator, field='self_gen'):
     """
-    Sets up operator for writing out simulation results (and progress).
+    Sets up initial genotypes and numbers of selfing generations drawn from
+    equilibrium (see selfingsim.coalescent).
+
+    Mutations segregating in the initial population occupy available sites of
+    `mutator`, and those sites are registered to it as occupied.
+    """
+    field = str(field)
+
+    def init(pop):
+        rng = cf.get_numpy_rng(simu)
+        selfing, loci = coalescent.draw_population(rng, config, coalescent.draw_haplotypes)
+        available = mutator.available[0]
+        used = mutator.used[0]
+        genotype = cf.get_genotype(pop)
+        for locus, ((index, haplotypes), lineages) in enumerate(loci):
+            nmut = len(frozenset().union(*haplotypes))
+            if nmut > len(available[locus]):
+                sys.exit('"allele length" is too short to hold {} segregating sites.'.
+                         format(nmut))
+            # Mutations are numbered from the oldest, and they take sites in the
+            # same order as new mutations do.
+            sites = [available[locus].pop() for _ in range(nmut)]
+            states = np.zeros((len(haplotypes), nmut), dtype=np.int64)
+            for hid, haplotype in enumerate(haplotypes):
+                states[hid, list(haplotype)] = 1
+            genes = states[index[lineages]]
+            genotype[:, :, sites] = genes
+            used[locus] = set(sites)
+        cf.set_genotype(pop, genotype)
+        pop.setIndInfo(selfing.tolist(), field)
+        return True
+
+    return simu.PyOperator(func=init)
+
+
+def get_output_operator(config, writer, field='self_gen'):
+    """
+    Sets up operator for writing out simulation results (and progress) through
+    `writer`.
     """
     field = str(field)
 
-    output = config.outfile
     output_per = config.output_per
-    N = config.N
     burnin = config.burnin
     ngen = config.gens
     loci = config.loci
     allele_length = config.allele_length
 
-    data = ['infinite sites',
-            N,
-            ngen,
-            1,
-            loci,
-            config.m,
-            config.s,
-            config.r,
-            burnin,
-            config.a,
-            config.tau]
-
-    header = ['mutation model',
-              'number of individuals',
-              'number of generations',
-              'number of replicates',
-              'number of loci',
-              'mutation rate',
-              'selfing rate',
-              'recombination rate',
-              'number of burnin generations',
-              'a',
-              'tau']
-
-    try:
-        data.append(config.sigma)
-        header.append('sigma')
-    except:
-        pass
-
-    if config.model != 'pure hermaphrodite':
-        data.append(config.sex_ratio)
-        header.append('sex ratio')
-
-    if config.model == 'gynodioecy':
-        data.append(config.h)
-        header.append('H')
-
-    header.extend(['replicate',
-                   'generation',
-                   'individual',
-                   'number of selfing',
-                   'chromosome'] + ['locus {}'.format(i) for i in range(loci)])
-
     class MyWriter(simu.PyOperator):
         """A class handling output of genetic information of the entire population."""
 
@@ -267,11 +200,7 @@ def get_output_operator(config, field='self_gen'):
             # sites, which can hold polymorphic sites, and it is
             # there for strictly an implementation reason (albeit user
             # configurable).
-            self._output = output
-
-            with io.open(output, utils.getmode('w')) as f:
-                writer = csv.DictWriter(f, header)
-                writer.writeheader()
+            self._writer = writer
 
             if output_per > 0:
                 ats = [i + burnin for i in range(0, ngen, output_per)]
@@ -282,51 +211,25 @@ def get_output_operator(config, field='self_gen'):
         def write(self, pop):
             """
             Writes population state into a file.
+
+            A gene at a locus is written as a hexadecimal number, whose bits
+            represent states of polymorphic sites at the locus in the order of
+            sites.
             """
-            # In order to keep output file structure simple, all
-            # information regarding to simulation such as model
-            # parameters are included into each row.  This obviously
-            # caused repetition of simulation-wide parameters many
-            # times and excessive use of storage space.  However, I
-            # consider an upside, the simplicity of the output file
-            # structure, is well worth the cost.
-
-            with io.open(self._output, utils.getmode('a')) as f:
-                dvars = pop.dvars()
-                rep = dvars.rep
-                gen = dvars.gen - burnin
-
-                writer = csv.DictWriter(f, header)
-
-                # scan genotype of all individuals to identify
-                # polymorphic sites.
-
-                # convert to carray to list because I want to use
-                # slice
-                raw_geno = list(pop.genotype())
-                stride = loci * allele_length
-                poly_sites = [locus for locus in range(stride)
-                              if len(set(raw_geno[locus::stride])) > 1]
-                poly_sites = [[i for i in poly_sites
-                               if j * allele_length <= i < (j + 1) * allele_length]
-                              for j in range(loci)]
-                for idx, ind in enumerate(pop.individuals()):
-                    selfing = ind.info(field)
-                    for ploidy in range(2):
-                        geno = ind.genotype(ploidy=ploidy)
-                        geno = [''.join(str(geno[site]) for site in locus)
-                                for locus in poly_sites]
-                        geno = [hex(int(i, 2)) for i in geno if len(i) > 0]
-                        writer.writerow({key: value for key, value in
-                                         zip(header,
-                                             data + [rep, gen, idx, selfing, ploidy] + geno)})
+            dvars = pop.dvars()
+
+            nind = pop.popSize()
+            # Genotypes are only read, and encoded genes are new objects.
+            geno = cf.get_genotype(pop).reshape(nind, 2, loci, allele_length)
+            self._writer.write(config.replicate, dvars.gen, pop.indInfo(field),
+                               cf.encode_sites(geno))
 
             return True
 
     return MyWriter()
 
 
-def execute(config, pop, mating_op):
+def execute(config, pop, mating_op, tagger_op):
     """Configure and run simulations."""
 
     _, init_genotype_op = cf.get_init_genotype_by_count(simu, 1)
@@ -338,35 +241,88 @@ def execute(config, pop, mating_op):
                                         nrep=1,
                                         burnin=config.burnin)
 
-    output_op = get_output_operator(config)
+    if config.initial_genotype[0] == 'equilibrium':
+        init_genotype_op = get_init_genotype_by_equilibrium(config, mutation_op)
+
+    def burn_in(seed):
+        """Returns a state of the population at the end of burn-in."""
+        simu.setRNG(seed=seed)
+        simulator = simu.Simulator(pops=pop, rep=1)
+        simulator.evolve(
+            initOps=[init_info_op, init_genotype_op],
+            preOps=mutation_op,
+            matingScheme=mating_op,
+            postOps=tagger_op,
+            gen=config.burnin)
+        return {'gen': config.burnin,
+                'mutator': mutation_op.get_state(),
+                'population': checkpoint.dump_population(simulator.population(0),
+                                                         burnin.get_path(config))}
+
+    seed = config.seed if config.seed is not None else simu.getRNG().seed()
+    state = checkpoint.load(config)
+    if state is None:
+        state = burnin.load(config, burn_in)
+        if state is not None:
+            # A simulation forked from a shared burn-in draws its own random numbers.
+            simu.setRNG(seed=seed)
+            state = dict(state, seed=seed, offset=None)
+
+    if state is None:
+        init_ops = [init_info_op, init_genotype_op]
+        writer = storage.get_writer(config.outfile, config.loci)
+        start = 0
+    else:
+        pop = checkpoint.load_population(simu, state['population'], checkpoint.get_path(config))
+        mutation_op.set_state(state['mutator'])
+        init_ops = []
+        seed = state['seed']
+        writer = storage.get_writer(config.outfile, config.loci, offset=state['offset'])
+        start = state['gen']
+
+    output_op = get_output_operator(config, writer)
+    checkpoint_op = checkpoint.get_checkpoint_operator(simu, config, writer, mutation_op, seed)
 
     simulator = simu.Simulator(pops=pop, rep=1)
 
+    # The selfing tagger must precede any operator reading `self_gen`.
+    post_op = [tagger_op]
     if config.debug > 0:
-        post_op = [simu.Stat(alleleFreq=simu.ALL_AVAIL, step=config.debug),
-                   simu.PyEval(r"'%s\n' % alleleFreq", step=config.debug)]
-    else:
-        post_op = []
+        post_op.extend([simu.Stat(alleleFreq=simu.ALL_AVAIL, step=config.debug),
+                        simu.PyEval(r"'%s\n' % alleleFreq", step=config.debug)])
 
     if config.output_per > 0:
         post_op.append(output_op)
 
-    simulator.evolve(
-        initOps=[init_info_op, init_genotype_op],
-        preOps=mutation_op,
-        matingScheme=mating_op,
-        postOps=post_op,
-        finalOps=output_op,
-        gen=config.gens + config.burnin)
+    # The writer is closed even if the simulation fails, so that states written
+    # so far (including the final one written by finalOps) are flushed.
+    try:
+        # A resumed population carries its generation, so it evolves only the rest.
+        simulator.evolve(
+            initOps=init_ops,
+            preOps=[checkpoint_op, mutation_op],
+            matingScheme=mating_op,
+            postOps=post_op,
+            finalOps=output_op,
+            gen=config.gens + config.burnin - start)
+    finally:
+        writer.close()
+
+    checkpoint.remove(config)
 
 
 def run(config):
     """
     Launches simulations under appropriate mutational model and mating scheme.
     """
-    if config.model == 'androdioecy':
+    if config.seed is not None:
+        simu.setRNG(seed=config.seed)
+
+    if config.mating_model == 'androdioecy':
         cf.androdioecy(simu, execute, config)
-    elif config.model == 'gynodioecy':
+    elif config.mating_model == 'gynodioecy':
         cf.gynodioecy(simu, execute, config)
-    else:
+    elif config.mating_model == 'pure hermaphroditism':
         cf.pure_hermaphrodite(simu, execute, config)
+    else:
+        sys.exit('Unrecognized mating model: {}.'.format(config.mating_model))
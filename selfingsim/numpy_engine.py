@@ -0,0 +1,359 @@
+"""
+selfingsim.numpy_engine
+=======================
+
+A standalone simulation engine built on NumPy.
+
+A population is an integer array of shape (N, 2, loci) holding genes, together
+with a vector holding the number of consecutive selfing generations per
+individual.  Mutation, mating (with recombination between adjacent loci), and
+tagging of selfing are all operations over whole arrays, so no Python code runs
+per individual, and simuPOP need not be installed.
+
+Under the infinite alleles model, a gene is an allele.  Under the infinite sites
+model, a gene is an ID of a haplotype, and mutations carried by haplotypes are
+stored sparsely (see `InfiniteSites`).
+
+Results are written in the same layout as the simuPOP-based engines.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+
+import numpy as np
+
+from . import burnin
+from . import checkpoint
+from . import coalescent
+from . import common as cf
+from . import storage
+
+
+def get_init_genotype_by_prop(rng, prop, npop, loci):
+    """
+    Sets up genotypes of initial individuals by proportions of alleles.
+
+    As in simuPOP's InitGenotype(prop=...), the number of copies of each allele is
+    fixed by its proportion, and the copies are randomly placed.
+    """
+    prop = np.asarray(prop, dtype=float)
+    prop /= prop.sum()
+    nchrom = 2 * npop
+    counts = np.floor(prop * nchrom).astype(int)
+    geno = np.empty((loci, nchrom), dtype=np.int64)
+    for locus in range(loci):
+        # Copies left over after rounding are assigned in proportion to prop.
+        rest = rng.choice(len(prop), nchrom - counts.sum(), p=prop)
+        alleles = np.concatenate([np.repeat(np.arange(len(prop)), counts), rest])
+        rng.shuffle(alleles)
+        geno[locus] = alleles
+    return len(prop), geno.T.reshape(npop, 2, loci).copy()
+
+
+def get_init_genotype(rng, config):
+    """
+    Sets up genotypes of an initial population.
+
+    Returns the next unused allele and the genotypes.
+    """
+    init = config.initial_genotype
+    npop = config.N
+    loci = config.loci
+
+    if init[0] == 'monomorphic':
+        return 1, np.zeros((npop, 2, loci), dtype=np.int64)
+    elif init[0] == 'unique':
+        return get_init_genotype_by_prop(rng, [1] * (2 * npop), npop, loci)
+    elif init[0] == 'count':
+        return get_init_genotype_by_prop(rng, [1] * init[1], npop, loci)
+    elif init[0] == 'frequency':
+        return get_init_genotype_by_prop(rng, init[1], npop, loci)
+    sys.exit('Unknown init: {}.'.format(init))
+
+
+def mutate(rng, geno, m_rate, new_idx):
+    """
+    Adds mutations to a population under the infinite alleles model.
+
+    Every mutation creates an allele distinct from any other alleles ever present
+    at the locus.  `new_idx` holds the next unused allele per locus, and it is
+    updated in place.
+    """
+    for locus, genes in cf.sample_mutations(rng, m_rate, 2 * geno.shape[0]):
+        nmut = len(genes)
+        geno[genes // 2, genes % 2, locus] = new_idx[locus] + np.arange(nmut)
+        new_idx[locus] += nmut
+
+
+class InfiniteAlleles(object):
+    """
+    Mutations under the infinite alleles model.
+    """
+    def __init__(self, config, next_idx):
+        self.m_rate = config.m
+        self.new_idx = [next_idx] * config.loci
+
+    def mutate(self, rng, geno):
+        """
+        Adds mutations to a population.
+        """
+        mutate(rng, geno, self.m_rate, self.new_idx)
+
+    def encode(self, geno):
+        """
+        Returns genes of a population as written to an output file.
+
+        The result is a copy, because genes are mutated in place while it is
+        being written.
+        """
+        return geno.copy()
+
+
+def get_equilibrium_sites(rng, config):
+    """
+    Draws a population at equilibrium under the infinite sites model.
+
+    Returns a mutation model holding haplotypes of the population, genotypes, and
+    the numbers of selfing generations.
+    """
+    model = InfiniteSites(config)
+    selfing, loci = coalescent.draw_population(rng, config, coalescent.draw_haplotypes)
+    geno = np.empty((config.N, 2, config.loci), dtype=np.int64)
+    for locus, ((index, haplotypes), lineages) in enumerate(loci):
+        # IDs of mutations keep their order of age, and haplotypes follow them.
+        nmut = len(frozenset().union(*haplotypes))
+        model.haplotypes[locus] = dict((nmut + 1 + hid, frozenset(i + 1 for i in haplotype))
+                                       for hid, haplotype in enumerate(haplotypes))
+        model.new_idx[locus] = nmut + 1 + len(haplotypes)
+        model._ncompact[locus] = len(haplotypes)
+        geno[:, :, locus] = nmut + 1 + index[lineages]
+    return model, geno, selfing
+
+
+class InfiniteSites(object):
+    """
+    Mutations under the infinite sites model.
+
+    Since there is no recombination within a locus, a gene is fully described by
+    the set of mutations it carries, that is, by its haplotype.  A gene in a
+    population holds an ID of its haplotype, and `haplotypes[locus]` maps IDs to
+    frozensets of mutations.  A mutation creates a new haplotype from the mutated
+    one, and the ID of that haplotype also serves as the ID of the mutation.
+
+    Haplotypes lost from a population are dropped, and mutations fixed in a
+    population are stripped from all haplotypes from time to time.  Therefore,
+    memory and time scale with the numbers of haplotypes and segregating sites,
+    and there is no limit on the number of sites per locus (allele length).
+    """
+    def __init__(self, config):
+        self.m_rate = config.m
+        self.haplotypes = [{0: frozenset()} for _ in range(config.loci)]
+        self.new_idx = [1] * config.loci
+        # Number of haplotypes retained by the last compaction of each locus.
+        self._ncompact = [1] * config.loci
+
+    def mutate(self, rng, geno):
+        """
+        Adds mutations to a population.
+        """
+        for locus, genes in cf.sample_mutations(rng, self.m_rate, 2 * geno.shape[0]):
+            haplotypes = self.haplotypes[locus]
+            inds = genes // 2
+            ploidy = genes % 2
+            new = self.new_idx[locus] + np.arange(len(genes))
+            for hid, old in zip(new.tolist(), geno[inds, ploidy, locus].tolist()):
+                haplotypes[hid] = haplotypes[old] | frozenset([hid])
+            geno[inds, ploidy, locus] = new
+            self.new_idx[locus] += len(genes)
+
+            if len(haplotypes) > 2 * self._ncompact[locus] + 64:
+                self.compact(geno, locus)
+
+    def compact(self, geno, locus):
+        """
+        Drops lost haplotypes, and strips fixed mutations from the rest.
+        """
+        live = np.unique(geno[:, :, locus]).tolist()
+        haplotypes = self.haplotypes[locus]
+        fixed = frozenset.intersection(*[haplotypes[hid] for hid in live])
+        self.haplotypes[locus] = dict((hid, haplotypes[hid] - fixed) for hid in live)
+        self._ncompact[locus] = len(live)
+
+    def encode(self, geno):
+        """
+        Returns genes of a population as written to an output file.
+
+        As in the simuPOP-based engine, a gene is a hexadecimal number, whose bits
+        represent states of polymorphic sites at the locus.  Here, sites are
+        ordered by their age, and the oldest site is the most significant bit.
+        The simuPOP-based engine orders sites by their positions in an allele
+        instead, which are reused in no particular order.  Therefore, the two
+        engines give the same genes the same code only up to an order of bits,
+        and codes only tell genes apart.
+        """
+        encoded = np.empty(geno.shape, dtype=object)
+        for locus in range(geno.shape[2]):
+            live, inverse = np.unique(geno[:, :, locus], return_inverse=True)
+            haplotypes = [self.haplotypes[locus][hid] for hid in live.tolist()]
+            sites = sorted(frozenset.union(*haplotypes) - frozenset.intersection(*haplotypes))
+            column = dict((site, bit) for bit, site in enumerate(sites))
+            states = np.zeros((len(haplotypes), len(sites)), dtype=np.uint8)
+            for hid, haplotype in enumerate(haplotypes):
+                states[hid, [column[site] for site in haplotype if site in column]] = 1
+            labels = cf.encode_states(states)
+            encoded[:, :, locus] = labels[inverse.ravel()].reshape(geno.shape[:2])
+        return encoded
+
+
+def meiosis(rng, geno, parents, r_rate):
+    """
+    Draws one gamete from each of `parents`.
+
+    The first locus of a gamete comes from a randomly chosen chromosome, and the
+    source chromosome switches between adjacent loci with probability `r_rate`.
+    """
+    nparent = len(parents)
+    loci = geno.shape[2]
+    start = rng.randint(2, size=(nparent, 1))
+    switches = rng.random_sample((nparent, loci - 1)) < r_rate
+    ploidy = (start + np.concatenate([np.zeros((nparent, 1), dtype=int),
+                                      np.cumsum(switches, axis=1)],
+                                     axis=1)) % 2
+    return geno[parents[:, np.newaxis], ploidy, np.arange(loci)]
+
+
+def mate(rng, geno, selfing, chooser, r_rate):
+    """
+    Produces the next generation.
+
+    Returns genotypes and the numbers of selfing generations of offspring.  As in
+    simuPOP, the first chromosome of an offspring comes from the first parent.
+    """
+    uniparental, first, second = chooser.choose(rng, selfing)
+    # A uniparental offspring receives two independent gametes from its parent.
+    second = np.where(uniparental, first, second)
+    offspring = np.empty_like(geno)
+    offspring[:, 0] = meiosis(rng, geno, first, r_rate)
+    offspring[:, 1] = meiosis(rng, geno, second, r_rate)
+    return offspring, chooser.offspring_selfing()
+
+
+def allele_frequencies(geno):
+    """
+    Returns per-locus allele frequencies in a format similar to simuPOP's alleleFreq.
+    """
+    freqs = {}
+    for locus in range(geno.shape[2]):
+        alleles, counts = np.unique(geno[:, :, locus], return_counts=True)
+        freqs[locus] = dict(zip(alleles.tolist(), (counts / counts.sum()).tolist()))
+    return freqs
+
+
+def initialize(config, rng):
+    """
+    Returns a state of an initial population.
+
+    A state is a dict in the format of a checkpoint (see selfingsim.checkpoint).
+    """
+    selfing = np.zeros(config.N, dtype=np.int64)
+    if config.mutation_model == 'infinite sites':
+        if config.initial_genotype[0] == 'equilibrium':
+            model, geno, selfing = get_equilibrium_sites(rng, config)
+        else:
+            # As in the simuPOP-based engine, the initial population is monomorphic.
+            geno = np.zeros((config.N, 2, config.loci), dtype=np.int64)
+            model = InfiniteSites(config)
+    elif config.initial_genotype[0] == 'equilibrium':
+        next_idx, geno, selfing = coalescent.draw_allele_genotypes(rng, config)
+        model = InfiniteAlleles(config, next_idx)
+    else:
+        next_idx, geno = get_init_genotype(rng, config)
+        model = InfiniteAlleles(config, next_idx)
+    return {'gen': 0, 'geno': geno, 'selfing': selfing, 'model': model, 'rng': rng}
+
+
+def burn_in(config, chooser, rng):
+    """
+    Returns a state of a population at the end of burn-in.
+    """
+    state = initialize(config, rng)
+    geno = state['geno']
+    selfing = state['selfing']
+    model = state['model']
+    for gen in range(config.burnin):
+        model.mutate(rng, geno)
+        geno, selfing = mate(rng, geno, selfing, chooser, config.r)
+
+        if config.debug > 0 and gen % config.debug == 0:
+            print(allele_frequencies(geno))
+
+    return dict(state, gen=config.burnin, geno=geno, selfing=selfing)
+
+
+def execute(config, rng):
+    """
+    Executes a simulation.
+    """
+    chooser = cf.get_parents_chooser(config)
+    state = checkpoint.load(config)
+    if state is not None:
+        writer = storage.get_writer(config.outfile, config.loci, offset=state['offset'])
+    else:
+        state = burnin.load(config,
+                            lambda seed: burn_in(config, chooser, np.random.RandomState(seed)))
+        if state is None:
+            state = initialize(config, rng)
+        else:
+            # A simulation forked from a shared burn-in draws its own random numbers.
+            state['rng'] = rng
+        writer = storage.get_writer(config.outfile, config.loci)
+
+    geno = state['geno']
+    selfing = state['selfing']
+    model = state['model']
+    rng = state['rng']
+    start = state['gen']
+
+    ngen = config.gens + config.burnin
+    if config.output_per > 0:
+        ats = set(i + config.burnin for i in range(0, config.gens, config.output_per))
+    else:
+        ats = set()
+
+    checkpoints = set(checkpoint.get_generations(config))
+
+    # The writer is closed even if the simulation fails, so that states written
+    # so far are flushed to the output file.
+    try:
+        for gen in range(start, ngen):
+            if gen in checkpoints:
+                checkpoint.save(config, {'gen': gen,
+                                         'geno': geno,
+                                         'selfing': selfing,
+                                         'model': model,
+                                         'rng': rng,
+                                         'offset': writer.position()})
+
+            model.mutate(rng, geno)
+            geno, selfing = mate(rng, geno, selfing, chooser, config.r)
+
+            if config.debug > 0 and gen % config.debug == 0:
+                print(allele_frequencies(geno))
+
+            if gen in ats:
+                writer.write(config.replicate, gen, selfing, model.encode(geno))
+
+        writer.write(config.replicate, ngen, selfing, model.encode(geno))
+    finally:
+        writer.close()
+    checkpoint.remove(config)
+
+
+def run(config):
+    """
+    Runs a simulation with the NumPy engine.
+    """
+    execute(config, np.random.RandomState(config.seed))
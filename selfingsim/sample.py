@@ -13,9 +13,15 @@ from __future__ import unicode_literals
 # standard imports
 import argparse
 import io
+import os.path
+try:
+    xrange
+except NameError:
+    xrange = range
 
 # within-package import
 from . import data
+from . import genostore
 from . import utils
 
 def run():
@@ -77,7 +83,8 @@ def sample(config):
     results in TSV format.
     """
     # Assume that one simulation result does not contain results of more than one replicates.
-    sim = data.createsample(config.simfile, config.generation)[0]
+    # Individuals are drawn through a store of the population (see genostore).
+    sim = genostore.load(config.simfile, config.generation)[0]
     fbase = ".".join(config.simfile.split(".")[:-1])
 
     dreps = _ndigits(config.reps)
@@ -96,7 +103,10 @@ def subsample(config):
     """
     Gets a subsample from already a sample in a JSON-formatted file.
     """
-    samp = data.createsample(config.samplefile)
+    if os.path.splitext(config.samplefile)[1] == ".json":
+        samp = genostore.load(config.samplefile)[0]
+    else:
+        samp = data.createsample(config.samplefile)
     subs = samp.sample(config.samplesize, config.sampleloci)
 
     with io.open(config.subsamplefile, "w") as fhandle:
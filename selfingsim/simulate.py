@@ -12,7 +12,22 @@ from __future__ import unicode_literals
 # standard imports
 import argparse
 import json
+import multiprocessing
 import sys
+import time
+
+# within-package imports
+from . import storage
+from . import utils
+
+# Available simulation engines.  The first one is the default.
+ENGINES = ('simupop', 'numpy')
+
+class ReplicateError(Exception):
+    """
+    Raised when a replicate fails to run.
+    """
+    pass
 
 def run():
     """
@@ -41,40 +56,142 @@ def setup_command_line(subparsers):
         type=str,
         nargs="*",
         help='substitutions plugged into an output file name (specified in config)')
+    parser.add_argument(
+        '--engine',
+        choices=ENGINES,
+        help='simulation engine (overrides the setting in config; default: simupop)')
+    parser.add_argument(
+        '--replicates',
+        type=int,
+        default=1,
+        help='number of independent replicates (default: 1)')
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='number of replicates simulated in parallel (default: 1)')
+    parser.add_argument(
+        '--burnin-cache',
+        type=str,
+        help='directory of populations at the end of burn-in shared by simulations '
+             '(overrides the setting in config)')
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='continue replicates from their latest checkpoints (if any)')
     parser.set_defaults(func=simulate)
 
 def simulate(args):
     """
     Runs simulation.
+
+    Each replicate runs with its own seed derived from the master seed ("seed" in
+    the general section of config, or a random one if absent), and it writes to a
+    separate output file.  The replicate number is plugged into the output file name
+    following the substitutions given on the command line, and it is also available
+    as "{replicate}".
+
+    With `--resume`, replicates having checkpoints (see selfingsim.checkpoint)
+    continue from there, and the others start from scratch.  With a burn-in cache,
+    replicates fork from a shared burn-in (see selfingsim.burnin).
     """
-    config = Config(json.load(args.config), args.substs)
+    cobj = json.load(args.config)
+    if args.engine is not None:
+        cobj['general']['engine'] = args.engine
+    if args.burnin_cache is not None:
+        cobj['general']['burnin cache'] = args.burnin_cache
+
+    master = cobj['general'].get('seed')
+    if master is None:
+        master = utils.random_seed()
+        cobj['general']['seed'] = master
 
-    if config.mutation_model == 'infinite sites':
-        print("The infinite-sites model is disabled")
-        sys.exit(1)
-        exec_infinite_sites(config)
-    elif config.mutation_model == 'infinite alleles':
-        exec_infinite_alleles(config)
+    tasks = [(cobj, args.substs, rep, utils.derive_seed(master, rep), args.resume)
+             for rep in range(args.replicates)]
+
+    # Catch errors in config before launching any simulation.
+    outfiles = [Config(*task).outfile for task in tasks]
+    shared = utils.find_duplicate(outfiles)
+    if shared is not None:
+        sys.exit('Replicates share an output file "{}".  Add a placeholder for a '
+                 'replicate number to "outfile".'.format(shared))
+    for outfile in outfiles:
+        storage.check_format(outfile)
+
+    if args.jobs > 1 and len(tasks) > 1:
+        # A fresh process per replicate keeps simulators of replicates apart.
+        pool = multiprocessing.Pool(args.jobs, maxtasksperchild=1)
+        try:
+            report_replicates(master, pool.imap_unordered(run_replicate, tasks))
+        except ReplicateError as e:
+            pool.terminate()
+            sys.exit(str(e))
+        finally:
+            pool.close()
+            pool.join()
     else:
-        print("Unknown mutational model specified", file=sys.stderr)
-        sys.exit(1)
+        try:
+            report_replicates(master, (run_replicate(task) for task in tasks))
+        except ReplicateError as e:
+            sys.exit(str(e))
+
+def run_replicate(task):
+    """
+    Runs a single replicate and measures its wall-clock time.
+
+    `task` is a tuple of arguments to Config.
+
+    Errors reported by sys.exit are raised as ReplicateError instead, because a
+    worker of multiprocessing.Pool exiting without a result leaves the pool
+    waiting for it forever.
+    """
+    config = Config(*task)
+    start = time.time()
+
+    try:
+        if config.mutation_model == 'infinite sites':
+            exec_infinite_sites(config)
+        elif config.mutation_model == 'infinite alleles':
+            exec_infinite_alleles(config)
+        else:
+            raise ReplicateError('Unknown mutational model specified')
+    except SystemExit as e:
+        raise ReplicateError('Replicate {} failed: {}'.format(config.replicate, e.code))
+
+    return config.replicate, config.seed, config.outfile, time.time() - start
+
+def report_replicates(master, results):
+    """
+    Prints wall-clock time per replicate to stderr as replicates finish (in the
+    order of `results`).
+    """
+    print("master seed: {}".format(master), file=sys.stderr)
+    print("replicate\tseed\toutfile\tseconds", file=sys.stderr)
+    for result in results:
+        print("{}\t{}\t{}\t{:.3f}".format(*result), file=sys.stderr)
 
 class Config(object):
     """
     Stores settings of simulations.
+
+    A replicate number is plugged into the name of an output file after `substs`.
+    `seed` seeds random number generators of the replicate (None for a random seed).
+    `resume` continues the replicate from its checkpoint (if any).
     """
 
-    def __init__(self, cobj, substs):
-        self._params = {}
+    def __init__(self, cobj, substs, replicate=0, seed=None, resume=False):
+        self._params = {'replicate': replicate, 'seed': seed, 'resume': resume}
         # Sets up simple parameters
         self._addparam(cobj, 'population', 'N')
         self._addparam(cobj, 'population', 'loci')
         self._addparam(cobj, 'population', 'r')
         self._addparam(cobj, 'general', 'outfile',
-                       lambda x: x.format(*substs))
+                       lambda x: x.format(*(list(substs) + [replicate]),
+                                          replicate=replicate))
         self._addparam(cobj, 'general', 'gens', lambda x: self._params['N'] * x)
         self._addparam(cobj, 'general', 'burnin', lambda x: self._params['N'] * x)
         self._addparam(cobj, 'general', 'debug')
+        self._addengine(cobj)
 
         # check if "output per" exists in an input file.  If not, set the value to
         # the last generation.
@@ -84,6 +201,13 @@ class Config(object):
         except KeyError:
             self._params['output_per'] *= self._params['gens'] * self._params['burnin']
 
+        # Checkpoints are optional, and they are disabled unless specified.
+        self._params['checkpoint_per'] = \
+            self._params['N'] * cobj['general'].get('checkpoint per', 0)
+        # So is sharing of burn-in, which depends on the master seed.
+        self._params['burnin_cache'] = cobj['general'].get('burnin cache')
+        self._params['master_seed'] = cobj['general'].get('seed')
+
         # Sets up more complex parameters
         # start with mtaing scheme
         self._addmating(cobj)
@@ -97,7 +221,7 @@ class Config(object):
         Adds settings of initial genotypes of a simulated population.
         """
         init = cobj['population']['init']
-        if init == 'unique' or init == 'monomorphic':
+        if init in ('unique', 'monomorphic', 'equilibrium'):
             self._params['initial_genotype'] = [init]
         elif type(init) is int and init > 0:
             self._params['initial_genotype'] = ['count', init]
@@ -112,6 +236,15 @@ class Config(object):
             except TypeError:
                 sys.exit('Unknown init: {}.'.format(init))
 
+    def _addengine(self, cobj):
+        """
+        Adds a simulation engine.  simuPOP is used unless specified otherwise.
+        """
+        engine = cobj['general'].get('engine', ENGINES[0])
+        if engine not in ENGINES:
+            sys.exit('Unknown engine: {}.'.format(engine))
+        self._params['engine'] = engine
+
     def _addparam(self, cobj, sec, key, mod=None):
         """
         Adds settings of simple parameters.
@@ -227,7 +360,10 @@ def exec_infinite_sites(config):
     """
     Launches simulations with the infinite-sites model.
     """
-    import selfingsim.infinite_sites as model
+    if config.engine == 'numpy':
+        import selfingsim.numpy_engine as model
+    else:
+        import selfingsim.infinite_sites as model
     model.run(config)
 
 
@@ -236,7 +372,10 @@ def exec_infinite_alleles(config):
     """
     Launches simulations with the infinite-alleles model.
     """
-    import selfingsim.infinite_alleles as model
+    if config.engine == 'numpy':
+        import selfingsim.numpy_engine as model
+    else:
+        import selfingsim.infinite_alleles as model
     model.run(config)
 
 if __name__ == '__main__':
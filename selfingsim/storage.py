@@ -0,0 +1,561 @@
+"""
+selfingsim.storage
+==================
+
+Storage of simulation results.
+
+All simulation engines write states of a population through the writers in this
+module, so results share a single file layout regardless of how they were
+simulated.
+
+Two layouts are available, and one is chosen by the suffix of an output file.
+By default, results are written as TSV (see `TSVWriter`).  Results written to a
+file with suffix ".snap" are stored in a binary columnar format instead (see
+`BinaryWriter`), which is much smaller and faster to write and read.
+
+TSV can also be compressed with gzip or xz by adding suffix ".gz" or ".xz"
+(e.g., "out.tsv.gz").  Either way, an index next to the file (with suffix ".idx")
+allows reading a single generation without reading (or decompressing) the others
+(see `TSVWriter`).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import csv
+import gzip
+import io
+import json
+import os
+import struct
+import sys
+import threading
+import zlib
+
+import numpy as np
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import utils
+
+# For compatibility with python2.
+# csv module does not support unicode.
+DELIMITER = str("\t")
+
+# Suffix of files in the binary format.
+BINARY_SUFFIX = ".snap"
+
+# The first bytes of files in the binary format.
+MAGIC = b"SELFSNAP"
+
+# A length of a metadata block in the binary format (little-endian uint32).
+LENGTH = struct.Struct(str("<I"))
+
+# Suffixes of compressed TSV files and their compression methods.
+COMPRESSIONS = {".gz": "gzip", ".xz": "xz"}
+
+# Suffix of an index of a TSV file.
+INDEX_SUFFIX = ".idx"
+
+# Header of an index of a TSV file.
+INDEX_HEADER = ["replicate", "generation", "offset", "length"]
+
+
+def _compact(values):
+    """
+    Returns integers as an array of the smallest little-endian type holding them.
+    """
+    if values.size == 0:
+        return values.astype(str("<u1"))
+    dtype = np.result_type(np.min_scalar_type(values.min()), np.min_scalar_type(values.max()))
+    return values.astype(dtype.newbyteorder(str("<")))
+
+
+def _truncate(fname, offset):
+    with io.open(fname, "r+b") as f:
+        f.truncate(offset)
+
+
+def get_compression(fname):
+    """
+    Returns the compression method of a TSV file (None if not compressed).
+    """
+    return COMPRESSIONS.get(os.path.splitext(fname)[1])
+
+
+def _compress(compression, data):
+    if compression == "gzip":
+        # A gzip member without a timestamp, so that output is reproducible.
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    _check_lzma()
+    return lzma.compress(data)
+
+
+def _decompress(compression, data):
+    if compression == "gzip":
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    _check_lzma()
+    return lzma.decompress(data)
+
+
+def _check_lzma():
+    if lzma is None:
+        sys.exit("Compression with xz requires the lzma module.")
+
+
+def check_format(fname):
+    """
+    Exits if results cannot be written to a file of this name (e.g., xz without
+    the lzma module), so that the problem shows before any simulation starts.
+    """
+    if get_compression(fname) == "xz":
+        _check_lzma()
+
+
+def get_writer(fname, loci, offset=None):
+    """
+    Returns a writer appropriate to the suffix of an output file.
+
+    The writer runs in the background (see `AsyncWriter`), and it must be closed
+    when a simulation ends.
+    """
+    if os.path.splitext(fname)[1] == BINARY_SUFFIX:
+        return AsyncWriter(BinaryWriter(fname, loci, offset))
+    return AsyncWriter(TSVWriter(fname, loci, offset))
+
+
+def get_header(loci):
+    """
+    Returns the header row of a TSV file of simulation results.
+    """
+    return [
+        'replicate',
+        'generation',
+        'individual',
+        'number of selfing',
+        'chromosome'
+    ] + ['locus {}'.format(i) for i in range(loci)]
+
+
+def _write_rows(writer, rep, gen, selfing, genotypes):
+    if isinstance(genotypes, np.ndarray):
+        genotypes = genotypes.tolist()
+    for idx, (nself, geno) in enumerate(zip(selfing, genotypes)):
+        for ploidy in range(2):
+            writer.writerow([rep, gen, idx, int(nself), ploidy] + list(geno[ploidy]))
+
+
+def _text_buffer(data=None):
+    # An in-memory file csv works with (bytes under python2).
+    if sys.version_info.major < 3:
+        return io.BytesIO(data) if data is not None else io.BytesIO()
+    if data is not None:
+        return io.StringIO(data.decode("utf-8"), newline="")
+    return io.StringIO(newline="")
+
+
+def _encode(buf):
+    value = buf.getvalue()
+    return value if isinstance(value, bytes) else value.encode("utf-8")
+
+
+def _open_text(fname, compression):
+    if compression is None:
+        return io.open(fname, utils.getmode("r"))
+    if sys.version_info.major < 3:
+        return _text_buffer(_decompress_all(fname, compression))
+    if compression == "gzip":
+        return gzip.open(fname, "rt", newline="")
+    _check_lzma()
+    return lzma.open(fname, "rt", newline="")
+
+
+def _decompress_all(fname, compression):
+    with io.open(fname, "rb") as f:
+        if compression == "gzip":
+            return gzip.GzipFile(fileobj=f).read()
+        _check_lzma()
+        return lzma.decompress(f.read())
+
+
+def read_index(fname):
+    """
+    Returns entries of the index of a TSV file.
+
+    Each entry is a tuple of the replicate, generation, offset, and length (in
+    bytes) of a block of rows, in the order of blocks.  None is returned if the
+    file has no index.
+    """
+    if not os.path.exists(fname + INDEX_SUFFIX):
+        return None
+    with io.open(fname + INDEX_SUFFIX, utils.getmode("r")) as f:
+        reader = csv.reader(f, delimiter=DELIMITER)
+        next(reader)
+        return [tuple(int(i) for i in row) for row in reader]
+
+
+def _open_index(fname, entries):
+    f = io.open(fname + INDEX_SUFFIX, utils.getmode("w"))
+    writer = csv.writer(f, delimiter=DELIMITER)
+    writer.writerow(INDEX_HEADER)
+    writer.writerows(entries)
+    return f, writer
+
+
+def build_index(fname):
+    """
+    Returns entries of the index of an uncompressed TSV file by scanning it.
+
+    The index is also saved next to the file if possible.
+    """
+    entries = []
+    with io.open(fname, "rb") as f:
+        offset = len(f.readline())
+        key = None
+        for line in f:
+            fields = line.split(b"\t", 2)
+            if (fields[0], fields[1]) != key:
+                key = (fields[0], fields[1])
+                entries.append([int(key[0]), int(key[1]), offset, 0])
+            entries[-1][3] += len(line)
+            offset += len(line)
+
+    entries = [tuple(entry) for entry in entries]
+    try:
+        f, _ = _open_index(fname, entries)
+        f.close()
+    except (IOError, OSError):
+        # The index is only an optimization, e.g., for read-only directories.
+        pass
+    return entries
+
+
+def _get_index(fname, compression):
+    index = read_index(fname)
+    # An index not covering the whole file is stale (e.g., the file was
+    # rewritten without the index).
+    if index and index[-1][2] + index[-1][3] == os.path.getsize(fname):
+        return index
+    if compression is None:
+        return build_index(fname)
+    return None
+
+
+def read_rows(fname, gen=None):
+    """
+    Yields rows (but the header) of a TSV file of simulation results.
+
+    If `gen` is given, only rows at the generation are yielded, and only blocks
+    at the generation are read (and decompressed) through the index of the file.
+    An uncompressed file without an index gets one on the first such read.
+    """
+    compression = get_compression(fname)
+    index = _get_index(fname, compression) if gen is not None else None
+    if index is not None:
+        with io.open(fname, "rb") as f:
+            for _, generation, offset, length in index:
+                if generation != gen:
+                    continue
+                f.seek(offset)
+                block = f.read(length)
+                if compression is not None:
+                    block = _decompress(compression, block)
+                for row in csv.reader(_text_buffer(block), delimiter=DELIMITER):
+                    yield row
+        return
+
+    with _open_text(fname, compression) as f:
+        reader = csv.reader(f, delimiter=DELIMITER)
+        # Throw out a header row
+        next(reader)
+        for row in reader:
+            if gen is None or int(row[1]) == gen:
+                yield row
+
+
+class TSVWriter(object):
+    """
+    Writes states of a population as rows of a TSV file.
+
+    Each row contains genes on a single chromosome.  Because simulated organisms
+    are diploid, each individual occupies two (successive) rows.
+
+    Rows of each state of a population form a block, and the replicate,
+    generation, offset, and length of every block are recorded in an index, which
+    is a small TSV file named after the output file with suffix ".idx".  If the
+    output file has suffix ".gz" or ".xz", the header and every block are
+    compressed separately by gzip or xz.  Compressed blocks are simply
+    concatenated, so that the whole file is still a valid gzip or xz file (e.g.,
+    readable with zcat), and offsets in the index refer to compressed bytes.
+
+    A writer normally starts a new file.  When `offset` is given, it instead
+    continues an existing file (and its index) truncated to `offset` bytes, which
+    is a value of `position` recorded earlier (e.g., at a checkpoint).
+    """
+    def __init__(self, fname, loci, offset=None):
+        self._fname = fname
+        self._compression = get_compression(fname)
+        if offset is None:
+            self._file = io.open(fname, "wb")
+            buf = _text_buffer()
+            csv.writer(buf, delimiter=DELIMITER).writerow(get_header(loci))
+            self._file.write(self._encode(buf))
+            entries = []
+        else:
+            _truncate(fname, offset)
+            self._file = io.open(fname, "ab")
+            entries = [entry for entry in read_index(fname) or []
+                       if entry[2] + entry[3] <= offset]
+        self._index, self._index_writer = _open_index(fname, entries)
+
+    def _encode(self, buf):
+        data = _encode(buf)
+        if self._compression is not None:
+            data = _compress(self._compression, data)
+        return data
+
+    def position(self):
+        """
+        Returns the size of everything written so far in bytes.
+        """
+        self._file.flush()
+        self._index.flush()
+        return os.path.getsize(self._fname)
+
+    def close(self):
+        """
+        Flushes and closes the file and its index.
+        """
+        self._file.close()
+        self._index.close()
+
+    def write(self, rep, gen, selfing, genotypes):
+        """
+        Appends a state of a population.
+
+        `selfing` holds the number of selfing generations per individual, and
+        `genotypes` holds, per individual, a pair of chromosomes, each of which
+        is a sequence of genes (or an array of shape (N, 2, loci)).
+        """
+        # In order to keep output file structure simple, all
+        # information regarding to simulation such as model
+        # parameters are included into each row.  This obviously
+        # caused repetition of simulation-wide parameters many
+        # times and excessive use of storage space.  However, I
+        # consider an upside, the simplicity of the output file
+        # structure, is well worth the cost.
+        buf = _text_buffer()
+        _write_rows(csv.writer(buf, delimiter=DELIMITER), rep, gen, selfing, genotypes)
+        block = self._encode(buf)
+        offset = self._file.tell()
+        self._file.write(block)
+        self._index_writer.writerow([rep, gen, offset, len(block)])
+
+
+def _write_block(f, meta):
+    data = json.dumps(meta, sort_keys=True).encode("utf-8")
+    f.write(LENGTH.pack(len(data)))
+    f.write(data)
+
+
+def _read_block(f):
+    data = f.read(LENGTH.size)
+    if len(data) == 0:
+        return None
+    return json.loads(f.read(LENGTH.unpack(data)[0]).decode("utf-8"))
+
+
+class BinaryWriter(object):
+    """
+    Writes states of a population in a binary columnar format.
+
+    A file starts with `MAGIC` and a metadata block holding the number of loci.
+    Then, each state of a population (snapshot) is a metadata block followed by
+    two arrays of integers: the numbers of selfing generations of N individuals,
+    and genes of shape (N, 2, loci).  A metadata block is a JSON object preceded
+    by its length as a little-endian 32-bit integer, and the object of a snapshot
+    holds the replicate, generation, N, types of the arrays, and the labels of
+    genes.  Each array is stored in the smallest little-endian type holding its
+    values.  If genes are integers (e.g., alleles), labels are null, and the array
+    holds genes as they are.  Otherwise (e.g., hexadecimal codes of haplotypes),
+    the array holds indices into per-locus lists of labels.
+
+    A writer normally starts a new file.  When `offset` is given, it instead
+    continues an existing file truncated to `offset` bytes, which is a value of
+    `position` recorded earlier (e.g., at a checkpoint).
+    """
+    def __init__(self, fname, loci, offset=None):
+        self._fname = fname
+        self._loci = loci
+        if offset is None:
+            self._file = io.open(fname, "wb")
+            self._file.write(MAGIC)
+            _write_block(self._file, {"loci": loci})
+        else:
+            _truncate(fname, offset)
+            self._file = io.open(fname, "ab")
+
+    def position(self):
+        """
+        Returns the size of everything written so far in bytes.
+        """
+        self._file.flush()
+        return os.path.getsize(self._fname)
+
+    def close(self):
+        """
+        Flushes and closes the file.
+        """
+        self._file.close()
+
+    def write(self, rep, gen, selfing, genotypes):
+        """
+        Appends a state of a population.
+
+        Arguments are the same as those of `TSVWriter.write`.
+        """
+        selfing = _compact(np.asarray(selfing, dtype=np.int64))
+        labels = None
+        try:
+            genes = np.asarray(genotypes, dtype=np.int64)
+        except (TypeError, ValueError):
+            genes = np.asarray(genotypes, dtype=object)
+            labels = []
+            codes = np.empty(genes.shape, dtype=np.int64)
+            for locus in range(genes.shape[2]):
+                values, inverse = np.unique(genes[:, :, locus], return_inverse=True)
+                labels.append([str(i) for i in values.tolist()])
+                codes[:, :, locus] = inverse.reshape(genes.shape[:2])
+            genes = codes
+        genes = _compact(genes.reshape(len(selfing), 2, self._loci))
+
+        _write_block(self._file, {"replicate": int(rep),
+                                  "generation": int(gen),
+                                  "individuals": len(selfing),
+                                  "selfing type": selfing.dtype.str,
+                                  "gene type": genes.dtype.str,
+                                  "labels": labels})
+        self._file.write(selfing.tobytes())
+        self._file.write(genes.tobytes())
+
+
+class AsyncWriter(object):
+    """
+    Writes states of a population in a background thread.
+
+    This wraps `TSVWriter` or `BinaryWriter`, and `write` only queues a state, so
+    that a simulation moves on to the next generation while the state is formatted
+    and written.  Arguments of `write` must not be modified afterward; pass
+    copies of arrays reused by a simulation.  At most `maxsize` states wait in the
+    queue, and `write` blocks when the queue is full.
+
+    `position` waits until all queued states are written.  An error in the
+    background is raised by the next call of any method.  `close` must be called
+    even if a simulation fails, so that states written so far are not lost.
+    """
+    def __init__(self, writer, maxsize=2):
+        self._writer = writer
+        self._queue = queue.Queue(maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    self._writer.write(*item)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def position(self):
+        """
+        Returns the size of everything written so far in bytes.
+        """
+        self._queue.join()
+        self._check()
+        return self._writer.position()
+
+    def write(self, rep, gen, selfing, genotypes):
+        """
+        Queues a state of a population.
+
+        Arguments are the same as those of `TSVWriter.write`.
+        """
+        self._check()
+        self._queue.put((rep, gen, selfing, genotypes))
+
+    def close(self):
+        """
+        Writes all queued states, and flushes and closes the file.
+
+        If `close` is called while another exception propagates (e.g., in a
+        `finally` clause), an error in the background is printed to stderr
+        instead of being raised, so that it does not mask that exception.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._writer.close()
+        if self._error is not None and sys.exc_info()[0] is not None:
+            sys.stderr.write('[ERROR] writing states failed: {!r}\n'.format(self._error))
+            self._error = None
+        self._check()
+
+
+def read_snapshots(fname, gen=None):
+    """
+    Yields states of a population written by `BinaryWriter`.
+
+    Each state is a tuple of the metadata, the numbers of selfing generations, and
+    genes as strings of shape (N, 2, loci).  If `gen` is given, states at other
+    generations are skipped without being read.
+    """
+    with io.open(fname, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a file of simulation results in the binary format")
+        loci = _read_block(f)["loci"]
+        while True:
+            meta = _read_block(f)
+            if meta is None:
+                return
+            nind = meta["individuals"]
+            stype = np.dtype(str(meta["selfing type"]))
+            gtype = np.dtype(str(meta["gene type"]))
+            if gen is not None and meta["generation"] != gen:
+                f.seek(stype.itemsize * nind + gtype.itemsize * nind * 2 * loci, io.SEEK_CUR)
+                continue
+
+            selfing = np.frombuffer(f.read(stype.itemsize * nind), dtype=stype)
+            genes = np.frombuffer(f.read(gtype.itemsize * nind * 2 * loci), dtype=gtype)
+            genes = genes.reshape(nind, 2, loci)
+            if meta["labels"] is None:
+                genes = genes.astype(str)
+            else:
+                strings = np.empty(genes.shape, dtype=object)
+                for locus, labels in enumerate(meta["labels"]):
+                    strings[:, :, locus] = np.array(labels, dtype=object)[genes[:, :, locus]]
+                genes = strings
+            yield meta, selfing, genes
@@ -0,0 +1,249 @@
+"""
+selfingsim.sweep
+################
+
+Run simulations over a grid of parameters.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# standard imports
+import argparse
+import copy
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import sys
+
+# within-package imports
+from . import simulate
+from . import utils
+
+# Parameters that can be swept, and their locations in a config and types.
+AXES = {
+    's*': (('population', 'mating', 's*'), float),
+    's tilde': (('population', 'mating', 's tilde'), float),
+    'tau': (('population', 'mating', 'tau'), float),
+    'a': (('population', 'mating', 'a'), float),
+    'sigma': (('population', 'mating', 'sigma'), float),
+    'H': (('population', 'mating', 'H'), float),
+    'N_hermaphrodites': (('population', 'mating', 'N_hermaphrodites'), int),
+    'theta': (('population', 'mutation', 'theta'), float),
+    'N': (('population', 'N'), int),
+    'loci': (('population', 'loci'), int),
+    'r': (('population', 'r'), float),
+}
+
+# Columns of a manifest preceding values of parameters.
+MANIFEST_HEADER = ['point', 'replicate', 'master', 'seed', 'status', 'seconds', 'outfile']
+
+def run():
+    """
+    Runs a parameter sweep as a stand-alone script.
+    """
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+    setup_command_line(subparsers)
+    args = parser.parse_args()
+    args.func(args)
+
+def setup_command_line(subparsers):
+    """
+    Sets up command line interface.
+    """
+    parser = subparsers.add_parser(
+        'sweep',
+        help='run forward simulations over a grid of parameters')
+    parser.add_argument(
+        'config',
+        type=argparse.FileType('r'),
+        help='the base settings of simulations as a JSON file')
+    parser.add_argument(
+        'substs',
+        type=str,
+        nargs="*",
+        help='substitutions plugged into an output file name before a label of a point')
+    parser.add_argument(
+        '--axis',
+        type=parse_axis,
+        action='append',
+        required=True,
+        help='values of a parameter as NAME=VALUE,VALUE,... (one of {})'.format(
+            ', '.join(sorted(AXES))))
+    parser.add_argument(
+        '--engine',
+        choices=simulate.ENGINES,
+        help='simulation engine (overrides the setting in config)')
+    parser.add_argument(
+        '--burnin-cache',
+        type=str,
+        help='directory of populations at the end of burn-in shared by simulations '
+             '(overrides the setting in config)')
+    parser.add_argument(
+        '--replicates',
+        type=int,
+        default=1,
+        help='number of replicates per point (default: 1)')
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='number of simulations run in parallel (default: 1)')
+    parser.add_argument(
+        '--manifest',
+        type=str,
+        help='file mapping points to output files (default: <config>.manifest.tsv)')
+    parser.set_defaults(func=sweep)
+
+def parse_axis(text):
+    """
+    Parses an axis given as NAME=VALUE,VALUE,...
+    """
+    try:
+        name, values = text.split('=', 1)
+        path, vtype = AXES[name]
+        return name, [vtype(value) for value in values.split(',')]
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError('invalid axis: {}'.format(text))
+
+def label(name, value):
+    """
+    Returns a part of a file name representing a value of a parameter.
+    """
+    return re.sub(r'[^0-9A-Za-z.]', '', name.replace('*', 'star')) + '-' + str(value)
+
+def expand(cobj, axes):
+    """
+    Yields labels, values, and configs of all points on a grid.
+    """
+    names = [name for name, _ in axes]
+    for values in itertools.product(*[vals for _, vals in axes]):
+        point = copy.deepcopy(cobj)
+        for name, value in zip(names, values):
+            path, _ = AXES[name]
+            section = point
+            for key in path[:-1]:
+                section = section[key]
+            section[path[-1]] = value
+        yield '_'.join(label(n, v) for n, v in zip(names, values)), values, point
+
+def read_manifest(fname):
+    """
+    Returns rows of a manifest (if any) keyed by output files.
+    """
+    if not os.path.exists(fname):
+        return {}
+    with io.open(fname, utils.getmode('r')) as fhandle:
+        reader = csv.DictReader(fhandle, delimiter=str('\t'))
+        return dict((row['outfile'], row) for row in reader)
+
+def write_manifest(fname, names, rows):
+    """
+    Writes a manifest atomically, so that an interrupted sweep never leaves it broken.
+    """
+    tmp = fname + '.tmp'
+    with io.open(tmp, utils.getmode('w')) as fhandle:
+        writer = csv.writer(fhandle, delimiter=str('\t'))
+        writer.writerow(MANIFEST_HEADER + names)
+        for row in rows:
+            writer.writerow([row[key] for key in MANIFEST_HEADER] + list(row['values']))
+    utils.replace(tmp, fname)
+
+def sweep(args):
+    """
+    Runs simulations at all points of a grid of parameters.
+
+    The label of a point (e.g., "sstar-0.5_theta-1.0") is plugged into the output
+    file name after the substitutions given on the command line, and then follows a
+    replicate number.  A manifest records the point, seed, status, and output file of
+    every simulation.
+
+    A simulation is skipped if its output file already exists, unless the manifest
+    marks it pending, that is, started by an earlier sweep but not finished.
+    Therefore, rerunning an interrupted sweep resumes where it stopped, and
+    simulations having checkpoints continue from there.  Without a seed in the
+    config, a resumed sweep reuses the master seed recorded in the manifest.
+    """
+    cobj = json.load(args.config)
+    if args.engine is not None:
+        cobj['general']['engine'] = args.engine
+    if args.burnin_cache is not None:
+        cobj['general']['burnin cache'] = args.burnin_cache
+
+    manifest = args.manifest
+    if manifest is None:
+        manifest = os.path.splitext(args.config.name)[0] + '.manifest.tsv'
+    previous = read_manifest(manifest)
+
+    master = cobj['general'].get('seed')
+    if master is None:
+        recorded = [row['master'] for row in previous.values() if row.get('master')]
+        master = int(recorded[0]) if recorded else utils.random_seed()
+        cobj['general']['seed'] = master
+
+    names = [name for name, _ in args.axis]
+    rows = []
+    tasks = []
+    for point, values, pobj in expand(cobj, args.axis):
+        for rep in range(args.replicates):
+            task = (pobj, list(args.substs) + [point], rep, utils.derive_seed(master, point, rep))
+            outfile = simulate.Config(*task).outfile
+            old = previous.get(outfile, {})
+            done = os.path.exists(outfile) and old.get('status') != 'pending'
+            rows.append({'point': point, 'replicate': rep,
+                         'master': old.get('master', master) if done else master,
+                         'seed': old.get('seed', task[3]) if done else task[3],
+                         'status': 'done' if done else 'pending',
+                         'seconds': old.get('seconds', '') if done else '',
+                         'outfile': outfile, 'values': values})
+            if not done:
+                # An interrupted simulation continues from its checkpoint (if any).
+                tasks.append(task + (True,))
+
+    shared = utils.find_duplicate(row['outfile'] for row in rows)
+    if shared is not None:
+        sys.exit('Simulations share an output file "{}".  Add placeholders for a point '
+                 'and a replicate number to "outfile".'.format(shared))
+
+    write_manifest(manifest, names, rows)
+    print("master seed: {}".format(master), file=sys.stderr)
+    print("{} of {} simulations to run".format(len(tasks), len(rows)), file=sys.stderr)
+
+    byfile = dict((row['outfile'], row) for row in rows)
+    if args.jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(args.jobs, maxtasksperchild=1)
+        try:
+            record(manifest, names, rows, byfile,
+                   pool.imap_unordered(simulate.run_replicate, tasks))
+        except simulate.ReplicateError as e:
+            pool.terminate()
+            sys.exit(str(e))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        try:
+            record(manifest, names, rows, byfile,
+                   (simulate.run_replicate(task) for task in tasks))
+        except simulate.ReplicateError as e:
+            sys.exit(str(e))
+
+def record(manifest, names, rows, byfile, results):
+    """
+    Marks simulations done in the manifest as they finish.
+    """
+    for _, _, outfile, seconds in results:
+        row = byfile[outfile]
+        row['status'] = 'done'
+        row['seconds'] = '{:.3f}'.format(seconds)
+        write_manifest(manifest, names, rows)
+        print("done\t{}\t{}".format(outfile, row['seconds']), file=sys.stderr)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,100 @@
+# -*- mode: python; coding: utf-8; -*-
+
+# helpers.py - Stand-ins, configurations, and a runner of commands shared by
+# tests.
+
+from __future__ import division
+
+import io
+import json
+import os.path
+import sys
+
+import selfingsim.simulate as simulate
+
+
+class Args(object):
+    """Minimal stand-in of parsed command line arguments."""
+
+    def __init__(self, **params):
+        self.__dict__.update(params)
+
+
+def get_config(outfile, init='unique', selfing=0.5):
+    """Returns a small configuration of simulations with the NumPy engine."""
+    return {
+        'general': {
+            'outfile': outfile,
+            'gens': 1,
+            'burnin': 1,
+            'debug': 0,
+            'output per': 1,
+            'engine': 'numpy',
+            'seed': 1
+        },
+        'population': {
+            'N': 10,
+            'loci': 2,
+            'init': init,
+            'mating': {'model': 'pure hermaphroditism', 's*': selfing},
+            'r': 0.5,
+            'mutation': {'model': 'infinite alleles', 'theta': 0.5}
+        }
+    }
+
+
+def get_engine_config(outfile, **mating):
+    """Returns settings of a somewhat larger simulation with the NumPy engine."""
+    if not mating:
+        mating = {'model': 'pure hermaphroditism', 's*': 0.5}
+    cobj = {
+        'general': {
+            'outfile': outfile,
+            'gens': 2,
+            'burnin': 1,
+            'debug': 0,
+            'output per': 1,
+            'engine': 'numpy'
+        },
+        'population': {
+            'N': 20,
+            'loci': 3,
+            'init': 'unique',
+            'mating': mating,
+            'r': 0.5,
+            'mutation': {'model': 'infinite alleles', 'theta': 0.5}
+        }
+    }
+    return simulate.Config(cobj, [])
+
+
+def write_config(tmpdir, cobj):
+    """Writes a configuration to a file in `tmpdir`, and returns its name."""
+    fname = os.path.join(tmpdir, 'config.json')
+    with io.open(fname, 'w') as f:
+        f.write(json.dumps(cobj))
+    return fname
+
+
+def run(func, args, errors=None):
+    """
+    Runs a command, and returns lines printed and the exit status.
+
+    Lines printed to stderr are appended to `errors` if given.
+    """
+    stdout = sys.stdout
+    stderr = sys.stderr
+    sys.stdout = io.StringIO() if sys.version_info.major > 2 else io.BytesIO()
+    sys.stderr = io.StringIO() if sys.version_info.major > 2 else io.BytesIO()
+    status = None
+    try:
+        func(args)
+    except SystemExit as e:
+        status = e.code
+    finally:
+        output = sys.stdout.getvalue()
+        if errors is not None:
+            errors.extend(sys.stderr.getvalue().splitlines())
+        sys.stdout = stdout
+        sys.stderr = stderr
+    return output.splitlines(), status
@@ -0,0 +1,139 @@
+# -*- mode: python; coding: utf-8; -*-
+
+# test_analyze.py - Tests for analysis of many sample files.
+
+from __future__ import division
+
+import io
+import os.path
+import shutil
+import tempfile
+
+import selfingsim.analyze as analyze
+import selfingsim.data as data
+import selfingsim.storage as storage
+from selfingsim.test.helpers import Args
+from selfingsim.test.helpers import run
+
+
+def write_samples(tmpdir, nfile):
+    """
+    Writes samples, one individual each, and returns their names.
+    """
+    fnames = []
+    for i in range(nfile):
+        fname = os.path.join(tmpdir, 'sample_{:02d}.json'.format(i))
+        sample = data.FullSample(fname, ['0'], [[[str(i), '0']]], [i])
+        with io.open(fname, 'w') as f:
+            f.write(sample.tojson())
+        fnames.append(fname)
+    return fnames
+
+
+class TestBatch:
+
+    def test_order(self):
+        """Results follow the order of files regardless of parallelism."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fnames = write_samples(tmpdir, 12)
+            pattern = os.path.join(tmpdir, 'sample_*.json')
+            assert analyze.expand([fnames[3], pattern]) == fnames[3:4] + fnames
+
+            expected = ['{}\tsample.0\t{}'.format(fname, i) for i, fname in enumerate(fnames)]
+            for jobs in [1, 3]:
+                lines, status = run(analyze.inbtime,
+                                    Args(samplefiles=[pattern], with_header=True, jobs=jobs))
+                assert lines == ['dataset\tsample\tselfing.gen'] + expected
+                assert status is None
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_failure(self):
+        """A file failing to be analyzed does not stop the others."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fnames = write_samples(tmpdir, 2)
+            missing = os.path.join(tmpdir, 'missing.json')
+            lines, status = run(analyze.inbtime,
+                                Args(samplefiles=[fnames[0], missing, fnames[1]],
+                                     with_header=False, jobs=2))
+            assert lines == ['{}\tsample.0\t{}'.format(fname, i) for i, fname in enumerate(fnames)]
+            assert status == '1 of 3 files failed.'
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_exit(self):
+        """A file making the data layer exit does not stop the others."""
+        tmpdir = tempfile.mkdtemp()
+        lzma = storage.lzma
+        try:
+            fnames = write_samples(tmpdir, 2)
+            fname = os.path.join(tmpdir, 'results.tsv.xz')
+            writer = storage.get_writer(fname, 1)
+            writer.write(0, 0, [0], [[[1], [2]]])
+            writer.close()
+
+            # Reading xz exits without the lzma module.
+            storage.lzma = None
+            for jobs in [1, 2]:
+                lines, status = run(analyze.inbtime,
+                                    Args(samplefiles=[fnames[0], fname, fnames[1]],
+                                         with_header=False, jobs=jobs))
+                assert lines == ['{}\tsample.0\t{}'.format(f, i) for i, f in enumerate(fnames)]
+                assert status == '1 of 3 files failed.'
+        finally:
+            storage.lzma = lzma
+            shutil.rmtree(tmpdir)
+
+    def test_confidence_interval(self):
+        """Intervals are reproducible whatever the number of jobs."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fnames = write_samples(tmpdir, 4)
+            outputs = []
+            for jobs in [1, 2]:
+                config = Args(samplefiles=fnames, with_header=True, jobs=jobs, ci='bootstrap',
+                                resample='individuals', replicates=20, level=0.9, seed=1)
+                lines, status = run(analyze.inbcoeff, config)
+                assert status is None
+                outputs.append(lines)
+            assert outputs[0] == outputs[1]
+            assert outputs[0][0] == 'dataset\tstatistic\testimate\tlower\tupper\tse'
+            assert [line.split('\t')[:2] for line in outputs[0][1:3]] == \
+                [[fnames[0], 'Fis'], [fnames[0], 'Fis.corrected']]
+            assert len(outputs[0]) == 9
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_random_seed(self):
+        """Intervals with a random seed are reproduced with the seed printed."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'sample.json')
+            genos = [[[str(i % 3), str(i % 2)], [str(i % 4), '0']] for i in range(12)]
+            with io.open(fname, 'w') as f:
+                f.write(data.FullSample(fname, [str(i) for i in range(12)], genos,
+                                        [0] * 12).tojson())
+            params = dict(samplefiles=[fname], with_header=False, jobs=1, ci='bootstrap',
+                          resample='individuals', replicates=20, level=0.9)
+            errors = []
+            lines, _ = run(analyze.inbcoeff, Args(seed=None, **params), errors)
+            seed = int(errors[0].split('resampling seed: ')[1])
+            assert run(analyze.inbcoeff, Args(seed=seed, **params))[0] == lines
+            assert run(analyze.inbcoeff, Args(seed=seed + 1, **params))[0] != lines
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_selfing(self):
+        """A selfing rate is estimated per file."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fnames = write_samples(tmpdir, 3)
+            lines, status = run(analyze.selfing,
+                                Args(samplefiles=fnames, with_header=False, jobs=2, level=0.95))
+            assert status is None
+            assert [line.split('\t')[0] for line in lines] == fnames
+            assert all(len(line.split('\t')) == 6 for line in lines)
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,113 @@
+# -*- mode: python; coding: utf-8; -*-
+
+# test_coalescent.py - Tests for drawing populations at equilibrium with the
+# coalescent with partial selfing.
+
+from __future__ import division
+
+import glob
+import io
+import json
+import os.path
+import shutil
+import tempfile
+
+import numpy as np
+
+import selfingsim.coalescent as coalescent
+import selfingsim.numpy_engine as engine
+from selfingsim.test.helpers import Args
+from selfingsim.test.helpers import get_config as get_cobj
+from selfingsim.test.helpers import get_engine_config as get_config
+from selfingsim.test.helpers import run
+from selfingsim.test.helpers import write_config
+
+
+class TestDraws:
+
+    def test_number_of_alleles(self):
+        """The number of alleles follows the Ewens sampling formula."""
+        rng = np.random.RandomState(1)
+        counts = [coalescent.draw_alleles(rng, 2.0, 50).max() + 1 for _ in range(2000)]
+
+        assert abs(np.mean(counts) - sum(2.0 / (2.0 + k) for k in range(50))) < 0.1
+
+    def test_segregating_sites(self):
+        """The number of segregating sites has mean theta times the harmonic number."""
+        rng = np.random.RandomState(1)
+        counts = [len(frozenset().union(*coalescent.draw_haplotypes(rng, 2.0, 50)[1]))
+                  for _ in range(2000)]
+
+        assert abs(np.mean(counts) - 2.0 * sum(1 / k for k in range(1, 50))) < 0.3
+
+    def test_lineages(self):
+        """Identical-by-descent genes share a lineage, and the others do not."""
+        lineages = coalescent.get_lineages(np.array([True, False, True]))
+
+        assert lineages.tolist() == [[0, 0], [1, 2], [3, 3]]
+
+
+class TestEquilibrium:
+
+    def test_inbreeding(self):
+        """Genes within individuals are identical more often than between them."""
+        config = get_config('unused.tsv', **{'model': 'pure hermaphroditism', 's*': 0.6})
+        config._params['initial_genotype'] = ['equilibrium']
+        state = engine.initialize(config, np.random.RandomState(1))
+        geno = state['geno']
+
+        within = (geno[:, 0] == geno[:, 1]).mean()
+        between = (geno[:, 0] == np.roll(geno[:, 1], 1, axis=0)).mean()
+        assert within > between
+        assert (state['selfing'] >= 0).all() and state['selfing'].max() > 0
+
+
+class TestSample:
+
+    def test_full_sample(self):
+        """A sample holds strings of genes and numbers of selfing generations as JSON."""
+        config = get_config('unused.tsv', **{'model': 'pure hermaphroditism', 's*': 0.6})
+        config._params['mutation_model'] = 'infinite sites'
+        sample = coalescent.draw_sample(np.random.RandomState(1), config, 30)
+        rows = json.loads(sample.tojson())
+
+        assert len(rows) == 30
+        assert all(len(row[2]) == config.loci for row in rows)
+        assert all(gene.startswith('0x') for row in rows for locus in row[2] for gene in locus)
+        assert [row[1] for row in rows] == sample.tselfing
+        assert sample.inbreedingcoefficient()[-1]['key'] == 'overall'
+
+
+def run_coalesce(tmpdir, cobj):
+    """
+    Draws two samples, and returns them and the master seed printed.
+    """
+    config = write_config(tmpdir, cobj)
+    errors = []
+    with io.open(config, 'r') as f:
+        run(coalescent.coalesce, Args(config=f, substs=[], samplesize=5, reps=2), errors)
+
+    samples = []
+    for fname in sorted(glob.glob(os.path.join(tmpdir, '*.json'))):
+        if fname != config:
+            with io.open(fname, 'r') as f:
+                samples.append(f.read())
+            os.remove(fname)
+    return samples, int(errors[0].split('master seed: ')[1])
+
+
+class TestCoalesce:
+
+    def test_seed(self):
+        """Samples drawn with a random seed are drawn again with the seed printed."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cobj = get_cobj(os.path.join(tmpdir, 'out.tsv'))
+            del cobj['general']['seed']
+            samples, seed = run_coalesce(tmpdir, cobj)
+            assert len(samples) == 2
+
+            cobj['general']['seed'] = seed
+            assert run_coalesce(tmpdir, cobj) == (samples, seed)
+        finally:
+            shutil.rmtree(tmpdir)
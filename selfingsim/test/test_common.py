@@ -0,0 +1,47 @@
+# -*- mode: python; coding: utf-8; -*-
+
+# test_common.py - Tests for helpers shared by simuPOP-based simulations.
+
+from __future__ import division
+
+import array
+
+import selfingsim.common as cf
+
+
+class Population(object):
+    """Minimal stand-in of simuPOP.Population holding genotypes."""
+
+    def __init__(self, genotype, size, loci):
+        self._genotype = genotype
+        self._size = size
+        self._loci = loci
+
+    def popSize(self):
+        return self._size
+
+    def totNumLoci(self):
+        return self._loci
+
+    def genotype(self):
+        return self._genotype
+
+    def setGenotype(self, genotype):
+        self._genotype = list(genotype)
+
+
+class TestGenotype:
+
+    def test_copy(self):
+        """Genotypes are copied, and they are stored back explicitly."""
+        for genotype in [array.array(str('l'), range(12)), list(range(12))]:
+            pop = Population(genotype, 2, 3)
+            geno = cf.get_genotype(pop)
+            assert geno[1, 0].tolist() == [6, 7, 8]
+
+            geno[1, 0, 2] = 100
+            assert pop.genotype()[8] == 8
+
+            cf.set_genotype(pop, geno)
+            assert pop.genotype()[8] == 100
+            assert pop.genotype()[:3] == [0, 1, 2]
@@ -0,0 +1,148 @@
+# -*- mode: python; coding: utf-8; -*-
+
+# test_data.py - Tests for samples and their statistics.
+
+from __future__ import division
+
+import math
+
+import numpy as np
+
+import selfingsim.data as data
+
+
+def get_sample():
+    """
+    Returns a sample of four individuals at two loci.
+
+    At the first locus, alleles are "a" (5 genes) and "b" (3 genes), and one
+    individual is heterozygous.  The second locus is monomorphic.
+    """
+    genos = [[['a', 'a'], ['1', '1']],
+             [['b', 'a'], ['1', '1']],
+             [['b', 'b'], ['1', '1']],
+             [['a', 'a'], ['1', '1']]]
+    return data.FullSample('test', ['0', '1', '2', '3'], genos, [0, 1, 2, 3])
+
+
+class TestSample:
+
+    def test_codes(self):
+        """Genes are encoded once, and genotypes are decoded as given."""
+        sample = get_sample()
+        assert sample.labels == [['a', 'b'], ['1']]
+        assert sample.codes[1].tolist() == [[1, 0], [0, 0]]
+        assert sample.genotypes[1] == [['b', 'a'], ['1', '1']]
+        assert sample.nsam == 4
+        assert sample.nloc == 2
+
+    def test_sample(self):
+        """A subsample keeps labels of its loci."""
+        sample = get_sample().sample(4, [0])
+        assert sorted(sample.genotypes) == [[['a', 'a']], [['a', 'a']], [['b', 'a']], [['b', 'b']]]
+        assert sorted(sample.tselfing) == [0, 1, 2, 3]
+
+    def test_inbreeding_coefficient(self):
+        """Statistics match those computed by hand."""
+        stats = get_sample().inbreedingcoefficient()
+        hexp = 1 - (5 / 8) ** 2 - (3 / 8) ** 2
+
+        assert [entry['key'] for entry in stats] == [0, 1, 'overall']
+        assert stats[0]['hobs'] == 0.25
+        assert abs(stats[0]['hexp'] - hexp) < 1e-12
+        assert abs(stats[0]['fis'] - (1 - 0.25 / hexp)) < 1e-12
+        assert abs(stats[0]['fisc'] - (hexp - 0.25 + 0.25 / 8) / (hexp - 0.25 / 8)) < 1e-12
+        assert stats[0]['nalleles'] == 2
+        assert math.isnan(stats[1]['fis'])
+        assert stats[1]['nalleles'] == 1
+        assert abs(stats[2]['fis'] - (1 - 0.25 / hexp)) < 1e-12
+        assert stats[2]['nalleles'] == 1.5
+
+
+class TestConfidenceInterval:
+
+    def get_sample(self):
+        rng = np.random.RandomState(0)
+        genos = rng.randint(0, 4, (20, 6, 2))
+        genos[:, :, 1] = np.where(rng.rand(20, 6) < 0.5, genos[:, :, 0], genos[:, :, 1])
+        return data.BasicSample('test', list(range(20)), genos)
+
+    def resampled(self, sample, over, idx):
+        """Returns overall Fis and bias-corrected Fis of a resampled sample."""
+        if over == 'loci':
+            new = data.BasicSample('test', sample.ids, sample.codes[:, idx],
+                                   [sample.labels[j] for j in idx])
+        else:
+            new = data.BasicSample('test', idx, sample.codes[idx], sample.labels)
+        overall = new.inbreedingcoefficient()[-1]
+        return [overall['fis'], overall['fisc']]
+
+    def test_bootstrap(self):
+        """Weighted resampling matches resampling samples themselves."""
+        sample = self.get_sample()
+        for over, nunit in [('loci', 6), ('individuals', 20)]:
+            rng = np.random.RandomState(1)
+            weights = rng.multinomial(nunit, np.ones(nunit) / nunit, size=50)
+            values = np.array([self.resampled(sample, over, np.repeat(np.arange(nunit), w))
+                               for w in weights])
+            expected = np.percentile(values, [5, 95], axis=0)
+
+            stats = sample.confidenceinterval('bootstrap', over, 50, 0.9, np.random.RandomState(1))
+            overall = sample.inbreedingcoefficient()[-1]
+            for i, entry in enumerate(stats):
+                assert entry['estimate'] == overall[entry['key']]
+                assert abs(entry['lower'] - expected[0, i]) < 1e-12
+                assert abs(entry['upper'] - expected[1, i]) < 1e-12
+                assert abs(entry['se'] - values[:, i].std(ddof=1)) < 1e-12
+
+    def test_jackknife(self):
+        """Standard errors match those of samples leaving a unit out."""
+        sample = self.get_sample()
+        for over, nunit in [('loci', 6), ('individuals', 20)]:
+            values = np.array([self.resampled(sample, over, [j for j in range(nunit) if j != i])
+                               for i in range(nunit)])
+            se = np.sqrt((nunit - 1) / nunit * ((values - values.mean(axis=0)) ** 2).sum(axis=0))
+
+            stats = sample.confidenceinterval('jackknife', over)
+            for i, entry in enumerate(stats):
+                assert abs(entry['se'] - se[i]) < 1e-12
+                width = 1.959963984540054 * se[i]
+                assert abs(entry['lower'] - (entry['estimate'] - width)) < 1e-9
+                assert abs(entry['upper'] - (entry['estimate'] + width)) < 1e-9
+
+
+class TestSelfingRate:
+
+    def simulate(self, selfing, nsam, theta, rng):
+        """
+        Returns a sample of individuals selfed for geometrically distributed
+        numbers of generations, as assumed by RMES.
+        """
+        gens = rng.geometric(1 - selfing, nsam) - 1
+        hets = rng.rand(nsam, len(theta)) < theta / 2. ** gens[:, None]
+        codes = np.zeros((nsam, len(theta), 2), dtype=np.uint8)
+        codes[:, :, 1] = hets
+        return data.BasicSample('test', list(range(nsam)), codes, [[0, 1]] * len(theta))
+
+    def test_estimate(self):
+        """Selfing rates are recovered, and the estimate maximizes the likelihood."""
+        rng = np.random.RandomState(4)
+        for selfing in [0.3, 0.8]:
+            sample = self.simulate(selfing, 500, rng.uniform(0.3, 0.9, 10), rng)
+            estimate = sample.selfingrate()
+            assert estimate['lower'] < selfing < estimate['upper']
+            assert estimate['lower'] < estimate['selfing'] < estimate['upper']
+            assert estimate['nloc'] == 10
+
+        hets = sample.codes[:, :, 0] != sample.codes[:, :, 1]
+        patterns, counts = np.unique(hets, axis=0, return_counts=True)
+        rate, theta, loglik = data._rmesem(patterns, counts)
+        assert abs(loglik - estimate['loglik']) < 1e-9
+        for other in [rate - 0.01, rate + 0.01]:
+            assert data._rmesem(patterns, counts, other, theta)[2] < loglik
+
+    def test_no_heterozygote(self):
+        """Nothing is estimated without heterozygotes."""
+        estimate = data.BasicSample('test', ['0', '1'], [[['a', 'a']], [['b', 'b']]]).selfingrate()
+        assert estimate['nloc'] == 0
+        assert math.isnan(estimate['selfing'])
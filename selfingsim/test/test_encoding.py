@@ -0,0 +1,54 @@
+# -*- mode: python; coding: utf-8; -*-
+
+# test_encoding.py - Tests for codes of genes under the infinite sites model.
+
+from __future__ import division
+
+import numpy as np
+
+import selfingsim.common as cf
+
+
+class TestEncodeStates:
+
+    def test_hexadecimal(self):
+        """Bits follow sites, the first being the most significant."""
+        rng = np.random.RandomState(1)
+        for nsite in [1, 7, 8, 9, 70]:
+            states = rng.randint(0, 2, (5, 2, nsite))
+            expected = [['0x{:x}'.format(int(''.join(str(i) for i in gene), 2)) for gene in ind]
+                        for ind in states.tolist()]
+            assert cf.encode_states(states).tolist() == expected
+
+    def test_no_site(self):
+        """A gene without polymorphic sites is 0x0."""
+        assert cf.encode_states(np.zeros((2, 2, 0))).tolist() == [['0x0'] * 2] * 2
+
+
+class TestEncodeSites:
+
+    def test_polymorphic_sites(self):
+        """Only polymorphic sites are encoded, and fixed or unused sites are dropped."""
+        # Three individuals at two loci of four sites each.  At the first locus,
+        # site 0 is fixed, sites 1 and 3 are polymorphic, and site 2 is unused.
+        # At the second locus, site 2 is fixed, and the others are unused.
+        geno = np.zeros((3, 2, 2, 4), dtype=np.uint8)
+        geno[:, :, 0, 0] = 1
+        geno[0, 0, 0, 1] = 1
+        geno[1, 1, 0, 3] = 1
+        geno[2, :, 0, [1, 3]] = 1
+        geno[:, :, 1, 2] = 1
+
+        codes = cf.encode_sites(geno)
+        assert codes.shape == (3, 2, 2)
+        assert codes[:, :, 0].tolist() == [['0x2', '0x0'], ['0x0', '0x1'], ['0x3', '0x3']]
+        assert codes[:, :, 1].tolist() == [['0x0', '0x0']] * 3
+
+    def test_order_of_sites(self):
+        """Codes of polymorphic sites are independent of sites around them."""
+        rng = np.random.RandomState(1)
+        states = rng.randint(0, 2, (4, 2, 1, 5))
+        geno = np.zeros((4, 2, 1, 9), dtype=np.uint8)
+        geno[:, :, :, [0, 2, 3, 6, 8]] = states
+        geno[:, :, :, 4] = 1
+        assert cf.encode_sites(geno).tolist() == cf.encode_sites(states).tolist()
@@ -0,0 +1,98 @@
+# -*- mode: python; coding: utf-8; -*-
+
+# test_genostore.py - Tests for memory-mapped genotype stores.
+
+from __future__ import division
+
+import io
+import json
+import os.path
+import random
+import shutil
+import tempfile
+
+import selfingsim.data as data
+import selfingsim.genostore as genostore
+import selfingsim.storage as storage
+
+
+def write_results(fname):
+    """
+    Writes two replicates of a population of three individuals at two loci.
+    """
+    writer = storage.get_writer(fname, 2)
+    writer.write(0, 10, [0, 2, 1], [[[1, 2], [3, 4]], [[5, 6], [7, 8]], [[1, 1], [2, 2]]])
+    writer.write(1, 10, [3, 0, 0], [[[9, 9], [9, 9]], [[1, 0], [0, 1]], [[1, 1], [1, 1]]])
+    writer.close()
+
+
+class TestStore:
+
+    def test_results(self):
+        """Samples loaded through a store are identical to those read from a file."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'out.tsv')
+            write_results(fname)
+            expected = data.createsample(fname, 10)
+            for _ in range(2):
+                samples = genostore.load(fname, 10)
+                assert os.path.isdir(genostore.get_path(fname, 10))
+                assert len(samples) == len(expected) == 2
+                for sample, exp in zip(samples, expected):
+                    assert [sample.genotypes[i] for i in range(3)] == exp.genotypes
+                    assert [sample.ids[i] for i in range(3)] == exp.ids
+                    assert [sample.tselfing[i] for i in range(3)] == exp.tselfing
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_sample(self):
+        """Individuals drawn from a mapped sample are plain."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'out.tsv')
+            write_results(fname)
+            expected = data.createsample(fname, 10)[0]
+            sample = genostore.load(fname, 10)[0]
+
+            random.seed(1)
+            new = sample.sample(2, [1])
+            random.seed(1)
+            exp = expected.sample(2, [1])
+            assert new.tojson() == exp.tojson()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_rebuild(self):
+        """A store is rebuilt when its file has changed."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'sample.json')
+            with io.open(fname, 'w') as f:
+                f.write('[["a", 0, [["1", "2"]]]]')
+            assert genostore.load(fname)[0].genotypes[0] == [['1', '2']]
+
+            with io.open(fname, 'w') as f:
+                f.write('[["a", 0, [["3", "4"]]], ["b", 1, [["5", "5"]]]]')
+            os.utime(fname, (0, 0))
+            sample = genostore.load(fname)[0]
+            assert sample.nsam == 2
+            assert sample.genotypes[1] == [['5', '5']]
+            assert sample.tselfing[1] == 1
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_id_types(self):
+        """IDs keep their types whether they are integers, strings, or mixed."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for n, ids in enumerate([[3, 1], ['a', 'b'], [3, 'b']]):
+                fname = os.path.join(tmpdir, 'sample_{}.json'.format(n))
+                with io.open(fname, 'w') as f:
+                    f.write(json.dumps([[i, 0, [['1', '2']]] for i in ids]))
+                expected = data.createsample(fname)
+                sample = genostore.load(fname)[0]
+                assert [sample.ids[i] for i in range(2)] == expected.ids == ids
+                assert genostore.load(fname)[0].tojson() == expected.tojson()
+        finally:
+            shutil.rmtree(tmpdir)
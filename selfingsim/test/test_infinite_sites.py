@@ -0,0 +1,70 @@
+# -*- mode: python; coding: utf-8; -*-
+
+# test_infinite_sites.py - Tests for bookkeeping of sites under the infinite
+# sites model with simuPOP.
+
+from __future__ import division
+
+import simuOpt
+simuOpt.setOptions(quiet=True, alleleType='binary')
+import simuPOP as simu
+
+import selfingsim.infinite_sites as isf
+
+
+def get_population(size, allele_length):
+    """Returns a population at a single locus without any derived allele."""
+    pop = simu.Population(size=size, loci=allele_length)
+    pop.dvars().rep = 0
+    return pop
+
+
+def add_mutation(op, pop, chromosomes):
+    """Puts a derived allele at a new site on chromosomes, and returns the site."""
+    site = op.available[0][0].pop()
+    for chrom in chromosomes:
+        ind, ploidy = divmod(chrom, 2)
+        pop.individual(ind).setAllele(1, site, ploidy=ploidy)
+    op.used[0][0].add(site)
+    return site
+
+
+class TestMutator:
+
+    def test_reclaim(self):
+        """Lost and fixed sites are reset to the ancestral state and reused."""
+        pop = get_population(5, 3)
+        op = isf.get_mutation_operator(m_rate=[0.], loci=1, allele_length=3, nrep=1, burnin=0)
+        fixed = add_mutation(op, pop, range(10))
+        lost = add_mutation(op, pop, [])
+        segregating = add_mutation(op, pop, [4])
+        assert op.available[0][0] == []
+
+        assert op.reclaim(pop, 0, 0)
+        assert sorted(op.available[0][0]) == sorted([fixed, lost])
+        assert op.used[0][0] == set([segregating])
+        assert all(pop.individual(ind).allele(site, ploidy) == 0
+                   for site in [fixed, lost] for ind in range(5) for ploidy in range(2))
+        assert pop.individual(2).allele(segregating, 0) == 1
+
+        # Nothing is lost or fixed any more.
+        op.available[0][0] = []
+        op.used[0][0].update([fixed, lost])
+        pop.individual(0).setAllele(1, fixed, ploidy=0)
+        pop.individual(0).setAllele(1, lost, ploidy=0)
+        assert not op.reclaim(pop, 0, 0)
+
+    def test_state(self):
+        """Available and occupied sites are restored from a checkpoint."""
+        pop = get_population(5, 4)
+        op = isf.get_mutation_operator(m_rate=[0.], loci=1, allele_length=4, nrep=1, burnin=0)
+        site = add_mutation(op, pop, [1])
+
+        new = isf.get_mutation_operator(m_rate=[0.], loci=1, allele_length=4, nrep=1, burnin=0)
+        new.set_state(op.get_state())
+        assert new.available == op.available
+        assert new.used == [[set([site])]]
+
+        # Older checkpoints hold counts of derived alleles.
+        new.set_state({'available': op.available, 'counts': [[{site: 1}]]})
+        assert new.used == [[set([site])]]
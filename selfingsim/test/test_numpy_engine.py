@@ -0,0 +1,203 @@
+# -*- mode: python; coding: utf-8; -*-
+
+# test_numpy_engine.py - Tests for the standalone NumPy simulation engine.
+
+from __future__ import division
+
+import csv
+import io
+import os.path
+import shutil
+import tempfile
+
+import numpy as np
+
+import selfingsim.common as cf
+import selfingsim.numpy_engine as engine
+from selfingsim.test.helpers import get_engine_config as get_config
+
+
+class TestMeiosis:
+
+    def test_no_recombination(self):
+        """Without recombination, a gamete is one of the parental chromosomes."""
+        geno = np.arange(2 * 2 * 5).reshape(2, 2, 5)
+        gametes = engine.meiosis(np.random.RandomState(1), geno, np.array([0, 1] * 50), 0.0)
+
+        for parent, gamete in zip([0, 1] * 50, gametes):
+            assert (gamete == geno[parent, 0]).all() or (gamete == geno[parent, 1]).all()
+
+    def test_free_recombination(self):
+        """Genes at adjacent loci come from different chromosomes half of the time."""
+        geno = np.array([[[0] * 10, [1] * 10]])
+        gametes = engine.meiosis(np.random.RandomState(1), geno, np.zeros(10000, dtype=int), 0.5)
+
+        assert abs((gametes[:, 1:] != gametes[:, :-1]).mean() - 0.5) < 0.01
+
+
+class TestMutate:
+
+    def test_new_alleles(self):
+        """Every mutation introduces a distinct allele."""
+        geno = np.zeros((100, 2, 2), dtype=np.int64)
+        new_idx = [1, 1]
+        engine.mutate(np.random.RandomState(1), geno, [0.1, 0.0], new_idx)
+
+        mutated = geno[:, :, 0][geno[:, :, 0] > 0]
+        assert len(mutated) == len(set(mutated.tolist())) == new_idx[0] - 1
+        assert (geno[:, :, 1] == 0).all() and new_idx[1] == 1
+
+
+class TestInfiniteSites:
+
+    def test_haplotypes(self):
+        """A gene carries mutations of its ancestors, and output codes follow them."""
+        config = get_config('unused.tsv')
+        model = engine.InfiniteSites(config)
+        geno = np.zeros((1, 2, config.loci), dtype=np.int64)
+        model.haplotypes[0].update({1: frozenset([1]), 2: frozenset([1, 2])})
+        geno[0, :, 0] = [2, 0]
+
+        # Site 1 is older than site 2, so it is the more significant bit.
+        assert [gene[0] for gene in model.encode(geno)[0]] == ['0x3', '0x0']
+
+    def test_compact(self):
+        """Lost haplotypes are dropped, and fixed mutations are stripped."""
+        config = get_config('unused.tsv')
+        model = engine.InfiniteSites(config)
+        geno = np.zeros((1, 2, config.loci), dtype=np.int64)
+        model.haplotypes[0].update({1: frozenset([1]), 2: frozenset([1, 2])})
+        geno[0, :, 0] = [2, 1]
+        model.compact(geno, 0)
+
+        assert model.haplotypes[0] == {1: frozenset(), 2: frozenset([2])}
+        assert [gene[0] for gene in model.encode(geno)[0]] == ['0x1', '0x0']
+
+
+class TestDrawHits:
+
+    def test_zero_rate(self):
+        """Loci with zero mutation rate get no mutation."""
+        assert len(cf.draw_hits(np.random.RandomState(1), 0.0, 1000)) == 0
+
+    def test_number_of_hits(self):
+        """Hits are distinct, sorted, in range, and as frequent as Bernoulli trials."""
+        rng = np.random.RandomState(1)
+        counts = []
+        for _ in range(1000):
+            hits = cf.draw_hits(rng, 0.01, 1000)
+            assert (np.diff(hits) > 0).all()
+            assert len(hits) == 0 or (0 <= hits[0] and hits[-1] < 1000)
+            counts.append(len(hits))
+
+        assert abs(np.mean(counts) - 10) < 0.5
+        assert abs(np.var(counts) - 1000 * 0.01 * 0.99) < 1.5
+
+
+class TestExecute:
+
+    def test_infinite_sites(self):
+        """The infinite sites model writes one hexadecimal code per locus."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outfile = os.path.join(tmpdir, 'out.tsv')
+            config = get_config(outfile)
+            config._params['mutation_model'] = 'infinite sites'
+            engine.execute(config, np.random.RandomState(1))
+
+            with io.open(outfile, 'r', newline='') as f:
+                rows = list(csv.reader(f, delimiter=str('\t')))
+
+            assert all(len(row) == 5 + config.loci for row in rows)
+            assert all(gene.startswith('0x') for row in rows[1:] for gene in row[5:])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_output(self):
+        """The engine writes the same TSV layout as the simuPOP engine."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outfile = os.path.join(tmpdir, 'out.tsv')
+            config = get_config(outfile)
+            engine.execute(config, np.random.RandomState(1))
+
+            with io.open(outfile, 'r', newline='') as f:
+                rows = list(csv.reader(f, delimiter=str('\t')))
+
+            assert rows[0][:5] == ['replicate', 'generation', 'individual',
+                                   'number of selfing', 'chromosome']
+            assert len(rows[0]) == 5 + config.loci
+            # Two snapshots during the simulation and one at the end.
+            assert len(rows) == 1 + 3 * 2 * config.N
+            assert sorted(set(int(row[1]) for row in rows[1:])) == [20, 40, 60]
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestCheckpoint:
+
+    def test_resume(self):
+        """A resumed simulation writes the same bytes as an uninterrupted one."""
+        tmpdir = tempfile.mkdtemp()
+        original = engine.mate
+        try:
+            outfile = os.path.join(tmpdir, 'out.tsv')
+            config = get_config(outfile)
+            config._params['checkpoint_per'] = config.N
+            config._params['resume'] = True
+            engine.execute(config, np.random.RandomState(1))
+            with io.open(outfile, 'rb') as f:
+                expected = f.read()
+            assert not os.path.exists(outfile + '.ckpt')
+
+            # Interrupt the simulation between the second and third checkpoints.
+            calls = []
+            def mate(*args):
+                calls.append(None)
+                if len(calls) > 50:
+                    raise KeyboardInterrupt
+                return original(*args)
+            engine.mate = mate
+            try:
+                engine.execute(config, np.random.RandomState(1))
+            except KeyboardInterrupt:
+                pass
+            engine.mate = original
+            assert os.path.exists(outfile + '.ckpt')
+
+            # The seed passed here is ignored in favor of the saved generator.
+            engine.execute(config, np.random.RandomState(2))
+            with io.open(outfile, 'rb') as f:
+                assert f.read() == expected
+        finally:
+            engine.mate = original
+            shutil.rmtree(tmpdir)
+
+
+class TestBurnin:
+
+    def test_shared_burnin(self):
+        """Replicates fork from a burn-in run once, and they diverge afterward."""
+        tmpdir = tempfile.mkdtemp()
+        original = engine.burn_in
+        try:
+            outputs = []
+            for replicate in range(2):
+                outfile = os.path.join(tmpdir, 'out.{}.tsv'.format(replicate))
+                config = get_config(outfile)
+                config._params['burnin_cache'] = os.path.join(tmpdir, 'cache')
+                config._params['replicate'] = replicate
+                engine.execute(config, np.random.RandomState(replicate))
+                with io.open(outfile, 'rb') as f:
+                    outputs.append(f.read())
+
+                # Later replicates must not repeat burn-in.
+                def burn_in(*args):
+                    raise AssertionError('burn-in repeated')
+                engine.burn_in = burn_in
+
+            assert len(os.listdir(config.burnin_cache)) == 1
+            assert outputs[0] != outputs[1]
+        finally:
+            engine.burn_in = original
+            shutil.rmtree(tmpdir)
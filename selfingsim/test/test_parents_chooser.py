@@ -0,0 +1,165 @@
+# -*- mode: python; coding: utf-8; -*-
+
+# test_parents_chooser.py - Tests for choosing parents of all offspring in a
+# generation at once.
+
+from __future__ import division
+
+import numpy as np
+
+import selfingsim.common as cf
+
+
+class Config(object):
+    """Minimal stand-in of simulate.Config holding mating parameters."""
+
+    def __init__(self, **params):
+        self._params = params
+
+    def __getattr__(self, name):
+        return self._params[name]
+
+
+class TestParentsChooser:
+
+    def test_abstract(self):
+        """Choosers must implement `draw`."""
+        try:
+            cf.ParentsChooser(10)
+        except TypeError:
+            pass
+        else:
+            assert False
+
+    def test_gene_sources(self):
+        """Choosers must implement `gene_sources` as well."""
+        class Chooser(cf.ParentsChooser):
+            def draw(self, rng):
+                return None
+
+        try:
+            Chooser(10)
+        except TypeError:
+            pass
+        else:
+            assert False
+
+
+class TestPureHermaphroditeParentsChooser:
+
+    def test_biparental_parents_differ(self):
+        """Both parents of a biparental offspring must be distinct individuals."""
+        chooser = cf.PureHermaphroditeParentsChooser(Config(N=10, sstar=0.0))
+        uniparental, first, second = chooser.draw(np.random.RandomState(1))
+
+        assert len(first) == 10
+        assert not uniparental.any()
+        assert (first != second).all()
+        assert ((0 <= second) & (second < 10)).all()
+
+    def test_compound_parameter(self):
+        """The fraction of uniparental offspring should be close to s*."""
+        chooser = cf.PureHermaphroditeParentsChooser(Config(N=100000, sstar=0.3))
+        uniparental, _, _ = chooser.draw(np.random.RandomState(1))
+
+        assert abs(uniparental.mean() - 0.3) < 0.01
+
+    def test_fundamental_parameters(self):
+        """Surviving uniparental offspring occur at s tilde * tau / (s tilde * tau + 1 - s tilde)."""
+        chooser = cf.PureHermaphroditeParentsChooser(Config(N=100000, stilde=0.5, tau=0.5))
+        uniparental, _, _ = chooser.draw(np.random.RandomState(1))
+
+        assert abs(uniparental.mean() - 1 / 3) < 0.01
+
+
+class TestAndrodioeciousParentsChooser:
+
+    def test_parents_by_sex(self):
+        """Seed parents are hermaphrodites and pollen parents of outcrossed offspring are males."""
+        chooser = cf.AndrodioeciousParentsChooser(Config(N=100, N_hermaphrodites=30, sstar=0.4))
+        uniparental, first, second = chooser.draw(np.random.RandomState(1))
+
+        assert (first[uniparental] >= 70).all()
+        assert (first[~uniparental] < 70).all()
+        assert (second >= 70).all()
+
+    def test_no_male(self):
+        """Parents are drawn without males under complete selfing, and outcrossing is rejected."""
+        chooser = cf.AndrodioeciousParentsChooser(Config(N=10, N_hermaphrodites=10, sstar=1.0))
+        uniparental, first, second = chooser.draw(np.random.RandomState(1))
+        assert uniparental.all()
+        assert (first == second).all()
+        assert ((0 <= first) & (first < 10)).all()
+
+        try:
+            cf.AndrodioeciousParentsChooser(Config(N=10, N_hermaphrodites=10, sstar=0.5))
+        except SystemExit as e:
+            assert 'requires males' in e.code
+        else:
+            assert False
+
+
+class TestGynodioeciousParentsChooser:
+
+    def test_parents_by_sex(self):
+        """Pollen parents are hermaphrodites, and seed parents are either sex."""
+        chooser = cf.GynodioeciousParentsChooser(Config(N=100, N_hermaphrodites=30, sstar=0.2, H=0.5))
+        uniparental, first, second = chooser.draw(np.random.RandomState(1))
+
+        assert (first < 30).all()
+        biparental = ~uniparental
+        assert (first[biparental] != second[biparental]).all()
+        assert (second < 30).any() and (second >= 30).any()
+
+    def test_no_female(self):
+        """Parents are drawn without females if hermaphrodites produce all seeds."""
+        for config in [Config(N=10, N_hermaphrodites=10, sstar=0.2, H=1.0),
+                       Config(N=10, N_hermaphrodites=10, a=0.5, tau=0.5, sigma=1.0)]:
+            chooser = cf.GynodioeciousParentsChooser(config)
+            uniparental, first, second = chooser.draw(np.random.RandomState(1))
+            assert ((0 <= second) & (second < 10)).all()
+            biparental = ~uniparental
+            assert biparental.any()
+            assert (first[biparental] != second[biparental]).all()
+
+        try:
+            cf.GynodioeciousParentsChooser(Config(N=10, N_hermaphrodites=10, sstar=0.2, H=0.5))
+        except SystemExit as e:
+            assert 'require females' in e.code
+        else:
+            assert False
+
+    def test_fundamental_parameters(self):
+        """Fundamental parameters are converted to s* and H as in the design notes."""
+        chooser = cf.GynodioeciousParentsChooser(
+            Config(N=100, N_hermaphrodites=50, a=0.5, tau=0.5, sigma=1.0))
+
+        assert abs(chooser.sstar - 12.5 / (12.5 + 25 + 50)) < 1e-12
+        assert abs(chooser.H - 25 / 75) < 1e-12
+
+
+class TestOffspringSelfing:
+
+    def test_record_semantics(self):
+        """
+        A uniparental offspring has one more selfing generation than its parent,
+        and a biparental offspring has none.
+        """
+        chooser = cf.PureHermaphroditeParentsChooser(Config(N=1000, sstar=0.5))
+        selfing = np.arange(1000)
+        uniparental, first, _ = chooser.choose(np.random.RandomState(1), selfing)
+        offspring = chooser.offspring_selfing()
+
+        assert (offspring[~uniparental] == 0).all()
+        assert (offspring[uniparental] == selfing[first[uniparental]] + 1).all()
+
+    def test_pure_selfing(self):
+        """Under complete selfing, the value equals the number of generations."""
+        chooser = cf.PureHermaphroditeParentsChooser(Config(N=10, sstar=1.0))
+        rng = np.random.RandomState(1)
+        selfing = np.zeros(10, dtype=int)
+        for _ in range(10):
+            chooser.choose(rng, selfing)
+            selfing = chooser.offspring_selfing()
+
+        assert (selfing == 10).all()
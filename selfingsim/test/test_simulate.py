@@ -0,0 +1,75 @@
+# -*- mode: python; coding: utf-8; -*-
+
+# test_simulate.py - Tests for running replicates of simulations.
+
+from __future__ import division
+
+import io
+import os.path
+import shutil
+import tempfile
+
+import selfingsim.simulate as simulate
+import selfingsim.utils as utils
+from selfingsim.test.helpers import Args
+from selfingsim.test.helpers import get_config
+from selfingsim.test.helpers import run
+from selfingsim.test.helpers import write_config
+
+
+def run_replicates(tmpdir, cobj, replicates, jobs):
+    """
+    Runs simulations, and returns the exit status.
+    """
+    with io.open(write_config(tmpdir, cobj), 'r') as f:
+        return run(simulate.simulate, Args(config=f, substs=[], engine=None,
+                                           replicates=replicates, jobs=jobs,
+                                           burnin_cache=None, resume=False))[1]
+
+
+class TestSeed:
+
+    def test_derive_seed(self):
+        """Seeds are reproducible, and they differ among replicates."""
+        seeds = [utils.derive_seed(1, rep) for rep in range(100)]
+        assert seeds == [utils.derive_seed(1, rep) for rep in range(100)]
+        assert len(set(seeds)) == 100
+        assert utils.derive_seed(2, 0) != seeds[0]
+        assert all(0 < seed < utils.MAX_SEED for seed in seeds)
+
+
+class TestReplicates:
+
+    def test_replicates(self):
+        """Each replicate writes its own file."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outfile = os.path.join(tmpdir, 'out.{}.tsv')
+            assert run_replicates(tmpdir, get_config(outfile), 3, 2) is None
+            for rep in range(3):
+                assert os.path.exists(outfile.format(rep))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_shared_outfile(self):
+        """Replicates are rejected unless the output file names a replicate."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outfile = os.path.join(tmpdir, 'out.tsv')
+            status = run_replicates(tmpdir, get_config(outfile), 2, 1)
+            assert 'share an output file "{}"'.format(outfile) in status
+            assert not os.path.exists(outfile)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_failure(self):
+        """A replicate exiting in a worker is reported instead of stalling the pool."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # No equilibrium exists under complete selfing, and a replicate exits.
+            outfile = os.path.join(tmpdir, 'out.{}.tsv')
+            for jobs in [1, 2]:
+                status = run_replicates(tmpdir, get_config(outfile, 'equilibrium', 1.0), 2, jobs)
+                assert 'No equilibrium exists' in status
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,210 @@
+# -*- mode: python; coding: utf-8; -*-
+
+# test_storage.py - Tests for writers of simulation results.
+
+from __future__ import division
+
+import gzip
+import io
+import os.path
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+import selfingsim.data as data
+import selfingsim.storage as storage
+
+
+# Suffixes of output files in all formats, the plain TSV first.
+SUFFIXES = ['.tsv', storage.BINARY_SUFFIX, '.tsv.gz', '.tsv.xz']
+
+
+def read_all(genotypes, gen):
+    """
+    Writes the same states through all writers, and returns samples read from
+    the plain TSV file and those read from the other files.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        samples = []
+        for suffix in SUFFIXES:
+            fname = os.path.join(tmpdir, 'out' + suffix)
+            writer = storage.get_writer(fname, 2)
+            writer.write(0, 10, [0, 3], genotypes)
+            writer.write(0, 20, [1, 0], genotypes[::-1])
+            writer.close()
+            samples.append(data.createsample(fname, gen))
+        return samples[0], samples[1:]
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+class TestBinaryWriter:
+
+    def test_alleles(self):
+        """Samples read from both formats are identical."""
+        for gen in [10, 20]:
+            expected, samples = read_all([[[1, 2], [3, 300]], [[5, 6], [7, 8]]], gen)
+            for sample in samples:
+                assert sample[0].genotypes == expected[0].genotypes
+                assert sample[0].tselfing == expected[0].tselfing
+                assert sample[0].ids == expected[0].ids
+
+    def test_labels(self):
+        """Genes other than integers are stored through labels."""
+        expected, samples = read_all([[['0x1', '0x0'], ['0x3', '0x0']],
+                                      [['0x0', '0x0'], ['0x1', '0x10']]], 20)
+
+        for sample in samples:
+            assert sample[0].genotypes == expected[0].genotypes
+
+    def test_missing_generation(self):
+        """No sample is created from a generation not recorded."""
+        expected, samples = read_all([[[1, 2], [3, 4]], [[5, 6], [7, 8]]], 15)
+
+        assert expected == []
+        for sample in samples:
+            assert sample == []
+
+
+class TestTSVWriter:
+
+    def test_blocks(self):
+        """A compressed file is a TSV file, and generations are read through its index."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'out.tsv')
+            writers = [storage.get_writer(name, 2) for name in [fname, fname + '.gz']]
+            for gen in range(3):
+                for writer in writers:
+                    writer.write(0, gen, [gen, 0], [[[gen, 1], [2, 3]], [[4, 5], [6, 7]]])
+            for writer in writers:
+                writer.close()
+
+            with io.open(fname, 'rb') as f:
+                expected = f.read()
+            with gzip.open(fname + '.gz', 'rb') as f:
+                assert f.read() == expected
+
+            index = storage.read_index(fname + '.gz')
+            assert [entry[1] for entry in index] == [0, 1, 2]
+            # Other blocks are never decompressed.
+            with io.open(fname + '.gz', 'r+b') as f:
+                f.seek(index[0][2])
+                f.write(b'\0' * index[0][3])
+            sample = data.createsample(fname + '.gz', 1)
+            assert sample[0].tselfing == [1, 0]
+            assert sample[0].genotypes == data.createsample(fname, 1)[0].genotypes
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_lazy_index(self):
+        """An index of an uncompressed file is built on the first read if missing."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'out.tsv')
+            writer = storage.get_writer(fname, 2)
+            for rep in range(2):
+                for gen in range(3):
+                    writer.write(rep, gen, [gen, rep], [[[gen, 1], [2, 3]], [[4, 5], [6, rep]]])
+            writer.close()
+            expected = storage.read_index(fname)
+            os.remove(fname + storage.INDEX_SUFFIX)
+
+            samples = data.createsample(fname, 2)
+            assert storage.read_index(fname) == expected
+            assert [sample.tselfing for sample in samples] == [[2, 0], [2, 1]]
+            assert samples[1].genotypes == [[['2', '2'], ['1', '3']], [['4', '6'], ['5', '1']]]
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestStreaming:
+
+    def test_replicates(self):
+        """Replicates are read one at a time, before later ones are checked."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'out.tsv')
+            with io.open(fname, 'w') as f:
+                f.write('\t'.join(storage.get_header(1)) + '\n')
+                f.write('0\t5\t0\t1\t0\t7\n0\t5\t0\t1\t1\t8\n')
+                # The second replicate lacks a chromosome.
+                f.write('1\t5\t0\t2\t0\t9\n')
+
+            samples = data.itersamples(fname, 5)
+            sample = next(samples)
+            assert sample.genotypes == [[['7', '8']]]
+            assert sample.tselfing == [1]
+            try:
+                next(samples)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError('a broken replicate was read')
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestAsyncWriter:
+
+    def test_position(self):
+        """Position accounts for all queued states, and resuming there drops later ones."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for suffix in SUFFIXES:
+                fname = os.path.join(tmpdir, 'out' + suffix)
+                geno = np.arange(8).reshape(2, 2, 2)
+                writer = storage.get_writer(fname, 2)
+                writer.write(0, 10, np.array([0, 3]), geno)
+                offset = writer.position()
+                writer.write(0, 20, np.array([1, 0]), geno + 1)
+                writer.close()
+                with io.open(fname, 'rb') as f:
+                    expected = f.read()
+
+                writer = storage.get_writer(fname, 2, offset=offset)
+                assert os.path.getsize(fname) == offset
+                writer.write(0, 20, np.array([1, 0]), geno + 1)
+                writer.close()
+                with io.open(fname, 'rb') as f:
+                    assert f.read() == expected
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_error(self):
+        """An error in the background is raised in the caller."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            writer = storage.get_writer(os.path.join(tmpdir, 'out.tsv'), 2)
+            writer.write(0, 10, [0], None)
+            try:
+                writer.close()
+            except TypeError:
+                pass
+            else:
+                raise AssertionError('an error in the background was ignored')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_error_in_simulation(self):
+        """An error in the background does not mask an error of a simulation."""
+        tmpdir = tempfile.mkdtemp()
+        stderr = sys.stderr
+        sys.stderr = io.StringIO() if sys.version_info.major > 2 else io.BytesIO()
+        try:
+            writer = storage.get_writer(os.path.join(tmpdir, 'out.tsv'), 2)
+            writer.write(0, 10, [0], None)
+            try:
+                try:
+                    raise ValueError('simulation failed')
+                finally:
+                    writer.close()
+            except ValueError:
+                pass
+            assert 'writing states failed' in sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,162 @@
+# -*- mode: python; coding: utf-8; -*-
+
+# test_sweep.py - Tests for parameter sweeps.
+
+from __future__ import division
+
+import argparse
+import copy
+import io
+import os.path
+import shutil
+import tempfile
+
+import selfingsim.sweep as sweep
+from selfingsim.test.helpers import Args
+from selfingsim.test.helpers import get_config
+from selfingsim.test.helpers import run
+from selfingsim.test.helpers import write_config
+
+
+class TestGrid:
+
+    def test_parse_axis(self):
+        """Axes are parsed into values of the type of their parameters."""
+        assert sweep.parse_axis('s*=0.1,0.5') == ('s*', [0.1, 0.5])
+        assert sweep.parse_axis('N=10,20') == ('N', [10, 20])
+        for text in ['unknown=1', 'N=10,x', 'N']:
+            try:
+                sweep.parse_axis(text)
+            except argparse.ArgumentTypeError:
+                pass
+            else:
+                assert False, text
+
+    def test_label(self):
+        """Labels are safe in file names."""
+        assert sweep.label('s*', 0.5) == 'sstar-0.5'
+        assert sweep.label('s tilde', 0.1) == 'stilde-0.1'
+
+    def test_expand(self):
+        """Points follow the grid in order without touching the base config."""
+        cobj = get_config('out.tsv')
+        base = copy.deepcopy(cobj)
+        axes = [('s*', [0.1, 0.5]), ('N', [10, 20, 30])]
+        points = list(sweep.expand(cobj, axes))
+
+        assert [values for _, values, _ in points] == \
+            [(0.1, 10), (0.1, 20), (0.1, 30), (0.5, 10), (0.5, 20), (0.5, 30)]
+        assert points[1][0] == 'sstar-0.1_N-20'
+        assert points[1][2]['population']['mating']['s*'] == 0.1
+        assert points[1][2]['population']['N'] == 20
+        assert cobj == base
+
+
+class TestManifest:
+
+    def test_round_trip(self):
+        """Rows written to a manifest are read back keyed by output files."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'manifest.tsv')
+            assert sweep.read_manifest(fname) == {}
+
+            rows = [{'point': 'N-{}'.format(n), 'replicate': 0, 'master': 1, 'seed': n,
+                     'status': 'done',
+                     'seconds': '1.000', 'outfile': 'out.{}.tsv'.format(n), 'values': [n]}
+                    for n in [10, 20]]
+            sweep.write_manifest(fname, ['N'], rows)
+            manifest = sweep.read_manifest(fname)
+            assert sorted(manifest) == ['out.10.tsv', 'out.20.tsv']
+            assert manifest['out.20.tsv'] == {
+                'point': 'N-20', 'replicate': '0', 'master': '1', 'seed': '20', 'status': 'done',
+                'seconds': '1.000', 'outfile': 'out.20.tsv', 'N': '20'}
+            assert not os.path.exists(fname + '.tmp')
+
+            # A manifest is replaced as a whole.
+            sweep.write_manifest(fname, ['N'], rows[:1])
+            assert sorted(sweep.read_manifest(fname)) == ['out.10.tsv']
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestSweep:
+
+    def test_resume(self):
+        """Existing output files are skipped unless the manifest marks them pending."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outfile = os.path.join(tmpdir, 'out.{}.{}.tsv')
+            config = write_config(tmpdir, get_config(outfile))
+            manifest = os.path.join(tmpdir, 'manifest.tsv')
+            done, pending, missing = [outfile.format('N-{}'.format(n), 0) for n in [10, 20, 30]]
+
+            for fname in [done, pending]:
+                with io.open(fname, 'w') as f:
+                    f.write('old')
+            sweep.write_manifest(manifest, ['N'], [
+                {'point': 'N-10', 'replicate': 0, 'master': 2, 'seed': 3, 'status': 'done',
+                 'seconds': '9.000', 'outfile': done, 'values': [10]},
+                {'point': 'N-20', 'replicate': 0, 'master': 1, 'seed': 0, 'status': 'pending',
+                 'seconds': '', 'outfile': pending, 'values': [20]}])
+
+            with io.open(config, 'r') as f:
+                args = Args(config=f, substs=[], axis=[('N', [10, 20, 30])], engine=None,
+                            burnin_cache=None, replicates=1, jobs=1, manifest=manifest)
+                assert run(sweep.sweep, args)[1] is None
+
+            with io.open(done, 'r') as f:
+                assert f.read() == 'old'
+            for fname in [pending, missing]:
+                with io.open(fname, 'r') as f:
+                    assert f.read() != 'old'
+            rows = sweep.read_manifest(manifest)
+            assert [rows[i]['status'] for i in [done, pending, missing]] == ['done'] * 3
+            assert rows[done]['seconds'] == '9.000'
+            assert (rows[done]['master'], rows[done]['seed']) == ('2', '3')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_shared_outfile(self):
+        """A sweep writing two simulations to one file names that file."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # Labels are cut short, so that N of 10 and 11 share a file but 20 does not.
+            outfile = os.path.join(tmpdir, 'out.{0:.3}.tsv')
+            config = write_config(tmpdir, get_config(outfile))
+
+            with io.open(config, 'r') as f:
+                args = Args(config=f, substs=[], axis=[('N', [20, 10, 11])], engine=None,
+                            burnin_cache=None, replicates=1, jobs=1,
+                            manifest=os.path.join(tmpdir, 'manifest.tsv'))
+                _, status = run(sweep.sweep, args)
+            assert '"{}"'.format(outfile.format('N-10')) in status
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_random_seed(self):
+        """A sweep without a seed reuses the master seed of its manifest when resumed."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outfile = os.path.join(tmpdir, 'out.{}.{}.tsv')
+            cobj = get_config(outfile)
+            del cobj['general']['seed']
+            config = write_config(tmpdir, cobj)
+            manifest = os.path.join(tmpdir, 'manifest.tsv')
+
+            seeds = []
+            for _ in range(2):
+                errors = []
+                with io.open(config, 'r') as f:
+                    args = Args(config=f, substs=[], axis=[('N', [10, 20])], engine=None,
+                                burnin_cache=None, replicates=1, jobs=1, manifest=manifest)
+                    assert run(sweep.sweep, args, errors)[1] is None
+                seeds.append(int(errors[0].split('master seed: ')[1]))
+                rows = sweep.read_manifest(manifest)
+                assert set(row['master'] for row in rows.values()) == set([str(seeds[-1])])
+                # Drop the output files, so that the second sweep runs again.
+                for fname in rows:
+                    os.remove(fname)
+            assert seeds[0] == seeds[1]
+        finally:
+            shutil.rmtree(tmpdir)
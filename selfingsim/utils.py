@@ -14,9 +14,14 @@ try:
 except NameError:
     pass
 
+import hashlib
 import os
+import random
 import sys
 
+# Upper bound (exclusive) of seeds.  Seeds must fit in numpy.random.RandomState.
+MAX_SEED = 2 ** 32 - 1
+
 def getnewlinechar(config):
     """
     Returns a new line character.
@@ -44,3 +49,51 @@ def getmode(mode):
         return mode + "b"
     else:
         return mode
+
+def random_seed():
+    """
+    Returns a random seed drawn from the operating system.
+    """
+    return random.SystemRandom().randint(1, MAX_SEED - 1)
+
+def derive_seed(master, *keys):
+    """
+    Derives a seed deterministically from a master seed and keys (e.g., a replicate).
+
+    Seeds of different keys are unrelated to each other, so that random number
+    streams seeded by them are effectively independent.
+    """
+    text = ":".join(str(i) for i in (master,) + keys)
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    # Zero is avoided as simuPOP takes it as a request for a random seed.
+    return int(digest, 16) % (MAX_SEED - 1) + 1
+
+def find_duplicate(values):
+    """
+    Returns the first value seen twice (None if all values are distinct).
+    """
+    seen = set()
+    for value in values:
+        if value in seen:
+            return value
+        seen.add(value)
+    return None
+
+def replace(src, dst):
+    """
+    Renames `src` to `dst`, replacing `dst` if it exists.
+
+    Python 2 lacks os.replace, and its os.rename fails on Windows if `dst`
+    exists.  There, a file `dst` is removed first, so the replacement is not
+    atomic.  A directory `dst` is never removed.
+    """
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+        return
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if not os.path.isfile(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
@@ -12,7 +12,7 @@ setup(description='A forward simulator for partially selfing population based on
       url='https://github.com/skumagai/selfingsim.git',
       author_email='seiji.kumagai@gmail.com',
       version=1.0,
-      install_requires=['nose'],
+      install_requires=['nose', 'numpy'],
       packages=['selfingsim'],
 #      scripts=['scripts/selfingsim'],
       entry_points={